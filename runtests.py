@@ -5,6 +5,8 @@ from os.path import dirname, abspath
 
 from django.conf import settings
 
+BENCHMARK = sys.argv[1:2] == ['benchmark']
+
 if not settings.configured:
     settings.configure(
         DATABASE_ENGINE='sqlite3',
@@ -12,6 +14,9 @@ if not settings.configured:
             'django.contrib.contenttypes',
             'taggit',
             'taggit.tests',
+            'taggit.contrib.synonyms',
+            'taggit.contrib.counts',
+            'taggit.contrib.suggest',
         ]
     )
 
@@ -20,12 +25,22 @@ from django.test.simple import run_tests
 
 def runtests(*test_args):
     if not test_args:
-        test_args = ['tests']
+        test_args = ['tests', 'counts', 'suggest']
     parent = dirname(abspath(__file__))
     sys.path.insert(0, parent)
     failures = run_tests(test_args, verbosity=1, interactive=True)
     sys.exit(failures)
 
 
+def runbenchmarks(*args):
+    parent = dirname(abspath(__file__))
+    sys.path.insert(0, parent)
+    from django.core.management import execute_from_command_line
+    execute_from_command_line([sys.argv[0], 'taggit_benchmark'] + list(args))
+
+
 if __name__ == '__main__':
-    runtests(*sys.argv[1:])
+    if BENCHMARK:
+        runbenchmarks(*sys.argv[2:])
+    else:
+        runtests(*sys.argv[1:])
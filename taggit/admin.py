@@ -30,12 +30,10 @@ class TagAdminForm(forms.ModelForm):
 
         # synonyms cannot be topic names
         if 'taggit.contrib.synonyms' in settings.INSTALLED_APPS:
-            from taggit.contrib.synonyms.models import TagSynonym
-            try:
-                synonym = TagSynonym.objects.get(name=name)
-                raise forms.ValidationError("this tag is not allowed, it is already a synonym of tag = %s" % synonym.tag.name)
-            except TagSynonym.DoesNotExist:
-                pass 
+            from taggit.contrib.synonyms.models import synonym_map
+            synonyms = synonym_map.get()
+            if name in synonyms:
+                raise forms.ValidationError("this tag is not allowed, it is already a synonym of tag = %s" % synonyms[name])
 
         return name
 
@@ -0,0 +1,98 @@
+"""
+Benchmarks of taggit's most used operations, against a synthetic dataset
+built from the models of ``taggit.tests``.
+
+Each operation is run a number of times to fill the caches, and then as
+many times again to be measured; the most queries of a run and the median
+time are recorded and compared with a budget.
+Run them with ``manage.py taggit_benchmark`` or ``runtests.py benchmark``.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from taggit.benchmarks.cases import CASES
+from taggit.benchmarks.dataset import Scale, seed
+
+
+# The most queries each operation may take at the default scale, with
+# taggit.contrib.counts installed, which adds queries to the writes.
+BUDGETS = {
+    "add": {"queries": 9},
+    "set": {"queries": 13},
+    "remove": {"queries": 4},
+    "similar_objects": {"queries": 3},
+    "most_common": {"queries": 1},
+    "parse_tags": {"queries": 0},
+    "suggest_tags": {"queries": 1},
+    "tags__in": {"queries": 1},
+    "tagged_object_list": {"queries": 3},
+}
+
+
+def measure(func):
+    """
+    Returns the number of queries ``func`` makes and the seconds it takes.
+    """
+    old_debug = settings.DEBUG
+    settings.DEBUG = True
+    start = len(connection.queries)
+    try:
+        started = time.time()
+        func()
+        return len(connection.queries) - start, time.time() - started
+    finally:
+        settings.DEBUG = old_debug
+
+def run(scale=None, repeat=5, names=None):
+    """
+    Seeds the database for ``scale`` and runs the cases called ``names``,
+    or all of them, ``repeat`` times each.  Returns a dict of results by
+    case name.
+    """
+    data = seed(scale or Scale())
+    results = {}
+    for name, case in CASES:
+        if names and name not in names:
+            continue
+        queries = []
+        times = []
+        # A first round, left out, fills the caches for every model.
+        for i in xrange(repeat, repeat + max(repeat, len(data.models))):
+            func = case(data, i)
+            if func is not None:
+                func()
+        for i in xrange(repeat):
+            func = case(data, i)
+            if func is None:
+                break
+            n, seconds = measure(func)
+            queries.append(n)
+            times.append(seconds)
+        if not times:
+            continue
+        times.sort()
+        results[name] = {
+            "queries": max(queries),
+            "seconds": times[len(times) // 2],
+            "min_seconds": times[0],
+            "max_seconds": times[-1],
+        }
+    return results
+
+def check_budgets(results, budgets=BUDGETS):
+    """
+    Returns a description of each result over its budget.  A budget may
+    limit ``queries`` and ``seconds``.
+    """
+    failures = []
+    for name in sorted(budgets):
+        if name not in results:
+            continue
+        for key in ("queries", "seconds"):
+            limit = budgets[name].get(key)
+            if limit is not None and results[name][key] > limit:
+                failures.append("%s took %s %s, over its budget of %s." % (
+                    name, results[name][key], key, limit))
+    return failures
@@ -0,0 +1,81 @@
+"""
+The operations benchmarked.  Each case takes the ``Dataset`` and the number
+of the run, does any preparation that shouldn't be timed, and returns the
+function to time, or ``None`` if it can't run in this installation.
+"""
+from django.conf import settings
+from django.http import HttpRequest, QueryDict
+
+from taggit.utils import parse_tags
+from taggit.views import tagged_object_list
+
+
+def _sample_names(data, n):
+    return [tag.name for tag in data.random.sample(data.tags,
+        min(n, len(data.tags)))]
+
+def bench_add(data, i):
+    obj = data.get_object()
+    names = _sample_names(data, 3) + ["new %d %d" % (i, n) for n in xrange(2)]
+    return lambda: obj.tags.add(*names)
+
+def bench_set(data, i):
+    obj = data.get_object()
+    names = _sample_names(data, 4) + ["set %d" % i]
+    return lambda: obj.tags.set(*names)
+
+def bench_remove(data, i):
+    obj = data.get_object()
+    names = [tag.name for tag in obj.tags.all()][:2]
+    return lambda: obj.tags.remove(*names)
+
+def bench_similar_objects(data, i):
+    obj = data.get_object()
+    return lambda: obj.tags.similar_objects(limit=10)
+
+def bench_most_common(data, i):
+    model = data.models[i % len(data.models)]
+    return lambda: list(model.tags.most_common()[:20])
+
+def bench_parse_tags(data, i):
+    names = _sample_names(data, 20)
+    strings = []
+    for n in xrange(0, len(names), 4):
+        strings.append(", ".join(names[n:n + 4]))
+        strings.append(" ".join(['"%s"' % name for name in names[n:n + 4]]))
+    return lambda: [parse_tags(s) for s in strings * 10]
+
+def bench_suggest_tags(data, i):
+    if "taggit.contrib.suggest" not in settings.INSTALLED_APPS:
+        return None
+    from taggit.contrib.suggest.utils import suggest_tags
+    words = ["keyword%d" % data.random.randrange(60) for n in xrange(20)]
+    content = " lorem ipsum ".join(words) * 10
+    return lambda: list(suggest_tags(content))
+
+def bench_tags_in(data, i):
+    model = data.models[i % len(data.models)]
+    tags = data.random.sample(data.tags, min(3, len(data.tags)))
+    return lambda: list(model._default_manager.filter(tags__in=tags).distinct())
+
+def bench_tagged_object_list(data, i):
+    model = data.models[0]
+    tag = data.tags[i % len(data.tags)]
+    request = HttpRequest()
+    request.method = "GET"
+    request.GET = QueryDict("")
+    return lambda: tagged_object_list(request, tag.slug,
+        model._default_manager.all(), paginate_by=20,
+        template_name="tests/food_list.html")
+
+CASES = (
+    ("add", bench_add),
+    ("set", bench_set),
+    ("remove", bench_remove),
+    ("similar_objects", bench_similar_objects),
+    ("most_common", bench_most_common),
+    ("parse_tags", bench_parse_tags),
+    ("suggest_tags", bench_suggest_tags),
+    ("tags__in", bench_tags_in),
+    ("tagged_object_list", bench_tagged_object_list),
+)
@@ -0,0 +1,97 @@
+"""
+The synthetic data the benchmarks run against, built from the models of
+``taggit.tests``.
+"""
+import random
+
+from django.conf import settings
+
+from taggit.bulk import BATCH_SIZE, add_links, get_through
+from taggit.models import Tag
+from taggit.tests.models import Food, Pet, DirectFood, DirectPet
+from taggit.utils import bulk_insert
+
+
+# Generic and custom through models alternate, so both are measured as soon
+# as there are two content types.
+MODELS = (Food, DirectFood, Pet, DirectPet)
+
+
+class Scale(object):
+    def __init__(self, objects=1000, tags=200, tags_per_object=5,
+        content_types=2, seed=0):
+        if not 1 <= content_types <= len(MODELS):
+            raise ValueError("content_types must be from 1 to %d." %
+                len(MODELS))
+        if tags_per_object > tags:
+            raise ValueError("tags_per_object can't be more than tags.")
+        self.objects = objects
+        self.tags = tags
+        self.tags_per_object = tags_per_object
+        self.content_types = content_types
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class Dataset(object):
+    """
+    The objects and tags created for a ``Scale``.  ``objects`` maps each
+    model to the primary keys of its objects.
+    """
+    def __init__(self, scale, models, objects, tags):
+        self.scale = scale
+        self.models = models
+        self.objects = objects
+        self.tags = tags
+        self.random = random.Random(scale.seed)
+
+    def get_object(self, model=None):
+        model = model or self.models[0]
+        return model._default_manager.get(
+            pk=self.random.choice(self.objects[model]))
+
+def _pick_tags(rng, tag_ids, n):
+    # Skewed towards the first tags, so some are much more popular than
+    # others, as on real sites.
+    picked = set()
+    while len(picked) < n:
+        picked.add(tag_ids[int(len(tag_ids) * rng.random() ** 2)])
+    return picked
+
+def seed(scale):
+    """
+    Creates ``scale.tags`` tags and ``scale.objects`` objects, spread over
+    ``scale.content_types`` models, each with ``scale.tags_per_object``
+    tags.  Returns the ``Dataset``.
+    """
+    rng = random.Random(scale.seed)
+    names = ["tag %d" % i for i in xrange(scale.tags)]
+    tags = []
+    for i in xrange(0, len(names), BATCH_SIZE):
+        tags.extend(Tag.objects.get_or_create_many(names[i:i + BATCH_SIZE]))
+    tags.sort(key=lambda tag: int(tag.name.split()[1]))
+    tag_ids = [tag.pk for tag in tags]
+
+    models = MODELS[:scale.content_types]
+    objects = {}
+    for n, model in enumerate(models):
+        count = scale.objects // len(models)
+        if n < scale.objects % len(models):
+            count += 1
+        bulk_insert(model, [model(name="%s %d" % (model._meta.object_name, i))
+            for i in xrange(count)])
+        pks = list(model._default_manager.order_by("pk").values_list("pk",
+            flat=True))
+        objects[model] = pks
+        through = get_through(model)
+        for i in xrange(0, len(pks), BATCH_SIZE):
+            add_links(through, [(model(pk=pk), _pick_tags(rng, tag_ids,
+                scale.tags_per_object)) for pk in pks[i:i + BATCH_SIZE]])
+
+    if "taggit.contrib.suggest" in settings.INSTALLED_APPS:
+        from taggit.contrib.suggest.models import TagKeyword
+        for i, tag in enumerate(tags[:50]):
+            TagKeyword.objects.create(tag=tag, keyword="keyword%d" % i)
+    return Dataset(scale, models, objects, tags)
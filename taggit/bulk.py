@@ -0,0 +1,231 @@
+"""
+Tagging many objects at once, with a fixed number of queries per batch of
+objects rather than per object.
+"""
+import django
+from django.db import transaction, IntegrityError
+from django.db.models.query import QuerySet
+
+from taggit.cache import invalidate_tags
+from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
+from taggit.utils import bulk_insert, update_tag_counts
+
+
+# Keeps the ids in a query below SQLite's limit on query parameters.
+BATCH_SIZE = 500
+
+
+def get_through(model, name=None):
+    """
+    Returns the through model of the ``TaggableManager`` of ``model`` called
+    ``name``, or of its first one.  Models without one can still be tagged
+    through ``TaggedItem``.
+    """
+    for field in model._meta.many_to_many:
+        if isinstance(field, TaggableManager) and name in (None, field.name):
+            return field.through
+    if name is not None:
+        raise ValueError("%s has no TaggableManager called %s." % (
+            model._meta.object_name, name))
+    return TaggedItem
+
+def in_bulk(model, pks):
+    """
+    Like ``in_bulk()`` on ``model``'s default manager, for any number of
+    primary keys.
+    """
+    pks = list(pks)
+    objects = {}
+    for i in xrange(0, len(pks), BATCH_SIZE):
+        objects.update(model._default_manager.in_bulk(pks[i:i + BATCH_SIZE]))
+    return objects
+
+def _trans_kwargs(through):
+    if django.VERSION >= (1, 2):
+        from django.db import router
+        using = router.db_for_write(through)
+        return using, {"using": using}
+    return None, {}
+
+def _existing_links(through, objs):
+    attname = through.object_id_attname()
+    existing = set()
+    for i in xrange(0, len(objs), BATCH_SIZE):
+        existing.update(through.objects.filter(
+            **through.bulk_lookup_kwargs(objs[i:i + BATCH_SIZE])
+        ).values_list(attname, "tag"))
+    return existing
+
+def missing_links(through, pairs):
+    """
+    Takes ``(obj, tag_ids)`` pairs, all objects of one model, and returns
+    the ``(obj, tag_id)`` links among them that ``through`` doesn't have yet.
+    """
+    pairs = [(obj, set(tag_ids)) for obj, tag_ids in pairs if tag_ids]
+    if not pairs:
+        return []
+    existing = _existing_links(through, [obj for obj, tag_ids in pairs])
+    links = []
+    for obj, tag_ids in pairs:
+        for tag_id in sorted(tag_ids):
+            if (obj.pk, tag_id) not in existing:
+                # An object may come up in more than one pair.
+                existing.add((obj.pk, tag_id))
+                links.append((obj, tag_id))
+    return links
+
+def add_links(through, pairs):
+    """
+    Links each object of the ``(obj, tag_ids)`` pairs, all of one model, to
+    its tags through ``through``, skipping the links that already exist.
+    The objects only need their primary key set.  Returns the number of
+    links added.
+    """
+    links = missing_links(through, pairs)
+    if not links:
+        return 0
+    using, trans_kwargs = _trans_kwargs(through)
+    sid = transaction.savepoint(**trans_kwargs)
+    try:
+        bulk_insert(through, [through(tag_id=tag_id, **through.lookup_kwargs(obj))
+            for obj, tag_id in links], using=using)
+    except IntegrityError:
+        # Some of the links were added concurrently.
+        transaction.savepoint_rollback(sid, **trans_kwargs)
+        added = []
+        for obj, tag_id in links:
+            _, created = through.objects.get_or_create(tag__pk=tag_id,
+                defaults={"tag_id": tag_id}, **through.lookup_kwargs(obj))
+            if created:
+                added.append((obj, tag_id))
+        links = added
+    else:
+        transaction.savepoint_commit(sid, **trans_kwargs)
+    _update_counts(through, links, 1)
+    invalidate_tags(through, [obj for obj, tag_id in links])
+    return len(links)
+
+def _update_counts(through, links, delta):
+    if not links:
+        return
+    uses = {}
+    for obj, tag_id in links:
+        uses[tag_id] = uses.get(tag_id, 0) + 1
+    by_uses = {}
+    for tag_id, n in uses.iteritems():
+        by_uses.setdefault(n, []).append(tag_id)
+    model = links[0][0]
+    for n, tag_ids in by_uses.iteritems():
+        update_tag_counts(through, model, tag_ids, n * delta)
+
+def _in_transaction(through, func, *args):
+    using, trans_kwargs = _trans_kwargs(through)
+    if trans_kwargs:
+        func = transaction.commit_on_success(**trans_kwargs)(func)
+    else:
+        func = transaction.commit_on_success(func)
+    return func(*args)
+
+def _object_chunks(objects, chunk_size):
+    """
+    Yields ``objects``, a queryset or a sequence of model instances, as lists
+    of at most ``chunk_size`` instances of one model.  Only the primary keys
+    of a queryset's objects are read, ``chunk_size`` at a time.
+    """
+    if isinstance(objects, QuerySet) and not objects.query.can_filter():
+        # A sliced queryset can't be paged through any further.
+        model = objects.model
+        objects = [model(pk=pk) for pk in objects.values_list("pk", flat=True)]
+    elif isinstance(objects, QuerySet):
+        model = objects.model
+        qs = objects.order_by("pk").values_list("pk", flat=True)
+        after = None
+        while True:
+            chunk_qs = qs
+            if after is not None:
+                chunk_qs = qs.filter(pk__gt=after)
+            pks = list(chunk_qs[:chunk_size])
+            if not pks:
+                return
+            yield [model(pk=pk) for pk in pks]
+            if len(pks) < chunk_size:
+                return
+            after = pks[-1]
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(obj.__class__, []).append(obj)
+    for objs in by_model.itervalues():
+        for i in xrange(0, len(objs), chunk_size):
+            yield objs[i:i + chunk_size]
+
+def _tag_ids(tags, create):
+    tag_ids = set([tag.pk for tag in tags if isinstance(tag, Tag)])
+    names = list(set([tag for tag in tags if not isinstance(tag, Tag)]))
+    for i in xrange(0, len(names), BATCH_SIZE):
+        if create:
+            tag_ids.update([tag.pk for tag in
+                Tag.objects.get_or_create_many(names[i:i + BATCH_SIZE])])
+        else:
+            tag_ids.update(Tag.objects.filter(name__in=names[i:i + BATCH_SIZE]
+                ).values_list("pk", flat=True))
+    return sorted(tag_ids)
+
+def tag_objects(objects, tags, through=None, chunk_size=BATCH_SIZE):
+    """
+    Tags each of ``objects``, a queryset or a sequence of model instances,
+    with ``tags``, ``Tag`` objects or names, creating the tags that don't
+    exist yet.  The objects are linked through ``through``, or the through
+    model of their model's first ``TaggableManager``.
+
+    The objects are tagged ``chunk_size`` at a time, each chunk in its own
+    transaction with one query for the links it already has and one insert
+    of the rest.  Returns the number of links added.
+    """
+    tag_ids = _tag_ids(tags, True)
+    added = 0
+    if not tag_ids:
+        return added
+    for objs in _object_chunks(objects, chunk_size):
+        chunk_through = through or get_through(objs[0].__class__)
+        added += _in_transaction(chunk_through, add_links, chunk_through,
+            [(obj, tag_ids) for obj in objs])
+    return added
+
+def remove_links(through, objs, tag_ids):
+    """
+    Unlinks ``objs``, all of one model, from the tags ``tag_ids`` through
+    ``through``.  Returns the number of links removed.
+    """
+    attname = through.object_id_attname()
+    links = []
+    for i in xrange(0, len(objs), BATCH_SIZE):
+        links.extend(through.objects.filter(tag__in=tag_ids,
+            **through.bulk_lookup_kwargs(objs[i:i + BATCH_SIZE])
+        ).values_list("pk", attname, "tag"))
+    if not links:
+        return 0
+    by_pk = dict([(obj.pk, obj) for obj in objs])
+    link_pks = [pk for pk, object_id, tag_id in links]
+    for i in xrange(0, len(link_pks), BATCH_SIZE):
+        through.objects.filter(pk__in=link_pks[i:i + BATCH_SIZE]).delete()
+    links = [(by_pk[object_id], tag_id) for pk, object_id, tag_id in links]
+    _update_counts(through, links, -1)
+    invalidate_tags(through, [obj for obj, tag_id in links])
+    return len(links)
+
+def untag_objects(objects, tags, through=None, chunk_size=BATCH_SIZE):
+    """
+    Removes ``tags``, ``Tag`` objects or names, from each of ``objects``, a
+    queryset or a sequence of model instances, a chunk at a time like
+    ``tag_objects()``.  Returns the number of links removed.
+    """
+    tag_ids = _tag_ids(tags, False)
+    removed = 0
+    if not tag_ids:
+        return removed
+    for objs in _object_chunks(objects, chunk_size):
+        chunk_through = through or get_through(objs[0].__class__)
+        removed += _in_transaction(chunk_through, remove_links, chunk_through,
+            objs, tag_ids)
+    return removed
@@ -0,0 +1,314 @@
+"""
+Process wide caches for values taggit derives from whole tables, such as the
+synonym map, invalidated through model signals.
+
+Where the values live is picked by the ``TAGGIT_CACHE_BACKEND`` setting, the
+dotted path of a backend class.  ``DjangoCacheBackend`` keeps them in Django's
+cache framework, where all processes share them and their invalidations.
+``LocalBackend`` keeps them in the memory of each process, so an invalidation
+is only seen by the process that made the change, and the other processes
+only reload a value once it expires.  Without the setting,
+``DjangoCacheBackend`` is used if Django's cache is shared between processes,
+and ``LocalBackend`` otherwise.
+
+The tags of single objects are kept in Django's cache for the
+``TaggableManager`` fields created with ``cache=True``; see ``TagsCache``.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import get_callable
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+
+
+class LocalBackend(object):
+    """
+    Keeps values in the memory of the process for
+    ``TAGGIT_LOCAL_CACHE_TIMEOUT`` seconds, 300 by default, and at most
+    ``TAGGIT_LOCAL_CACHE_MAX_ENTRIES`` of them, 1000 by default; when it's
+    full the third that expire first are dropped.
+    """
+    def __init__(self):
+        self._values = {}
+        self.timeout = getattr(settings, "TAGGIT_LOCAL_CACHE_TIMEOUT", 300)
+        self.max_entries = getattr(settings, "TAGGIT_LOCAL_CACHE_MAX_ENTRIES",
+            1000)
+
+    def get(self, key, loader, shared=True):
+        now = time.time()
+        try:
+            expires, value = self._values[key]
+            if expires > now:
+                return value
+        except KeyError:
+            pass
+        value = loader()
+        if key not in self._values and len(self._values) >= self.max_entries:
+            self._cull()
+        self._values[key] = (now + self.timeout, value)
+        return value
+
+    def _cull(self):
+        by_expiry = sorted(self._values.items(), key=lambda item: item[1][0])
+        for key, entry in by_expiry[:max(len(by_expiry) // 3, 1)]:
+            self._values.pop(key, None)
+
+    def invalidate(self, key):
+        self._values.pop(key, None)
+
+
+class DjangoCacheBackend(object):
+    """
+    Stores a version token for every key in Django's cache.  Values are
+    stored next to it under a key that includes the token, and memoized in
+    the process, so the steady state costs one cache lookup.  Invalidating
+    replaces the token.
+
+    Values created with ``shared=False``, such as compiled matchers that
+    are costly to pickle, are only memoized in the process; just their
+    version is shared.  At most ``TAGGIT_LOCAL_CACHE_MAX_ENTRIES`` values
+    are memoized.
+    """
+    def __init__(self):
+        self._values = {}
+        self.max_entries = getattr(settings, "TAGGIT_LOCAL_CACHE_MAX_ENTRIES",
+            1000)
+
+    def _cache(self):
+        from django.core.cache import cache
+        return cache
+
+    def _new_version(self):
+        return _new_version()
+
+    def _version_key(self, key):
+        return "%s:version" % key
+
+    def get(self, key, loader, shared=True):
+        cache = self._cache()
+        version_key = self._version_key(key)
+        version = cache.get(version_key)
+        if version is None:
+            cache.add(version_key, self._new_version())
+            version = cache.get(version_key)
+        try:
+            memo_version, value = self._values[key]
+            if memo_version == version:
+                return value
+        except KeyError:
+            pass
+        value = None
+        if shared:
+            value = cache.get("%s:%s" % (key, version))
+        if value is None:
+            value = loader()
+            if shared:
+                cache.set("%s:%s" % (key, version), value)
+        if key not in self._values and len(self._values) >= self.max_entries:
+            # The memo only saves fetching from the cache, so any will do.
+            for old_key in self._values.keys()[:max(self.max_entries // 3, 1)]:
+                self._values.pop(old_key, None)
+        self._values[key] = (version, value)
+        return value
+
+    def invalidate(self, key):
+        self._values.pop(key, None)
+        self._cache().set(self._version_key(key), self._new_version())
+
+
+_backends = {}
+
+def _default_backend():
+    """
+    ``DjangoCacheBackend`` if Django's cache is shared between processes,
+    otherwise ``LocalBackend``.
+    """
+    caches = getattr(settings, "CACHES", None)
+    if caches:
+        backend = caches.get("default", {}).get("BACKEND", "")
+    else:
+        backend = getattr(settings, "CACHE_BACKEND", "")
+    backend = backend.lower()
+    if not backend or "locmem" in backend or "dummy" in backend:
+        return "taggit.cache.LocalBackend"
+    return "taggit.cache.DjangoCacheBackend"
+
+def get_backend():
+    path = getattr(settings, "TAGGIT_CACHE_BACKEND", None) or _default_backend()
+    try:
+        return _backends[path]
+    except KeyError:
+        backend = _backends[path] = get_callable(path)()
+        return backend
+
+
+class CachedValue(object):
+    """
+    A value computed by ``loader`` the first time it's needed and kept in the
+    configured backend until ``invalidate()`` is called.  ``invalidate``
+    accepts any keyword arguments, so it can be connected to signals
+    directly.
+    """
+    def __init__(self, key, loader, shared=True):
+        self.key = key
+        self.loader = loader
+        self.shared = shared
+
+    def get(self):
+        return get_backend().get(self.key, self.loader, self.shared)
+
+    def invalidate(self, **kwargs):
+        get_backend().invalidate(self.key)
+
+
+def _new_version():
+    return "%x%x" % (int(time.time() * 1000), random.getrandbits(32))
+
+def _django_cache():
+    from django.core.cache import cache
+    return cache
+
+def _timeout():
+    return getattr(settings, "TAGGIT_TAGS_CACHE_TIMEOUT", None)
+
+def _key_prefix():
+    return getattr(settings, "TAGGIT_TAGS_CACHE_PREFIX", "taggit.tags")
+
+def _content_type_id(through, model=None):
+    from taggit.models import TaggedItem
+    from taggit.utils import get_content_type
+    if issubclass(through, TaggedItem):
+        return get_content_type(model).pk
+    # A custom through model only ever links one model.
+    return get_content_type(
+        through._meta.get_field_by_name("content_object")[0].rel.to).pk
+
+
+class TagsCache(object):
+    """
+    The tags of one object in Django's cache, for ``TaggableManager(cache=True)``.
+
+    The tags are stored under a key holding the object's version token.
+    Every change to the object's tags deletes the token, so tags read from
+    the database before a change are never stored where a later reader
+    would look for them.
+    """
+    def __init__(self, through, content_type_id, object_id):
+        self.key = "%s:%s:%s:%s" % (_key_prefix(), through._meta.db_table,
+            content_type_id, md5_constructor(smart_str(object_id)).hexdigest())
+        self.version_key = "%s:version" % self.key
+        self.version = None
+
+    @classmethod
+    def for_instance(cls, through, instance):
+        return cls(through, _content_type_id(through, instance), instance.pk)
+
+    def get(self):
+        """
+        Returns the cached tags, or ``None`` if they have to be read from
+        the database.
+        """
+        cache = _django_cache()
+        self.version = cache.get(self.version_key)
+        if self.version is None:
+            cache.add(self.version_key, _new_version(), _timeout())
+            self.version = cache.get(self.version_key)
+            return None
+        rows = cache.get("%s:%s" % (self.key, self.version))
+        if rows is None:
+            return None
+        from taggit.models import Tag
+        return [Tag(pk=pk, name=name, slug=slug) for pk, name, slug in rows]
+
+    def set(self, tags):
+        """
+        Stores ``tags``, read after the last ``get()``.
+        """
+        if self.version is None:
+            return
+        _django_cache().set("%s:%s" % (self.key, self.version),
+            [(tag.pk, tag.name, tag.slug) for tag in tags], _timeout())
+
+
+_cached_throughs = set()
+
+def _delete_versions(keys):
+    keys = list(set(keys))
+    if not keys:
+        return
+    cache = _django_cache()
+    if hasattr(cache, "delete_many"):
+        cache.delete_many(keys)
+    else:
+        for key in keys:
+            cache.delete(key)
+
+def invalidate_tags(through, objs):
+    """
+    Throws away the cached tags of ``objs``, whose links through
+    ``through`` changed.  Does nothing unless a ``TaggableManager`` with
+    ``cache=True`` uses ``through``.
+    """
+    if through not in _cached_throughs:
+        return
+    _delete_versions([TagsCache.for_instance(through, obj).version_key
+        for obj in objs])
+
+def invalidate_links(through, links):
+    """
+    Like ``invalidate_tags()``, for the objects given as ``(content_type_id,
+    object_id)`` pairs.
+    """
+    if through not in _cached_throughs:
+        return
+    keys = []
+    for ct_id, object_id in links:
+        keys.append(TagsCache(through, ct_id, object_id).version_key)
+        if len(keys) >= 500:
+            _delete_versions(keys)
+            keys = []
+    _delete_versions(keys)
+
+def _link_changed(sender, instance, **kwargs):
+    from taggit.models import TaggedItem
+    if issubclass(sender, TaggedItem):
+        ct_id = instance.content_type_id
+    else:
+        ct_id = _content_type_id(sender)
+    _delete_versions([TagsCache(sender, ct_id,
+        getattr(instance, sender.object_id_attname())).version_key])
+
+def _tag_changed(sender, instance, created=False, **kwargs):
+    # A renamed tag is stale in the cached tags of all of its objects.
+    if created:
+        return
+    from taggit.models import TaggedItem
+    for through in _cached_throughs:
+        attname = through.object_id_attname()
+        qs = through.objects.filter(tag=instance)
+        if issubclass(through, TaggedItem):
+            links = qs.values_list("content_type", attname)
+        else:
+            ct_id = _content_type_id(through)
+            links = [(ct_id, object_id)
+                for object_id in qs.values_list(attname, flat=True)]
+        invalidate_links(through, links)
+
+def cache_tags(through):
+    """
+    Keeps the cached tags of the objects linked through ``through`` up to
+    date when links are saved or deleted one at a time, or a tag is renamed.
+    """
+    from taggit.models import Tag
+    if through in _cached_throughs:
+        return
+    _cached_throughs.add(through)
+    post_save.connect(_link_changed, sender=through,
+        dispatch_uid="taggit.cache.tags")
+    post_delete.connect(_link_changed, sender=through,
+        dispatch_uid="taggit.cache.tags")
+    post_save.connect(_tag_changed, sender=Tag,
+        dispatch_uid="taggit.cache.tags")
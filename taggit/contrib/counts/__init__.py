@@ -0,0 +1 @@
+'''counts app - keeps the number of uses of each tag per content type'''
@@ -0,0 +1,12 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from taggit.contrib.counts.utils import rebuild_counts
+
+
+class Command(NoArgsCommand):
+    help = "Recounts the uses of every tag from the tagged items."
+
+    def handle_noargs(self, **options):
+        count = transaction.commit_on_success(rebuild_counts)()
+        return "Stored %d tag counts." % count
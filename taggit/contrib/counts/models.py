@@ -0,0 +1,81 @@
+'''models for counts app'''
+import threading
+
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db.models.signals import post_delete, pre_delete
+
+from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem, TaggedItemBase
+
+
+class TagCount(models.Model):
+    """Number of objects of a content type tagged with a tag"""
+    tag = models.ForeignKey(Tag, related_name='counts')
+    content_type = models.ForeignKey(ContentType, related_name='tag_counts')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('content_type', 'tag'),)
+
+    def __unicode__(self):
+        return u"%s: %s x %d" % (self.content_type, self.tag, self.count)
+
+
+def object_deleted(sender, instance, **kwargs):
+    '''the links of a deleted object are deleted without going through its
+    TaggableManager, so count them down here'''
+    from taggit.contrib.counts.utils import update_counts
+    for field in instance._meta.many_to_many:
+        if isinstance(field, TaggableManager) and instance.pk is not None:
+            through = field.through
+            # Deleting a subclass's object sends pre_delete for its parent
+            # row too, and a custom through model links them both; only the
+            # linked model's row counts.
+            if not issubclass(through, TaggedItem):
+                linked = through._meta.get_field_by_name('content_object')[0]
+                if instance.__class__ is not linked.rel.to:
+                    continue
+                if django.VERSION < (1, 2):
+                    update_counts(through, instance,
+                        _pending_tag_ids(through, instance.pk), -1)
+                    continue
+            tag_ids = through.objects.filter(
+                **through.lookup_kwargs(instance)).values_list("tag", flat=True)
+            update_counts(through, instance, list(tag_ids), -1)
+
+pre_delete.connect(object_deleted, dispatch_uid="taggit.contrib.counts.object_deleted")
+
+
+# Django 1.1 deletes the links of a custom through model before it sends
+# pre_delete for the object they link, so there they're remembered from
+# their own pre_delete until their post_delete.
+_pending = threading.local()
+
+def _pending_links():
+    if not hasattr(_pending, 'links'):
+        _pending.links = {}
+    return _pending.links
+
+def _pending_tag_ids(through, object_id):
+    links = _pending_links()
+    tag_ids = []
+    for key, (link_object_id, tag_id) in links.items():
+        if key[0] is through and link_object_id == object_id:
+            # Counted now, so not again when the link's post_delete comes.
+            del links[key]
+            tag_ids.append(tag_id)
+    return tag_ids
+
+def link_deleting(sender, instance, **kwargs):
+    if issubclass(sender, TaggedItemBase) and not issubclass(sender, TaggedItem):
+        _pending_links()[(sender, instance.pk)] = (
+            getattr(instance, sender.object_id_attname()), instance.tag_id)
+
+def link_deleted(sender, instance, **kwargs):
+    _pending_links().pop((sender, instance.pk), None)
+
+if django.VERSION < (1, 2):
+    pre_delete.connect(link_deleting, dispatch_uid="taggit.contrib.counts.link_deleting")
+    post_delete.connect(link_deleted, dispatch_uid="taggit.contrib.counts.link_deleted")
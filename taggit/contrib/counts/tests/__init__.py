@@ -0,0 +1 @@
+from taggit.contrib.counts.tests.tests import TestCounts, TestDirectCounts
@@ -0,0 +1,9 @@
+DATABASE_ENGINE = 'sqlite3'
+
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'taggit',
+    'taggit.tests',
+    'taggit.contrib.synonyms',
+    'taggit.contrib.counts',
+]
@@ -0,0 +1,169 @@
+'''tests for counts app'''
+import sys
+from StringIO import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import TestCase
+
+from taggit.bulk import get_through
+from taggit.contrib.counts.models import TagCount
+from taggit.contrib.counts.utils import update_counts
+from taggit.gc import delete_dangling_links, delete_links_on_delete
+from taggit.models import Tag, TaggedItem
+from taggit.ops import merge_tags
+from taggit.utils import get_content_type
+from taggit.tests.models import (Food, Pet, HousePet, DirectFood, DirectPet,
+    DirectHousePet, TaggedPet)
+
+
+class TestCounts(TestCase):
+    '''test the counts are kept up to date'''
+    food_model = Food
+
+    def counts(self):
+        return dict([(c.tag.name, c.count) for c in TagCount.objects.filter(
+            content_type__model=self.food_model._meta.module_name)])
+
+    def test_counts(self):
+        '''verify add, set, remove, clear and delete keep counts'''
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("red", "green")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("green", "green")
+        self.assertEquals(self.counts(), {"red": 1, "green": 2})
+
+        pear.tags.set("green", "juicy")
+        apple.tags.remove("red")
+        self.assertEquals(self.counts(), {"red": 0, "green": 2, "juicy": 1})
+        pear.tags.clear()
+        self.assertEquals(self.counts(), {"red": 0, "green": 1, "juicy": 0})
+        pear.tags.add("juicy")
+        apple.delete()
+        self.assertEquals(self.counts(), {"red": 0, "green": 0, "juicy": 1})
+
+    def test_delete_subclass(self):
+        '''verify deleting a subclass's object counts its links down once'''
+        pets = [DirectPet.objects.create(name="rex"),
+            DirectHousePet.objects.create(name="cat", trained=True),
+            DirectHousePet.objects.create(name="dog", trained=True)]
+        for pet in pets:
+            pet.tags.add("fuzzy")
+        pets[1].delete()
+        self.assertEquals(TagCount.objects.get(tag__name="fuzzy",
+            content_type=get_content_type(DirectPet)).count, 2)
+        self.assertEquals(TaggedPet.objects.filter(tag__name="fuzzy").count(),
+            2)
+
+    def test_reads(self):
+        '''verify the model level manager reads from the counts'''
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("red", "green")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("green")
+        pear.tags.remove("green")
+        pear.tags.add("green", "sweet")
+        self.assertEquals([(t.name, t.num_times) for t in
+            self.food_model.tags.most_common()][0], ("green", 2))
+        self.assertEquals(sorted([t.name for t in self.food_model.tags.all()]),
+            ["green", "red", "sweet"])
+        # Only the counts are read.
+        TagCount.objects.filter(tag__name="red").update(count=0)
+        self.assertEquals(sorted([t.name for t in self.food_model.tags.all()]),
+            ["green", "sweet"])
+
+    def test_rebuild(self):
+        '''verify counts are rebuilt from the tagged items'''
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("red", "green")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("green")
+        kitty = Pet.objects.create(name="kitty")
+        kitty.tags.add("green")
+        cat = HousePet.objects.create(name="cat", trained=True)
+        cat.tags.add("green")
+        expected = set(TagCount.objects.filter(count__gt=0).values_list(
+            "content_type", "tag", "count"))
+        # A link left behind by a deleted object isn't counted.
+        TaggedItem.objects.create(tag=Tag.objects.get(name="green"),
+            content_type=get_content_type(Pet), object_id=kitty.pk + 100)
+        TagCount.objects.all().delete()
+        TagCount.objects.create(tag=TaggedItem.objects.all()[0].tag,
+            content_type=TaggedItem.objects.all()[0].content_type, count=42)
+
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            call_command("rebuild_tag_counts")
+        finally:
+            sys.stdout = old_stdout
+        self.assertEquals(set(TagCount.objects.values_list(
+            "content_type", "tag", "count")), expected)
+        self.assertEquals(self.counts(), {"red": 1, "green": 2})
+
+    def test_count_down(self):
+        '''verify counts that drifted too low are counted down to zero'''
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("red", "green")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("red")
+        TagCount.objects.filter(tag__name="red").update(count=1)
+        update_counts(get_through(self.food_model), self.food_model,
+            Tag.objects.filter(name__in=["red", "green"]).values_list("pk",
+            flat=True), -2)
+        self.assertEquals(self.counts(), {"red": 0, "green": 0})
+
+    def test_gc(self):
+        '''verify the links the gc deletes are counted down'''
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("red", "green")
+        pear = Food.objects.create(name="pear")
+        pear.tags.add("red")
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE %s = %%s" % (
+            connection.ops.quote_name(Food._meta.db_table),
+            connection.ops.quote_name(Food._meta.pk.column)), [apple.pk])
+        self.assertEquals(delete_dangling_links(get_content_type(Food).pk), 2)
+        self.assertEquals(dict(TagCount.objects.filter(
+            content_type=get_content_type(Food)).values_list("tag__name",
+            "count")), {"red": 1, "green": 0})
+
+        ct = ContentType.objects.create(app_label="gone", model="gone")
+        red = Tag.objects.get(name="red")
+        TaggedItem.objects.create(content_object=ct, tag=red)
+        update_counts(TaggedItem, ContentType, [red.pk], 1)
+        delete_links_on_delete(ContentType)
+        try:
+            ct.delete()
+        finally:
+            post_delete.disconnect(sender=ContentType,
+                dispatch_uid="taggit.gc.delete_links_on_delete")
+        self.assertEquals(TagCount.objects.get(tag=red,
+            content_type=get_content_type(ContentType)).count, 0)
+
+    def test_merge(self):
+        '''verify merging tags moves their counts'''
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("red", "crimson")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("crimson", "green")
+        merge_tags(["crimson"], "red", batch_size=1)
+        self.assertEquals(self.counts(), {"red": 2, "green": 1})
+
+    def test_merge_dangling(self):
+        '''verify merging tags with links of a model that's gone'''
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("crimson")
+        gone = ContentType.objects.create(app_label="gone", model="gone")
+        TaggedItem.objects.create(tag=Tag.objects.get(name="crimson"),
+            content_type=gone, object_id=1)
+        merge_tags(["crimson"], "red")
+        self.assertEquals(self.counts(), {"red": 1})
+        self.assertEquals(TaggedItem.objects.filter(content_type=gone,
+            tag__name="red").count(), 1)
+
+class TestDirectCounts(TestCounts):
+    '''test the counts of a custom through model'''
+    food_model = DirectFood
@@ -0,0 +1,115 @@
+'''count utilities'''
+from django.db import models, transaction, IntegrityError
+
+from taggit.bulk import _trans_kwargs
+from taggit.contrib.counts.models import TagCount
+from taggit.gc import dangling_links, tagged_content_types
+from taggit.models import Tag, TaggedItem
+from taggit.utils import (bulk_insert, get_connection, get_content_type,
+    get_through_models)
+
+
+def get_count_content_type(through, model):
+    '''the content type tags of ``model`` (a model or an instance) through
+    ``through`` are counted under'''
+    if issubclass(through, TaggedItem):
+        return get_content_type(model)
+    # A custom through model only ever links one model.
+    return get_content_type(
+        through._meta.get_field_by_name('content_object')[0].rel.to)
+
+def update_counts(through, model, tag_ids, delta):
+    '''add ``delta`` to the counts of ``tag_ids`` for ``model``'''
+    tag_ids = set(tag_ids)
+    if not tag_ids or not delta:
+        return
+    ct = get_count_content_type(through, model)
+    if delta < 0:
+        _count_down(ct, tag_ids, -delta)
+        return
+    updated = TagCount.objects.filter(content_type=ct,
+        tag__in=tag_ids).update(count=models.F('count') + delta)
+    if updated == len(tag_ids):
+        return
+    have = set(TagCount.objects.filter(content_type=ct,
+        tag__in=tag_ids).values_list('tag', flat=True))
+    missing = tag_ids - have
+    sid = transaction.savepoint()
+    try:
+        bulk_insert(TagCount, [TagCount(tag_id=tag_id, content_type=ct,
+            count=delta) for tag_id in missing])
+    except IntegrityError:
+        # Another process created some of the rows first.
+        transaction.savepoint_rollback(sid)
+        for tag_id in missing:
+            count, created = TagCount.objects.get_or_create(tag_id=tag_id,
+                content_type=ct, defaults={'count': delta})
+            if not created:
+                TagCount.objects.filter(pk=count.pk).update(
+                    count=models.F('count') + delta)
+    else:
+        transaction.savepoint_commit(sid)
+
+def _count_down(ct, tag_ids, n):
+    '''take ``n`` off the counts of ``tag_ids``, stopping at zero, so a
+    count that has drifted too low is corrected rather than left as is'''
+    using, trans_kwargs = _trans_kwargs(TagCount)
+    connection = get_connection(using)
+    qn = connection.ops.quote_name
+    opts = TagCount._meta
+    count = qn(opts.get_field('count').column)
+    connection.cursor().execute("UPDATE %s SET %s = CASE WHEN %s > %%s THEN "
+        "%s - %%s ELSE 0 END WHERE %s = %%s AND %s IN (%s)" % (
+        qn(opts.db_table), count, count, count,
+        qn(opts.get_field('content_type').column),
+        qn(opts.get_field('tag').column), ", ".join(["%s"] * len(tag_ids))),
+        [n, n, ct.pk] + list(tag_ids))
+    transaction.commit_unless_managed(**trans_kwargs)
+
+def tag_uses(through, model, tag_ids):
+    '''how many objects of ``model`` use each of ``tag_ids``'''
+    ct = get_count_content_type(through, model)
+    uses = dict(TagCount.objects.filter(content_type=ct,
+        tag__in=tag_ids).values_list('tag', 'count'))
+    return dict([(tag_id, uses.get(tag_id, 0)) for tag_id in tag_ids])
+
+def tags_for(through, model):
+    '''the tags used by ``model``, from the counts'''
+    ct = get_count_content_type(through, model)
+    return Tag.objects.filter(counts__content_type=ct, counts__count__gt=0)
+
+def most_common(through, model):
+    '''the tags used by ``model`` annotated with ``num_times`` and ordered
+    by it, from the counts'''
+    return tags_for(through, model).annotate(
+        num_times=models.Max('counts__count')).order_by('-num_times')
+
+def rebuild_counts():
+    '''recount every tag's uses from the through tables, leaving out the
+    links of objects that no longer exist; returns the number of counts
+    stored'''
+    totals = {}
+    for through in get_through_models():
+        if issubclass(through, TaggedItem):
+            rows = through.objects.values('content_type', 'tag')
+            ct_id = None
+        else:
+            rows = through.objects.values('tag')
+            ct_id = get_count_content_type(through, None).pk
+        for row in rows.annotate(n=models.Count('pk')).order_by():
+            key = (row.get('content_type', ct_id), row['tag'])
+            totals[key] = totals.get(key, 0) + row['n']
+    # Deleting an object counted its links down, even those left behind.
+    for ct_id in tagged_content_types():
+        for rows in dangling_links(ct_id):
+            for tag_id in TaggedItem.objects.filter(pk__in=[pk
+                for pk, object_id in rows]).values_list('tag', flat=True):
+                totals[(ct_id, tag_id)] -= 1
+    totals = dict([(key, n) for key, n in totals.iteritems() if n])
+
+    connection = get_connection()
+    connection.cursor().execute("DELETE FROM %s" %
+        connection.ops.quote_name(TagCount._meta.db_table))
+    bulk_insert(TagCount, [TagCount(content_type_id=ct_id, tag_id=tag_id,
+        count=n) for (ct_id, tag_id), n in totals.iteritems()])
+    return len(totals)
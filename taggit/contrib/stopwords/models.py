@@ -1,5 +1,7 @@
 '''models for stopwords app'''
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from taggit.cache import CachedValue
 
 class StopWord(models.Model):
     """Model to store stop-words 
@@ -8,3 +10,13 @@ class StopWord(models.Model):
 
     def __unicode__(self):
         return self.stopword
+
+def _load_stopwords():
+    return frozenset(StopWord.objects.values_list('stopword', flat=True))
+
+stopwords = CachedValue('taggit.stopwords', _load_stopwords)
+
+post_save.connect(stopwords.invalidate, sender=StopWord,
+    dispatch_uid='taggit.stopwords.StopWord.post_save')
+post_delete.connect(stopwords.invalidate, sender=StopWord,
+    dispatch_uid='taggit.stopwords.StopWord.post_delete')
@@ -1,5 +1,8 @@
 '''tests for stopwords app'''
+from django.conf import settings
+from django.db import connection
 from django.test import TestCase
+from taggit.contrib.stopwords.models import StopWord, stopwords
 from taggit.contrib.stopwords.utils import filterwords
 
 class TestUtils(TestCase):
@@ -14,3 +17,25 @@ class TestUtils(TestCase):
         got = filterwords(none_filtered);
         got.sort()
         self.assertEquals(got, none_filtered)
+
+    def test_stopwords_are_cached(self):
+        '''verify stopwords are read once and reloaded when changed'''
+        filterwords(['warm', 'up'])
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        start = len(connection.queries)
+        try:
+            got = filterwords(['this', 'branch'])
+            self.assertEquals(len(connection.queries), start)
+        finally:
+            settings.DEBUG = old_debug
+        self.assertEquals(got, ['branch'])
+
+        StopWord.objects.create(stopword='branch')
+        self.assertEquals(filterwords(['this', 'branch']), [])
+        StopWord.objects.filter(stopword='branch').delete()
+        self.assertEquals(filterwords(['this', 'branch']), ['branch'])
+
+    def tearDown(self):
+        # the rollback at the end of the test doesn't send signals
+        stopwords.invalidate()
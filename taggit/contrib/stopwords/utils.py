@@ -1,8 +1,14 @@
 '''stopword utilities'''
-from taggit.contrib.stopwords.models import StopWord
+from taggit.contrib.stopwords.models import stopwords
+from taggit.instrumentation import instrumented
 
+def _kept(args, kwargs, result):
+    if result is None:
+        return None
+    return len(result)
+
+@instrumented("stopwords", tags=_kept)
 def filterwords(words):
     '''filter words'''
-    # get a list of all words from the db
-    stored_words = set(w.stopword for w in StopWord.objects.all())
-    return list(set(words).difference(stored_words))
+    # the stopwords are loaded once and cached until one changes
+    return list(set(words).difference(stopwords.get()))
@@ -0,0 +1,205 @@
+import csv
+import os
+import sys
+import time
+from optparse import make_option
+
+import django
+from django.core.management.base import LabelCommand, CommandError
+from django.db import models, transaction
+from django.utils.encoding import force_unicode
+
+from taggit.bulk import add_links, missing_links
+from taggit.contrib.suggest.models import keyword_matcher, regex_matcher
+from taggit.contrib.suggest.utils import suggest_tags_many
+from taggit.managers import TaggableManager
+from taggit.models import Tag
+
+
+def get_model(label):
+    try:
+        app_label, model_name = label.split(".")
+    except ValueError:
+        raise CommandError("Give the model as app_label.ModelName, not %r."
+            % label)
+    model = models.get_model(app_label, model_name)
+    if model is None:
+        raise CommandError("Unknown model: %s" % label)
+    return model
+
+def get_tags_field(model, name=None):
+    fields = [f for f in model._meta.many_to_many
+        if isinstance(f, TaggableManager)]
+    if name:
+        fields = [f for f in fields if f.name == name]
+    if not fields:
+        raise CommandError("%s has no TaggableManager%s." % (
+            model._meta.object_name, name and " called %s" % name or ""))
+    return fields[0]
+
+def pk_chunks(model, chunk_size, after=None):
+    """
+    Yields the primary keys of ``model`` in ascending lists of at most
+    ``chunk_size``, starting after ``after``.
+    """
+    qs = model._default_manager.order_by("pk")
+    while True:
+        chunk_qs = qs
+        if after is not None:
+            chunk_qs = qs.filter(pk__gt=after)
+        pks = list(chunk_qs.values_list("pk", flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        after = pks[-1]
+
+def suggest_chunk(label, field, first, last):
+    """
+    Suggests tags for the objects of the model labelled ``label`` with
+    primary keys from ``first`` to ``last``, from the text in ``field``.
+    Returns a list of ``(pk, tag_ids)`` pairs.  Runs in the worker processes.
+    """
+    model = get_model(label)
+    rows = list(model._default_manager.filter(pk__gte=first,
+        pk__lte=last).order_by("pk").values_list("pk", field))
+    suggestions = suggest_tags_many([force_unicode(text or u"")
+        for pk, text in rows])
+    return [(rows[index][0], tag_ids) for index, tag_ids in suggestions]
+
+def _suggest_chunk(args):
+    return suggest_chunk(*args)
+
+def close_connections():
+    if django.VERSION >= (1, 2):
+        from django.db import connections
+        for connection in connections.all():
+            connection.close()
+    else:
+        from django.db import connection
+        connection.close()
+
+
+class Command(LabelCommand):
+    args = "<app_label.ModelName>"
+    label = "model"
+    help = ("Tags the existing objects of a model with the tags "
+        "taggit.contrib.suggest suggests for the text in one of their fields.")
+    option_list = LabelCommand.option_list + (
+        make_option("--field", action="store", dest="field", default=None,
+            help="The field holding the text to suggest tags for."),
+        make_option("--tags", action="store", dest="tags", default=None,
+            help="The TaggableManager to add the tags to, if the model has "
+                "more than one."),
+        make_option("--workers", action="store", dest="workers", type="int",
+            default=1, help="The number of processes suggesting tags.  "
+                "Defaults to 1, which suggests them in this process."),
+        make_option("--chunk", action="store", dest="chunk", type="int",
+            default=1000, help="The number of objects handed to a worker "
+                "at once.  Defaults to 1000."),
+        make_option("--checkpoint", action="store", dest="checkpoint",
+            default=None, help="A file recording the last object tagged.  "
+                "When it exists, tagging resumes after that object."),
+        make_option("--dry-run", action="store_true", dest="dry_run",
+            default=False, help="Only write the tags that would be added, as "
+                "CSV rows of object pk, tag pk and tag name."),
+        make_option("--csv", action="store", dest="csv", default=None,
+            help="The file --dry-run writes to.  Defaults to standard output."),
+    )
+
+    def handle_label(self, label, **options):
+        model = get_model(label)
+        field = options.get("field")
+        if not field:
+            raise CommandError("Name the field holding the text with --field.")
+        try:
+            model._meta.get_field(field)
+        except models.FieldDoesNotExist:
+            raise CommandError("%s has no field %s." % (
+                model._meta.object_name, field))
+        through = get_tags_field(model, options.get("tags")).through
+        workers = options.get("workers") or 1
+        chunk_size = options.get("chunk") or 1000
+        dry_run = options.get("dry_run")
+        checkpoint = options.get("checkpoint")
+
+        after = None
+        if checkpoint and os.path.exists(checkpoint):
+            after = open(checkpoint).read().strip() or None
+
+        writer = out = None
+        if dry_run:
+            if options.get("csv"):
+                out = open(options["csv"], "wb")
+            else:
+                out = sys.stdout
+            writer = csv.writer(out)
+
+        # Build the matchers before forking, so the workers share them.
+        keyword_matcher.get()
+        regex_matcher.get()
+        pool = None
+        if workers > 1:
+            from multiprocessing import Pool
+            # Each worker has to open its own connections.
+            close_connections()
+            pool = Pool(workers)
+
+        started = time.time()
+        self.objects = self.suggested = self.added = 0
+        try:
+            pending = []
+            for pks in pk_chunks(model, chunk_size, after):
+                args = (label, field, pks[0], pks[-1])
+                if pool is None:
+                    self.apply(model, through, suggest_chunk(*args), pks[-1],
+                        writer, checkpoint)
+                    continue
+                pending.append((pks[-1],
+                    pool.apply_async(_suggest_chunk, (args,))))
+                # Keep every worker busy without reading ahead too far.
+                if len(pending) >= workers * 2:
+                    last, result = pending.pop(0)
+                    self.apply(model, through, result.get(), last, writer,
+                        checkpoint)
+            while pending:
+                last, result = pending.pop(0)
+                self.apply(model, through, result.get(), last, writer,
+                    checkpoint)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if out is not None and out is not sys.stdout:
+                out.close()
+
+        elapsed = time.time() - started
+        return ("Suggested %d tags for %d objects and %s %d of them in %.1f "
+            "seconds (%.0f objects per second)." % (self.suggested,
+            self.objects, dry_run and "would add" or "added", self.added,
+            elapsed, self.objects / max(elapsed, 0.001)))
+
+    def apply(self, model, through, results, last, writer, checkpoint):
+        """
+        Adds the tags suggested for a chunk of objects, or writes them out
+        on a dry run, and records ``last``, the chunk's last primary key, as
+        done.
+        """
+        pairs = [(model(pk=pk), tag_ids) for pk, tag_ids in results]
+        self.objects += len(pairs)
+        for obj, tag_ids in pairs:
+            self.suggested += len(tag_ids)
+        if writer is not None:
+            links = missing_links(through, pairs)
+            names = dict(Tag.objects.filter(pk__in=set([tag_id
+                for obj, tag_id in links])).values_list("pk", "name"))
+            for obj, tag_id in links:
+                writer.writerow([force_unicode(obj.pk).encode("utf-8"),
+                    tag_id, names[tag_id].encode("utf-8")])
+            self.added += len(links)
+            return
+        self.added += transaction.commit_on_success(add_links)(through, pairs)
+        if checkpoint:
+            f = open(checkpoint, "w")
+            try:
+                f.write("%s\n" % force_unicode(last).encode("utf-8"))
+            finally:
+                f.close()
@@ -0,0 +1,259 @@
+import logging
+import re
+import threading
+import time
+
+try:
+    import Stemmer
+except ImportError:
+    Stemmer = None
+
+
+logger = logging.getLogger('taggit.contrib.suggest')
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_SYMBOL_RE = re.compile(r'[^\w\s]', re.UNICODE)
+
+
+class Normalizer(object):
+    """
+    Turns text into its words separated by single spaces.  When PyStemmer is
+    installed the words are lowercased and stemmed, so "Universities" and
+    "university" both become "univers".
+
+    Stemmer objects aren't thread safe, so make a normalizer per thread.
+    """
+    def __init__(self, language='english'):
+        self.stemmer = Stemmer and Stemmer.Stemmer(language) or None
+
+    def __call__(self, text):
+        words = _WORD_RE.findall(text)
+        if self.stemmer:
+            words = self.stemmer.stemWords([w.lower() for w in words])
+        return u' '.join(words)
+
+    def keep_symbols(self, text):
+        """
+        Like calling the normalizer, but keeps the text as it is apart from
+        lowercasing it along with the words, for keywords like "C++" or
+        ".net" that are more than their words.
+        """
+        if self.stemmer:
+            return text.lower()
+        return text
+
+def is_word_char(c):
+    return c.isalnum() or c == '_'
+
+def has_symbols(text):
+    return _SYMBOL_RE.search(text) is not None
+
+
+class KeywordMatcher(object):
+    """
+    Finds many keywords in a text in a single pass (Aho-Corasick).
+
+    Built from ``(pattern, value, whole_word)`` tuples; ``search`` returns
+    the set of values whose pattern occurs in the text.  Patterns only match
+    at the start of a word, and ``whole_word`` patterns also only at the end
+    of one, so a stem like "univers" finds "university" but the keyword "art"
+    doesn't find "start" or "article".
+    """
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, value, whole_word in patterns:
+            if pattern:
+                self._add(pattern, value, whole_word)
+        self._build()
+
+    def _add(self, pattern, value, whole_word):
+        state = 0
+        for c in pattern:
+            next_state = self._goto[state].get(c)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][c] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        # Boundaries are only checked next to word characters, like \b.
+        self._out[state].append((len(pattern), value,
+            is_word_char(pattern[0]), whole_word and is_word_char(pattern[-1])))
+
+    def _build(self):
+        queue = list(self._goto[0].values())
+        i = 0
+        while i < len(queue):
+            state = queue[i]
+            i += 1
+            for c, next_state in self._goto[state].iteritems():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(c, 0)
+                if fail == next_state:
+                    fail = 0
+                self._fail[next_state] = fail
+                self._out[next_state].extend(self._out[fail])
+
+    def search(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        end = len(text)
+        found = set()
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for length, value, check_start, check_end in out[state]:
+                if value in found:
+                    continue
+                start = i - length + 1
+                if check_start and start > 0 and is_word_char(text[start - 1]):
+                    continue
+                if check_end and i + 1 < end and is_word_char(text[i + 1]):
+                    continue
+                found.add(value)
+        return found
+
+
+# Patterns with their own flags, named groups or backreferences can't be
+# merged with others.
+_PLAIN_FLAGS = re.compile('').flags
+_BACKREFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=')
+# Python's re supports at most 100 groups per expression.
+MAX_GROUPS = 99
+
+
+class RegexMatcher(object):
+    """
+    Finds which of many regular expressions occur in a text.
+
+    Built from ``(regex, value)`` tuples; ``search`` returns the set of
+    values whose regex matches.  Regexes are merged into alternations of
+    lookaheads with a named group each, so one scan reports every position
+    where some regex matches.  Regexes that can't be merged are scanned on
+    their own.
+
+    A scan can't be interrupted, but one taking longer than ``budget``
+    seconds per ``BUDGET_CHARS`` characters of text gets the regexes
+    responsible set aside: a merged alternation is split up, and a regex
+    that overruns on its own ``max_overruns`` searches in a row is dropped
+    and logged.  A new matcher, built when the regexes change, starts over.
+    """
+    BUDGET_CHARS = 10000
+
+    def __init__(self, patterns, budget=None, max_overruns=3):
+        self.budget = budget
+        self.max_overruns = max_overruns
+        self._combined = []
+        self._single = []
+        self._overruns = {}
+        self._lock = threading.Lock()
+        chunk, groups = [], 0
+        for regex, value in patterns:
+            compiled = re.compile(regex)
+            if (compiled.flags != _PLAIN_FLAGS or compiled.groupindex or
+                _BACKREFERENCE_RE.search(regex)):
+                self._single.append((compiled, value))
+                continue
+            if chunk and groups + compiled.groups + 1 > MAX_GROUPS:
+                self._add_combined(chunk)
+                chunk, groups = [], 0
+            chunk.append((compiled, value))
+            groups += compiled.groups + 1
+        if chunk:
+            self._add_combined(chunk)
+
+    def _add_combined(self, chunk):
+        if len(chunk) == 1:
+            self._single.extend(chunk)
+            return
+        members = {}
+        parts = []
+        for i, (compiled, value) in enumerate(chunk):
+            members["r%d" % i] = (compiled, value)
+            parts.append("(?=(?P<r%d>%s))" % (i, compiled.pattern))
+        try:
+            combined = re.compile("|".join(parts))
+        except re.error:
+            self._single.extend(chunk)
+            return
+        self._combined.append((combined, members))
+
+    def _allowed(self, text):
+        if self.budget is None:
+            return None
+        return self.budget * max(1.0, len(text) / float(self.BUDGET_CHARS))
+
+    def search(self, text):
+        found = set()
+        allowed = self._allowed(text)
+        self._lock.acquire()
+        try:
+            combined, single = self._combined, self._single
+        finally:
+            self._lock.release()
+        split, slow, fast = [], [], []
+        for entry in combined:
+            regex, members = entry
+            started = time.time()
+            positions = []
+            for match in regex.finditer(text):
+                found.add(members[match.lastgroup][1])
+                positions.append(match.start())
+            # At each position only the first matching regex is reported, so
+            # the others are tried where some regex matched.
+            for compiled, value in members.values():
+                if value in found:
+                    continue
+                for position in positions:
+                    if compiled.match(text, position):
+                        found.add(value)
+                        break
+            if allowed is not None and time.time() - started > allowed:
+                split.append(entry)
+        for entry in single:
+            compiled, value = entry
+            started = time.time()
+            if compiled.search(text):
+                found.add(value)
+            if allowed is not None and time.time() - started > allowed:
+                slow.append(entry)
+            elif entry in self._overruns:
+                fast.append(entry)
+        if split or slow or fast:
+            self._record(split, slow, fast, allowed)
+        return found
+
+    def _record(self, split, slow, fast, allowed):
+        # Other threads may be searching with the same lists, so new ones
+        # are built rather than changed in place.
+        self._lock.acquire()
+        try:
+            combined, single = list(self._combined), list(self._single)
+            for entry in split:
+                if entry in combined:
+                    combined.remove(entry)
+                    single.extend(entry[1].values())
+            for entry in fast:
+                self._overruns.pop(entry, None)
+            for entry in slow:
+                if entry not in single:
+                    continue
+                overruns = self._overruns.get(entry, 0) + 1
+                if overruns < self.max_overruns:
+                    self._overruns[entry] = overruns
+                    continue
+                self._overruns.pop(entry, None)
+                single.remove(entry)
+                logger.warning("Regex %r took longer than %s seconds %s times "
+                    "in a row and is no longer used for suggestions." % (
+                    entry[0].pattern, allowed, overruns))
+            self._combined, self._single = combined, single
+        finally:
+            self._lock.release()
@@ -1,7 +1,14 @@
 import re
+
+import django
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext_lazy as _
+from taggit.cache import CachedValue
+from taggit.contrib.suggest.matching import (KeywordMatcher, Normalizer,
+    RegexMatcher, has_symbols)
 from taggit.models import Tag
 
 try:
@@ -32,6 +39,44 @@ class TagKeyword(models.Model):
         super(TagKeyword, self).save(*args, **kwargs)
 
 
+def get_normalizer():
+    """
+    Returns the normalizer keywords and content are matched with
+    """
+    return Normalizer(getattr(settings, 'TAGGIT_SUGGEST_LANGUAGE', 'english'))
+
+def _load_keyword_matcher():
+    normalize = get_normalizer()
+    patterns, symbol_patterns = [], []
+    for k in TagKeyword.objects.all():
+        if has_symbols(k.keyword):
+            # Normalizing would turn "C++" into "c" and drop "++"
+            # altogether, so these are matched against the content itself.
+            symbol_patterns.append((normalize.keep_symbols(k.keyword),
+                k.tag_id, True))
+        elif normalize.stemmer:
+            # The content is stemmed too, so stemmed keywords are matched
+            # as whole words.
+            patterns.append((normalize(k.keyword), k.tag_id, True))
+        else:
+            # Use the stem if available, otherwise use the whole keyword.
+            # Stems are matched as the start of a word.
+            patterns.append((normalize(k.stem or k.keyword), k.tag_id,
+                not k.stem))
+    return (KeywordMatcher(patterns),
+        symbol_patterns and KeywordMatcher(symbol_patterns) or None)
+
+# Automatons over the keywords matched against the normalized content and
+# those matched against the content itself, built per process.
+keyword_matcher = CachedValue('taggit.suggest.keywords', _load_keyword_matcher,
+    shared=False)
+
+post_save.connect(keyword_matcher.invalidate, sender=TagKeyword,
+    dispatch_uid='taggit.suggest.TagKeyword.post_save')
+post_delete.connect(keyword_matcher.invalidate, sender=TagKeyword,
+    dispatch_uid='taggit.suggest.TagKeyword.post_delete')
+
+
 def validate_regex(value):
     """
     Make sure we have a valid regular expression
@@ -49,12 +94,13 @@ class TagRegex(models.Model):
     """
     tag = models.ForeignKey(Tag, related_name='regexes')
     name = models.CharField(max_length=30)
+    # Django 1.1 has no validators; save() checks the regex itself there.
     regex = models.CharField(
         max_length=250,
-         validators=[validate_regex],
-         help_text=_('Enter a valid Regular Expression. To make it '
-            'case-insensitive include "(?i)" in your expression.')
-     )
+        help_text=_('Enter a valid Regular Expression. To make it '
+            'case-insensitive include "(?i)" in your expression.'),
+        **(django.VERSION >= (1, 2) and {'validators': [validate_regex]} or {})
+    )
 
     def __unicode__(self):
         return self.name
@@ -63,5 +109,23 @@ class TagRegex(models.Model):
         """
         Make sure to validate
         """
-        self.full_clean()
+        if django.VERSION >= (1, 2):
+            self.full_clean()
+        else:
+            validate_regex(self.regex)
         super(TagRegex, self).save(*args, **kwargs)
+
+
+def _load_regex_matcher():
+    return RegexMatcher(TagRegex.objects.values_list('regex', 'tag_id'),
+        budget=getattr(settings, 'TAGGIT_SUGGEST_REGEX_BUDGET', 0.5),
+        max_overruns=getattr(settings, 'TAGGIT_SUGGEST_REGEX_OVERRUNS', 3))
+
+# All regular expressions, compiled per process.
+regex_matcher = CachedValue('taggit.suggest.regexes', _load_regex_matcher,
+    shared=False)
+
+post_save.connect(regex_matcher.invalidate, sender=TagRegex,
+    dispatch_uid='taggit.suggest.TagRegex.post_save')
+post_delete.connect(regex_matcher.invalidate, sender=TagRegex,
+    dispatch_uid='taggit.suggest.TagRegex.post_delete')
@@ -1 +1,2 @@
-from taggit.contrib.suggest.tests.tests import SuggestCase
+from taggit.contrib.suggest.tests.tests import (SuggestCase, BackfillCase,
+    KeywordMatcherCase, RegexMatcherCase)
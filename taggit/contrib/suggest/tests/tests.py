@@ -1,12 +1,31 @@
+import csv
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.test import TestCase
 
-from taggit.contrib.suggest.models import TagKeyword, TagRegex
-from taggit.contrib.suggest.utils import suggest_tags
+from taggit.contrib.suggest.matching import (KeywordMatcher, Normalizer,
+    RegexMatcher, Stemmer, logger)
+from taggit.contrib.suggest.models import (TagKeyword, TagRegex,
+    keyword_matcher, regex_matcher)
+from taggit.contrib.suggest.utils import (fetch_suggested_tags, suggest_tags,
+    suggest_tags_many)
 from taggit.models import Tag
+from taggit.tests.models import DirectFood, Food
 
 
 class SuggestCase(TestCase):
+    def tearDown(self):
+        # The rolled back keywords don't send signals.
+        keyword_matcher.invalidate()
+        regex_matcher.invalidate()
+
     def test_simple_suggest(self):
         ku_tag = Tag.objects.create(name='ku')
         ku_keyword1 = TagKeyword.objects.create(
@@ -46,3 +65,269 @@ class SuggestCase(TestCase):
             'of Kansas. Also known as kansas university by the way.')
 
         self.assertTrue(ku_tag in suggested_tags)
+
+    def test_keyword_tokens(self):
+        art_tag = Tag.objects.create(name='art')
+        TagKeyword.objects.create(tag=art_tag, keyword='art')
+
+        self.assertEqual(list(suggest_tags('Modern art, mostly')), [art_tag])
+        self.assertEqual(list(suggest_tags('Start the article')), [])
+
+    def test_keyword_stem(self):
+        ku_tag = Tag.objects.create(name='ku')
+        TagKeyword.objects.create(tag=ku_tag, keyword='universities',
+            stem='univers')
+
+        self.assertEqual(list(suggest_tags('The university of Kansas')), [ku_tag])
+        self.assertEqual(list(suggest_tags('The multiverse')), [])
+
+    def test_keyword_cache(self):
+        ku_tag = Tag.objects.create(name='ku')
+        keyword = TagKeyword.objects.create(tag=ku_tag, keyword='jayhawks')
+        self.assertEqual(list(suggest_tags('Go jayhawks')), [ku_tag])
+
+        keyword.keyword = 'wildcats'
+        keyword.save()
+        self.assertEqual(list(suggest_tags('Go jayhawks')), [])
+        self.assertEqual(list(suggest_tags('Beat the wildcats')), [ku_tag])
+
+        keyword.delete()
+        self.assertEqual(list(suggest_tags('Beat the wildcats')), [])
+
+    def test_regex_cache(self):
+        ku_tag = Tag.objects.create(name='ku')
+        regex = TagRegex.objects.create(tag=ku_tag, name='KU', regex=r'\bKU\b')
+        self.assertEqual(list(suggest_tags('Go KU')), [ku_tag])
+
+        regex.regex = r'(?i)\bku\b'
+        regex.save()
+        self.assertEqual(list(suggest_tags('Go ku')), [ku_tag])
+
+        regex.delete()
+        self.assertEqual(list(suggest_tags('Go KU')), [])
+
+    def test_suggest_many(self):
+        ku_tag = Tag.objects.create(name='ku')
+        ks_tag = Tag.objects.create(name='kansas')
+        TagKeyword.objects.create(tag=ku_tag, keyword='kansas university')
+        TagKeyword.objects.create(tag=ks_tag, keyword='kansas')
+        TagRegex.objects.create(tag=ku_tag, name='KU', regex=r'\bKU\b')
+
+        contents = iter([
+            'Off to kansas university',
+            'KU, in Lawrence',
+            'Nothing here',
+            'Kansas City, kansas',
+        ])
+        suggestions = list(suggest_tags_many(contents))
+        self.assertEqual(suggestions, [
+            (0, set([ku_tag.pk, ks_tag.pk])),
+            (1, set([ku_tag.pk])),
+            (2, set()),
+            (3, set([ks_tag.pk])),
+        ])
+        self.assertEqual(fetch_suggested_tags(suggestions), [
+            (0, [ku_tag, ks_tag]),
+            (1, [ku_tag]),
+            (2, []),
+            (3, [ks_tag]),
+        ])
+
+    def test_normalized_content(self):
+        ku_tag = Tag.objects.create(name='ku')
+        TagKeyword.objects.create(tag=ku_tag, keyword='kansas university')
+
+        # Words are matched regardless of the whitespace between them.
+        self.assertEqual(list(suggest_tags('At kansas\n  university')), [ku_tag])
+        self.assertEqual(list(suggest_tags('At kansas universityhall')), [])
+
+    def test_keyword_symbols(self):
+        cpp_tag = Tag.objects.create(name='cpp')
+        net_tag = Tag.objects.create(name='dotnet')
+        TagKeyword.objects.create(tag=cpp_tag, keyword='c++')
+        TagKeyword.objects.create(tag=net_tag, keyword='.net')
+
+        self.assertEqual(list(suggest_tags('Written in c++ for .net')),
+            [cpp_tag, net_tag])
+        self.assertEqual(list(suggest_tags('Written in c for the net')), [])
+        self.assertEqual(list(suggest_tags('A .network of abc++')), [])
+
+    def test_keyword_only_symbols(self):
+        smiley_tag = Tag.objects.create(name='smiley')
+        TagKeyword.objects.create(tag=smiley_tag, keyword=':-)')
+
+        self.assertEqual(list(suggest_tags('Nice :-)')), [smiley_tag])
+        self.assertEqual(list(suggest_tags('Nice')), [])
+
+    if Stemmer:
+        def test_stemmed_content(self):
+            ku_tag = Tag.objects.create(name='ku')
+            TagKeyword.objects.create(tag=ku_tag, keyword='kansas universities')
+
+            self.assertEqual(list(suggest_tags('Kansas University')), [ku_tag])
+            self.assertEqual(list(suggest_tags('kansans universities')), [])
+            self.assertEqual(Normalizer()('Running, to the Universities!'),
+                'run to the univers')
+
+
+class BackfillCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fruit = Tag.objects.create(name='fruit')
+        self.red = Tag.objects.create(name='red')
+        TagKeyword.objects.create(tag=self.fruit, keyword='apple')
+        TagKeyword.objects.create(tag=self.fruit, keyword='pear')
+        TagRegex.objects.create(tag=self.red, name='red', regex=r'(?i)\bred\b')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        keyword_matcher.invalidate()
+        regex_matcher.invalidate()
+
+    def call_command(self, *args, **kwargs):
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            call_command(*args, **kwargs)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+
+    def names(self, obj):
+        return sorted([t.name for t in obj.tags.all()])
+
+    def test_backfill(self):
+        apple = Food.objects.create(name='red apple')
+        pear = Food.objects.create(name='pear')
+        bread = Food.objects.create(name='bread')
+        pear.tags.add('fruit', 'green')
+
+        output = self.call_command('suggest_tags_backfill', 'tests.Food',
+            field='name', chunk=2)
+        self.assertTrue('Suggested 3 tags for 3 objects and added 2' in output)
+        self.assertEqual(self.names(apple), ['fruit', 'red'])
+        self.assertEqual(self.names(pear), ['fruit', 'green'])
+        self.assertEqual(self.names(bread), [])
+
+    def test_through(self):
+        apple = DirectFood.objects.create(name='Red apple')
+        self.call_command('suggest_tags_backfill', 'tests.DirectFood',
+            field='name')
+        self.assertEqual(self.names(apple), ['fruit', 'red'])
+
+    def test_checkpoint(self):
+        checkpoint = os.path.join(self.dir, 'checkpoint')
+        apple = Food.objects.create(name='apple')
+        self.call_command('suggest_tags_backfill', 'tests.Food', field='name',
+            checkpoint=checkpoint)
+        self.assertEqual(open(checkpoint).read().strip(), str(apple.pk))
+
+        pear = Food.objects.create(name='pear')
+        apple.tags.clear()
+        output = self.call_command('suggest_tags_backfill', 'tests.Food',
+            field='name', checkpoint=checkpoint)
+        self.assertTrue('for 1 objects' in output)
+        self.assertEqual(self.names(apple), [])
+        self.assertEqual(self.names(pear), ['fruit'])
+        self.assertEqual(open(checkpoint).read().strip(), str(pear.pk))
+
+    def test_dry_run(self):
+        path = os.path.join(self.dir, 'tags.csv')
+        apple = Food.objects.create(name='red apple')
+        pear = Food.objects.create(name='pear')
+        pear.tags.add('fruit')
+
+        output = self.call_command('suggest_tags_backfill', 'tests.Food',
+            field='name', dry_run=True, csv=path)
+        self.assertTrue('would add 2' in output)
+        self.assertEqual(list(csv.reader(open(path))), [
+            [str(apple.pk), str(self.fruit.pk), 'fruit'],
+            [str(apple.pk), str(self.red.pk), 'red'],
+        ])
+        self.assertEqual(self.names(apple), [])
+
+
+class KeywordMatcherCase(TestCase):
+    def test_search(self):
+        matcher = KeywordMatcher([
+            ('he', 1, True),
+            ('she', 2, True),
+            ('hers', 3, True),
+            ('his', 4, False),
+            ('c++', 5, True),
+        ])
+        self.assertEqual(matcher.search('ushers'), set())
+        self.assertEqual(matcher.search('she, he and hers'), set([1, 2, 3]))
+        self.assertEqual(matcher.search('history'), set([4]))
+        self.assertEqual(matcher.search('c++11 or c++'), set([5]))
+        self.assertEqual(matcher.search(''), set())
+
+    def test_overlapping(self):
+        matcher = KeywordMatcher([
+            ('new york', 1, True),
+            ('york', 2, True),
+            ('new york city', 3, True),
+        ])
+        self.assertEqual(matcher.search('new york city'), set([1, 2, 3]))
+        self.assertEqual(matcher.search('new yorkshire'), set())
+
+
+class RegexMatcherCase(TestCase):
+    def test_search(self):
+        matcher = RegexMatcher([
+            (r'ab+c', 1),
+            (r'b', 2),
+            (r'(?i)kansas', 3),
+            (r'(?P<word>\w+) (?P=word)', 4),
+            (r'(x)\1', 5),
+            (r'^start', 6),
+            (r'z{3}', 7),
+        ])
+        self.assertEqual(matcher.search('abbc'), set([1, 2]))
+        self.assertEqual(matcher.search('KANSAS the the'), set([3, 4]))
+        self.assertEqual(matcher.search('start xx'), set([5, 6]))
+        self.assertEqual(matcher.search('no start zz'), set())
+        self.assertEqual(matcher.search(''), set())
+
+    def test_same_position(self):
+        # Both regexes match only at the same position.
+        matcher = RegexMatcher([(r'foo', 1), (r'foobar', 2), (r'fo+', 3)])
+        self.assertEqual(matcher.search('a foobar'), set([1, 2, 3]))
+
+    def test_many_groups(self):
+        matcher = RegexMatcher([(r'(w)(o)rd%d\b' % i, i) for i in range(100)])
+        self.assertEqual(matcher.search('word7 and word42'), set([7, 42]))
+
+    def test_budget(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger.addHandler(handler)
+        try:
+            matcher = RegexMatcher([(r'foo', 1), (r'bar', 2), (r'(?i)baz', 3)],
+                budget=-1, max_overruns=2)
+            # The merged regexes are split up at once, but each regex is
+            # dropped only once it overruns twice in a row.
+            self.assertEqual(matcher.search('foo bar baz'), set([1, 2, 3]))
+            self.assertEqual(matcher.search('foo bar baz'), set([1, 2, 3]))
+            self.assertEqual(matcher.search('foo bar baz'), set([1, 2]))
+            self.assertEqual(matcher.search('foo bar baz'), set())
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(len(records), 3)
+
+    def test_budget_resets(self):
+        matcher = RegexMatcher([(r'(?i)baz', 1)], budget=-1, max_overruns=2)
+        self.assertEqual(matcher.search('baz'), set([1]))
+        # A scan within the budget forgives the overrun.
+        matcher.budget = None
+        self.assertEqual(matcher.search('baz'), set([1]))
+        matcher.budget = -1
+        self.assertEqual(matcher.search('baz'), set([1]))
+        self.assertEqual(matcher.search('baz'), set([1]))
+        self.assertEqual(matcher.search('baz'), set())
+
+    def test_budget_scales(self):
+        matcher = RegexMatcher([], budget=0.5)
+        self.assertEqual(matcher._allowed('x' * 100), 0.5)
+        self.assertEqual(matcher._allowed('x' * 40000), 2.0)
@@ -1,49 +1,67 @@
-import re
-
-from django.conf import settings
-
-from taggit.contrib.suggest.models import TagKeyword, TagRegex
+from taggit.contrib.suggest.models import (get_normalizer, keyword_matcher,
+    regex_matcher)
+from taggit.instrumentation import finish, start
 from taggit.models import Tag
 
 
+def _search_keywords(matchers, normalize, content):
+    words, symbols = matchers
+    found = words.search(normalize(content))
+    if symbols is not None:
+        found |= symbols.search(normalize.keep_symbols(content))
+    return found
+
 def _suggest_keywords(content):
     """
-    Suggest by keywords
+    Suggest by keywords, in a single pass over the words of the content
+    and one more if some keywords have symbols
     """
-    suggested_keywords = set()
-    keywords = TagKeyword.objects.all()
-
-    for k in keywords:
-        # Use the stem if available, otherwise use the whole keyword
-        if k.stem:
-            if k.stem in content:
-                suggested_keywords.add(k.tag_id)
-        elif k.keyword in content:
-            suggested_keywords.add(k.tag_id)
-
-    return suggested_keywords
+    return _search_keywords(keyword_matcher.get(), get_normalizer(), content)
 
 def _suggest_regexes(content):
     """
     Suggest by regular expressions
     """
-    # Grab all regular expressions and compile them
-    suggested_regexes = set()
-    regex_keywords = TagRegex.objects.all()
+    return regex_matcher.get().search(content)
 
-    # Look for our regular expressions in the content
-    for r in regex_keywords:
-        if re.search(r.regex, content):
-            suggested_regexes.add(r.tag_id)
+def suggest_tags_many(contents):
+    """
+    Suggest tags for each of many text contents, yielding an
+    ``(index, tag_ids)`` pair per content as it goes
+    """
+    normalize = get_normalizer()
+    keywords = keyword_matcher.get()
+    regexes = regex_matcher.get()
+    for index, content in enumerate(contents):
+        yield index, (_search_keywords(keywords, normalize, content) |
+            regexes.search(content))
 
-    return suggested_regexes
+def fetch_suggested_tags(suggestions, chunk_size=500):
+    """
+    Turn the ``(index, tag_ids)`` pairs of ``suggest_tags_many()`` into
+    ``(index, tags)`` pairs, loading all the tags at the end
+    """
+    suggestions = list(suggestions)
+    tag_ids = set()
+    for index, ids in suggestions:
+        tag_ids.update(ids)
+    tag_ids = sorted(tag_ids)
+    tags = {}
+    # One query unless there are more tags than a query can take ids.
+    for i in xrange(0, len(tag_ids), chunk_size):
+        tags.update(Tag.objects.in_bulk(tag_ids[i:i + chunk_size]))
+    return [(index, [tags[id] for id in sorted(ids) if id in tags])
+        for index, ids in suggestions]
 
 def suggest_tags(content):
     """
     Suggest tags based on text content
     """
-    suggested_keywords = _suggest_keywords(content)
-    suggested_regexes  = _suggest_regexes(content)
-    suggested_tag_ids  = suggested_keywords | suggested_regexes
+    record = start("suggest_tags")
+    suggested_tag_ids = ()
+    try:
+        suggested_tag_ids = list(suggest_tags_many([content]))[0][1]
+    finally:
+        finish(record, tags=len(suggested_tag_ids))
 
     return Tag.objects.filter(id__in=suggested_tag_ids)
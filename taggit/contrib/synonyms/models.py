@@ -1,5 +1,7 @@
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from taggit.cache import CachedValue
 from taggit.models import Tag
 
 class TagSynonym(models.Model):
@@ -14,3 +16,20 @@ class TagSynonym(models.Model):
         verbose_name = "synonym"
         verbose_name_plural = "synonyms"
 
+def _load_synonym_map():
+    return dict(TagSynonym.objects.values_list('name', 'tag__name'))
+
+# Synonym name -> name of its tag.
+synonym_map = CachedValue('taggit.synonyms', _load_synonym_map)
+
+def _tag_saved(sender, instance, created=False, **kwargs):
+    # A renamed tag changes the names synonyms map to.
+    if not created:
+        synonym_map.invalidate()
+
+post_save.connect(synonym_map.invalidate, sender=TagSynonym,
+    dispatch_uid='taggit.synonyms.TagSynonym.post_save')
+post_delete.connect(synonym_map.invalidate, sender=TagSynonym,
+    dispatch_uid='taggit.synonyms.TagSynonym.post_delete')
+post_save.connect(_tag_saved, sender=Tag,
+    dispatch_uid='taggit.synonyms.Tag.post_save')
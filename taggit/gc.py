@@ -0,0 +1,189 @@
+"""
+Cleaning up after deleted objects and tags nobody uses.
+
+Nothing cascades to the ``TaggedItem`` links of an object that's deleted
+without going through a ``TaggableManager``, such as an object tagged
+generically, or removed with raw SQL or along with its model, so its links
+are left behind.
+"""
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.utils.encoding import force_unicode
+
+from taggit.bulk import BATCH_SIZE, _in_transaction, _trans_kwargs
+from taggit.cache import invalidate_links
+from taggit.models import Tag, TaggedItem
+from taggit.utils import (get_connection, get_content_type, get_tag_relations,
+    tag_counts_installed, update_tag_counts)
+
+
+INTEGER_FIELDS = ("AutoField", "IntegerField", "PositiveIntegerField",
+    "BigIntegerField", "SmallIntegerField", "PositiveSmallIntegerField")
+
+
+def tagged_content_types():
+    """
+    Returns the ids of the content types ``TaggedItem`` links objects of.
+    """
+    return sorted(TaggedItem.objects.values_list("content_type",
+        flat=True).distinct().order_by())
+
+def _same_database(model):
+    if django.VERSION < (1, 2):
+        return True
+    from django.db import router
+    return router.db_for_read(model) == router.db_for_read(TaggedItem)
+
+def _pk_field(model):
+    field = model._meta.pk
+    # The primary key of a child model is a link to its parent's.
+    while field.rel:
+        field = field.rel.get_related_field()
+    return field
+
+def _anti_join(model, ct_id, after, chunk_size):
+    using, trans_kwargs = _trans_kwargs(TaggedItem)
+    connection = get_connection(using)
+    qn = connection.ops.quote_name
+    opts = TaggedItem._meta
+    params = {
+        "links": qn(opts.db_table),
+        "pk": qn(opts.pk.column),
+        "ct": qn(opts.get_field("content_type").column),
+        "object_id": qn(opts.get_field("object_id").column),
+        "objects": qn(model._meta.db_table),
+        "object_pk": qn(model._meta.pk.column),
+    }
+    cursor = connection.cursor()
+    cursor.execute("SELECT l.%(pk)s, l.%(object_id)s FROM %(links)s l "
+        "LEFT JOIN %(objects)s o ON o.%(object_pk)s = l.%(object_id)s "
+        "WHERE l.%(ct)s = %%s AND l.%(pk)s > %%s AND o.%(object_pk)s IS NULL "
+        "ORDER BY l.%(pk)s LIMIT %%s" % params, [ct_id, after, chunk_size])
+    return list(cursor.fetchall())
+
+def dangling_links(ct_id, chunk_size=BATCH_SIZE):
+    """
+    Yields the ``(id, object_id)`` pairs of the ``TaggedItem`` links of the
+    content type ``ct_id`` whose object doesn't exist, in lists of at most
+    ``chunk_size``.  The links yielded can be deleted before the next list
+    is asked for.
+    """
+    # Not get_for_id(), which can't cache a content type without a model.
+    model = ContentType.objects.get(pk=ct_id).model_class()
+    links = TaggedItem.objects.filter(content_type=ct_id).order_by("pk")
+    after = 0
+    while True:
+        if model is None:
+            # The model is gone, and its objects with it.
+            rows = list(links.filter(pk__gt=after).values_list("pk",
+                "object_id")[:chunk_size])
+            dangling = rows
+        elif (_pk_field(model).get_internal_type() in INTEGER_FIELDS and
+            _same_database(model)):
+            rows = dangling = _anti_join(model, ct_id, after, chunk_size)
+        else:
+            # The objects can't be joined in SQL, so look them up.
+            rows = list(links.filter(pk__gt=after).values_list("pk",
+                "object_id")[:chunk_size])
+            existing = set([force_unicode(pk) for pk in
+                model._default_manager.filter(pk__in=set([object_id
+                for pk, object_id in rows])).values_list("pk", flat=True)])
+            dangling = [row for row in rows
+                if force_unicode(row[1]) not in existing]
+        if not rows:
+            return
+        if dangling:
+            yield dangling
+        after = rows[-1][0]
+
+def _count_down(model, tag_ids):
+    # ``tag_ids`` has the tag of each deleted link.
+    uses = {}
+    for tag_id in tag_ids:
+        uses[tag_id] = uses.get(tag_id, 0) + 1
+    by_uses = {}
+    for tag_id, n in uses.iteritems():
+        by_uses.setdefault(n, []).append(tag_id)
+    for n, ids in by_uses.iteritems():
+        update_tag_counts(TaggedItem, model, ids, -n)
+
+def _delete_links(ct_id, rows):
+    tag_ids = None
+    if tag_counts_installed():
+        tag_ids = list(TaggedItem.objects.filter(pk__in=[pk
+            for pk, object_id in rows]).values_list("tag", flat=True))
+    using, trans_kwargs = _trans_kwargs(TaggedItem)
+    connection = get_connection(using)
+    qn = connection.ops.quote_name
+    connection.cursor().execute("DELETE FROM %s WHERE %s IN (%s)" % (
+        qn(TaggedItem._meta.db_table), qn(TaggedItem._meta.pk.column),
+        ", ".join(["%s"] * len(rows))), [pk for pk, object_id in rows])
+    transaction.commit_unless_managed(**trans_kwargs)
+    if tag_ids:
+        # Not get_for_id(), which can't cache a content type without a
+        # model.  The counts of a model that's gone are left to
+        # rebuild_tag_counts.
+        model = ContentType.objects.get(pk=ct_id).model_class()
+        if model is not None:
+            _count_down(model, tag_ids)
+    invalidate_links(TaggedItem, [(ct_id, object_id)
+        for pk, object_id in rows])
+
+def delete_dangling_links(ct_id, chunk_size=BATCH_SIZE, dry_run=False):
+    """
+    Deletes the ``TaggedItem`` links of the content type ``ct_id`` whose
+    object doesn't exist, ``chunk_size`` at a time, each chunk in its own
+    transaction.  Returns the number of links deleted, or only counts them
+    with ``dry_run``.
+    """
+    deleted = 0
+    for rows in dangling_links(ct_id, chunk_size):
+        if not dry_run:
+            _in_transaction(TaggedItem, _delete_links, ct_id, rows)
+        deleted += len(rows)
+    return deleted
+
+def unused_tags():
+    """
+    Returns the tags that no link, and nothing else such as a synonym,
+    points at.
+    """
+    return Tag.objects.filter(**dict([("%s__isnull" %
+        related.field.related_query_name(), True)
+        for related in get_tag_relations()]))
+
+def delete_unused_tags(chunk_size=BATCH_SIZE, dry_run=False):
+    """
+    Deletes the tags ``unused_tags()`` returns, ``chunk_size`` at a time.
+    Returns the number of tags deleted, or only counts them with
+    ``dry_run``.
+    """
+    if dry_run:
+        return unused_tags().count()
+    deleted = 0
+    while True:
+        ids = list(unused_tags().values_list("pk", flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        # Checked again, in case a tag was used in the meantime.
+        qs = unused_tags().filter(pk__in=ids)
+        deleted += qs.count()
+        _in_transaction(Tag, qs.delete)
+
+def _object_deleted(sender, instance, **kwargs):
+    qs = TaggedItem.objects.filter(content_type=get_content_type(sender),
+        object_id=instance.pk)
+    if tag_counts_installed():
+        _count_down(sender, list(qs.values_list("tag", flat=True)))
+    qs.delete()
+
+def delete_links_on_delete(model):
+    """
+    Deletes the ``TaggedItem`` links of ``model``'s objects as soon as
+    they're deleted, for a model that's tagged without a
+    ``TaggableManager``.  Subclasses have to be connected too.
+    """
+    post_delete.connect(_object_deleted, sender=model,
+        dispatch_uid="taggit.gc.delete_links_on_delete")
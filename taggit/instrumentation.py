@@ -0,0 +1,239 @@
+"""
+Optional timing of taggit's operations.
+
+When a receiver is connected to ``operation_finished``, or sinks are named
+in the ``TAGGIT_INSTRUMENTATION_SINKS`` setting, each instrumented operation
+produces a ``Record`` of what it did and how long it took, sent with the
+signal and passed to every sink.  Otherwise the instrumented functions just
+check that nothing is listening and go on.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import get_callable
+from django.db import connection
+from django.dispatch import Signal
+from django.utils.functional import wraps
+
+
+operation_finished = Signal(providing_args=["record"])
+
+logger = logging.getLogger("taggit.instrumentation")
+
+
+class Record(object):
+    """
+    What an operation did: its name, the label of the model it worked on,
+    the number of tags it was given or returned, the number of queries it
+    made (only known with ``DEBUG`` on, as Django only logs queries then),
+    the number of rows it wrote or read, and the seconds it took.
+    """
+    def __init__(self, operation, model=None):
+        self.operation = operation
+        self.model = model
+        self.tags = None
+        self.queries = None
+        self.rows = None
+        self.seconds = None
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return "<Record %s>" % ", ".join(["%s=%r" % item
+            for item in sorted(self.as_dict().items())])
+
+
+_sinks = None
+_local = threading.local()
+
+def get_sinks():
+    """
+    Returns the sinks of the ``TAGGIT_INSTRUMENTATION_SINKS`` setting, the
+    dotted paths of classes whose instances are called with each record.
+    They're created once.
+    """
+    global _sinks
+    if _sinks is None:
+        _sinks = [get_callable(path)() for path in
+            getattr(settings, "TAGGIT_INSTRUMENTATION_SINKS", ())]
+    return _sinks
+
+def reset_sinks():
+    """
+    Throws the sinks away, so they're created afresh from the setting.
+    """
+    global _sinks
+    _sinks = None
+
+def enabled():
+    return bool(operation_finished.receivers or get_sinks())
+
+def recording():
+    """
+    Returns whether an instrumented operation is running in this thread.
+    """
+    return bool(getattr(_local, "records", None))
+
+def note_rows(n):
+    """
+    Adds ``n`` to the rows touched by the operation running in this thread.
+    """
+    records = getattr(_local, "records", None)
+    if records:
+        records[-1].rows = (records[-1].rows or 0) + n
+
+def model_label(model):
+    if model is None:
+        return None
+    return "%s.%s" % (model._meta.app_label, model._meta.object_name)
+
+def _queries():
+    if settings.DEBUG:
+        return len(connection.queries)
+    return None
+
+def start(operation, model=None):
+    """
+    Starts a record of ``operation`` on ``model``, or returns ``None`` when
+    instrumentation is off.  Pass it to ``finish()`` once the operation is
+    done.
+    """
+    if not enabled():
+        return None
+    record = Record(operation, model_label(model))
+    if not hasattr(_local, "records"):
+        _local.records = []
+    _local.records.append(record)
+    record._queries = _queries()
+    record._started = time.time()
+    return record
+
+def finish(record, tags=None, rows=None):
+    """
+    Finishes ``record``, setting its number of ``tags`` and adding ``rows``
+    to the rows it touched, and sends it to the receivers and sinks.
+    """
+    if record is None:
+        return
+    record.seconds = time.time() - record.__dict__.pop("_started")
+    queries = record.__dict__.pop("_queries")
+    if queries is not None and settings.DEBUG:
+        record.queries = len(connection.queries) - queries
+    if tags is not None:
+        record.tags = tags
+    if rows is not None:
+        record.rows = (record.rows or 0) + rows
+    _local.records.remove(record)
+    # A failing receiver or sink mustn't fail the operation it records.
+    for receiver, response in operation_finished.send_robust(sender=Record,
+        record=record):
+        if isinstance(response, Exception):
+            logger.error("Receiver %r of operation_finished failed: %s",
+                receiver, response)
+    for sink in get_sinks():
+        try:
+            sink(record)
+        except Exception, e:
+            logger.error("Instrumentation sink %r failed: %s", sink, e)
+
+def instrumented(operation, model=None, tags=None, rows=None):
+    """
+    Decorates a function to be recorded as ``operation``.  ``model`` is a
+    function of the arguments returning the model worked on, and ``tags``
+    and ``rows`` functions of the arguments and the result returning the
+    number of tags and of rows read.
+    """
+    def decorator(func):
+        def inner(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            record = start(operation, model and model(args, kwargs))
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                finish(record, tags and tags(args, kwargs, result),
+                    rows and rows(args, kwargs, result))
+        return wraps(func)(inner)
+    return decorator
+
+
+class LoggingSink(object):
+    """
+    Logs each record to the ``taggit.instrumentation`` logger, at the DEBUG
+    level.
+    """
+    def __call__(self, record):
+        logger.debug("%s model=%s tags=%s queries=%s rows=%s seconds=%.6f",
+            record.operation, record.model, record.tags, record.queries,
+            record.rows, record.seconds)
+
+
+class AggregatingSink(object):
+    """
+    Keeps the records of each operation and model in memory, and reports
+    how many there were and percentiles of their times with ``summary()``.
+    Only the last ``max_samples`` times of each are kept.
+    """
+    max_samples = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._stats = {}
+        finally:
+            self._lock.release()
+
+    def __call__(self, record):
+        self._lock.acquire()
+        try:
+            key = (record.operation, record.model)
+            stats = self._stats.setdefault(key, {"count": 0, "queries": 0,
+                "rows": 0, "samples": []})
+            stats["count"] += 1
+            stats["queries"] += record.queries or 0
+            stats["rows"] += record.rows or 0
+            samples = stats["samples"]
+            samples.append(record.seconds)
+            if len(samples) > self.max_samples:
+                del samples[:len(samples) - self.max_samples]
+        finally:
+            self._lock.release()
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """
+        Returns a dict keyed by ``(operation, model)`` with the ``count``
+        of records, the total ``queries`` and ``rows``, and the times at
+        ``percentiles`` as ``p50`` and so on, plus ``max``, in seconds.
+        """
+        self._lock.acquire()
+        try:
+            summary = {}
+            for key, stats in self._stats.iteritems():
+                samples = sorted(stats["samples"])
+                entry = {"count": stats["count"], "queries": stats["queries"],
+                    "rows": stats["rows"], "max": samples[-1]}
+                for p in percentiles:
+                    entry["p%s" % p] = percentile(samples, p)
+                summary[key] = entry
+            return summary
+        finally:
+            self._lock.release()
+
+def percentile(samples, p):
+    """
+    The ``p``th percentile of the sorted ``samples``, by nearest rank.
+    """
+    if not samples:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(samples)))
+    return samples[min(max(rank, 1), len(samples)) - 1]
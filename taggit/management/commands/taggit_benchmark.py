@@ -0,0 +1,96 @@
+import sys
+from optparse import make_option
+
+import django
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+from django.utils import simplejson
+
+from taggit.benchmarks import BUDGETS, check_budgets, run
+from taggit.benchmarks.cases import CASES
+from taggit.benchmarks.dataset import Scale
+
+
+class Command(NoArgsCommand):
+    help = ("Times taggit's most used operations and counts their queries, "
+        "against a synthetic dataset in a test database, and fails if one "
+        "goes over its budget.  Needs taggit.tests in INSTALLED_APPS.")
+    option_list = NoArgsCommand.option_list + (
+        make_option("--objects", action="store", dest="objects", type="int",
+            default=1000, help="The number of tagged objects.  Defaults to "
+                "1000."),
+        make_option("--tags", action="store", dest="tags", type="int",
+            default=200, help="The number of tags.  Defaults to 200."),
+        make_option("--tags-per-object", action="store",
+            dest="tags_per_object", type="int", default=5,
+            help="The number of tags of each object.  Defaults to 5."),
+        make_option("--content-types", action="store", dest="content_types",
+            type="int", default=2, help="The number of models the objects "
+                "are spread over, up to 4.  Defaults to 2."),
+        make_option("--seed", action="store", dest="seed", type="int",
+            default=0, help="The random seed of the dataset."),
+        make_option("--repeat", action="store", dest="repeat", type="int",
+            default=5, help="The number of runs of each operation.  "
+                "Defaults to 5."),
+        make_option("--cases", action="store", dest="cases", default=None,
+            help="A comma separated list of the operations to run, out of "
+                "%s." % ", ".join([name for name, case in CASES])),
+        make_option("--output", action="store", dest="output", default=None,
+            help="A file to write the results to as JSON."),
+        make_option("--budgets", action="store", dest="budgets",
+            default=None, help="A JSON file of budgets, mapping operations "
+                "to their maximum \"queries\" and \"seconds\", to use instead "
+                "of the built in query budgets."),
+    )
+
+    def handle_noargs(self, **options):
+        if "taggit.tests" not in settings.INSTALLED_APPS:
+            raise CommandError("The benchmarks need taggit.tests in "
+                "INSTALLED_APPS.")
+        try:
+            scale = Scale(objects=options["objects"], tags=options["tags"],
+                tags_per_object=options["tags_per_object"],
+                content_types=options["content_types"], seed=options["seed"])
+        except ValueError, e:
+            raise CommandError(str(e))
+        budgets = BUDGETS
+        if options.get("budgets"):
+            f = open(options["budgets"])
+            try:
+                budgets = simplejson.load(f)
+            finally:
+                f.close()
+        names = None
+        if options.get("cases"):
+            names = options["cases"].split(",")
+        verbosity = int(options.get("verbosity", 1))
+
+        if django.VERSION >= (1, 2):
+            old_name = connection.settings_dict["NAME"]
+        else:
+            old_name = settings.DATABASE_NAME
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run(scale, options["repeat"], names)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        failures = check_budgets(results, budgets)
+
+        if options.get("output"):
+            f = open(options["output"], "w")
+            try:
+                simplejson.dump({"django": django.get_version(),
+                    "scale": scale.as_dict(), "repeat": options["repeat"],
+                    "results": results, "failures": failures}, f, indent=2,
+                    sort_keys=True)
+            finally:
+                f.close()
+        if verbosity >= 1:
+            for name, case in CASES:
+                if name in results:
+                    sys.stdout.write("%-20s %4d queries %9.2f ms\n" % (name,
+                        results[name]["queries"],
+                        results[name]["seconds"] * 1000))
+        if failures:
+            raise CommandError("\n".join(failures))
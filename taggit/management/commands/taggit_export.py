@@ -0,0 +1,130 @@
+import csv
+import sys
+import time
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.utils import simplejson
+from django.utils.encoding import force_unicode
+
+from taggit.models import TaggedItem
+from taggit.utils import get_content_type, get_through_models
+
+
+FORMATS = ("csv", "jsonl")
+
+
+def content_type_label(ct):
+    return "%s.%s" % (ct.app_label, ct.model)
+
+def get_format(options, filename):
+    format = options.get("format")
+    if not format and filename and "." in filename:
+        format = filename.rsplit(".", 1)[1]
+    format = format or "csv"
+    if format not in FORMATS:
+        raise CommandError("Unknown format %r; use one of %s." % (format,
+            ", ".join(FORMATS)))
+    return format
+
+def export_rows(through, batch_size):
+    """
+    Yields a ``(content_type, object_id, tag_name)`` row for every link in
+    ``through``, reading ``batch_size`` links per query.
+    """
+    qs = through.objects.order_by("pk")
+    if issubclass(through, TaggedItem):
+        fields = ("pk", "content_type", "object_id", "tag__name")
+    else:
+        label = content_type_label(get_content_type(
+            through._meta.get_field_by_name("content_object")[0].rel.to))
+        fields = ("pk", "content_object", "tag__name")
+    labels = {}
+    last = None
+    while True:
+        batch_qs = qs
+        if last is not None:
+            batch_qs = qs.filter(pk__gt=last)
+        rows = list(batch_qs.values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        for row in rows:
+            if len(row) == 4:
+                ct_id = row[1]
+                if ct_id not in labels:
+                    labels[ct_id] = content_type_label(
+                        ContentType.objects.get_for_id(ct_id))
+                yield labels[ct_id], row[2], row[3]
+            else:
+                yield label, row[1], row[2]
+        last = rows[-1][0]
+
+
+class Command(BaseCommand):
+    args = "[app_label.ThroughModel ...]"
+    help = ("Writes every tag link as a (content_type, object_id, tag_name) "
+        "row, in CSV or JSON lines.  Exports the links of all through models "
+        "unless some are given.")
+    option_list = BaseCommand.option_list + (
+        make_option("--format", action="store", dest="format", default=None,
+            help="csv or jsonl.  Defaults to the extension of --output, or "
+                "csv."),
+        make_option("--output", action="store", dest="output", default=None,
+            help="The file to write to.  Defaults to standard output."),
+        make_option("--batch-size", action="store", dest="batch_size",
+            type="int", default=1000, help="The number of links read per "
+                "query.  Defaults to 1000."),
+    )
+
+    def handle(self, *labels, **options):
+        throughs = []
+        for label in labels:
+            try:
+                app_label, model_name = label.split(".")
+            except ValueError:
+                raise CommandError("Give through models as "
+                    "app_label.ModelName, not %r." % label)
+            through = models.get_model(app_label, model_name)
+            if through not in get_through_models():
+                raise CommandError("%s isn't a tag through model." % label)
+            throughs.append(through)
+        throughs = throughs or get_through_models()
+        filename = options.get("output")
+        format = get_format(options, filename)
+        batch_size = options.get("batch_size") or 1000
+        verbosity = int(options.get("verbosity", 1))
+
+        if filename:
+            out = open(filename, "wb")
+        else:
+            out = sys.stdout
+        started = time.time()
+        count = 0
+        try:
+            if format == "csv":
+                writer = csv.writer(out)
+                writer.writerow(["content_type", "object_id", "tag_name"])
+            for through in throughs:
+                for ct, object_id, name in export_rows(through, batch_size):
+                    if format == "csv":
+                        writer.writerow([ct, force_unicode(object_id).encode(
+                            "utf-8"), name.encode("utf-8")])
+                    else:
+                        out.write(simplejson.dumps({"content_type": ct,
+                            "object_id": object_id, "tag_name": name}) + "\n")
+                    count += 1
+                    if verbosity >= 2 and count % (batch_size * 10) == 0:
+                        self.report(count, started)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if verbosity >= 1:
+            self.report(count, started)
+
+    def report(self, count, started):
+        # The rows may be going to standard output.
+        elapsed = time.time() - started
+        sys.stderr.write("Exported %d links in %.1f seconds (%.0f links per "
+            "second).\n" % (count, elapsed, count / max(elapsed, 0.001)))
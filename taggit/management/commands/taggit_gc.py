@@ -0,0 +1,45 @@
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import NoArgsCommand
+
+from taggit.bulk import BATCH_SIZE
+from taggit.gc import (delete_dangling_links, delete_unused_tags,
+    tagged_content_types)
+from taggit.management.commands.taggit_export import content_type_label
+
+
+class Command(NoArgsCommand):
+    help = ("Deletes the links of TaggedItem to objects that no longer "
+        "exist, and with --tags the tags nothing uses.")
+    option_list = NoArgsCommand.option_list + (
+        make_option("--tags", action="store_true", dest="tags",
+            default=False, help="Also delete the tags nothing uses."),
+        make_option("--dry-run", action="store_true", dest="dry_run",
+            default=False, help="Only count what would be deleted."),
+        make_option("--batch-size", action="store", dest="batch_size",
+            type="int", default=BATCH_SIZE, help="The number of rows deleted "
+                "per transaction.  Defaults to %d." % BATCH_SIZE),
+    )
+
+    def handle_noargs(self, **options):
+        dry_run = options.get("dry_run")
+        batch_size = options.get("batch_size") or BATCH_SIZE
+        verbosity = int(options.get("verbosity", 1))
+        verb = dry_run and "Would delete" or "Deleted"
+
+        lines = []
+        links = 0
+        for ct_id in tagged_content_types():
+            n = delete_dangling_links(ct_id, batch_size, dry_run)
+            links += n
+            if n and verbosity >= 2:
+                lines.append("%s %d dangling links of %s." % (verb, n,
+                    content_type_label(ContentType.objects.get(pk=ct_id))))
+        summary = "%s %d dangling links" % (verb, links)
+        if options.get("tags"):
+            tags = delete_unused_tags(batch_size, dry_run)
+            summary += " and %d unused tags" % tags
+        lines.append(summary + ".")
+        if verbosity >= 1:
+            return "\n".join(lines)
@@ -0,0 +1,151 @@
+import csv
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils import simplejson
+
+from taggit.bulk import BATCH_SIZE, add_links, get_through
+from taggit.management.commands.taggit_export import get_format
+from taggit.models import Tag
+
+
+def read_rows(f, format):
+    """
+    Yields the ``(content_type, object_id, tag_name)`` rows of ``f``.
+    """
+    if format == "csv":
+        reader = csv.reader(f)
+        for row in reader:
+            if reader.line_num == 1 and row == ["content_type", "object_id",
+                "tag_name"]:
+                continue
+            if row:
+                yield tuple([value.decode("utf-8") for value in row])
+    else:
+        for line in f:
+            line = line.strip()
+            if line:
+                row = simplejson.loads(line)
+                yield row["content_type"], row["object_id"], row["tag_name"]
+
+def pk_to_python(model, value):
+    field = model._meta.pk
+    # The primary key of a child model is a link to its parent's.
+    while field.rel:
+        field = field.rel.get_related_field()
+    return field.to_python(value)
+
+def batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    args = "<file>"
+    help = ("Tags objects from (content_type, object_id, tag_name) rows in "
+        "CSV or JSON lines, as written by taggit_export, creating the tags "
+        "that don't exist yet.  Rows for objects that don't exist are "
+        "skipped.")
+    option_list = BaseCommand.option_list + (
+        make_option("--format", action="store", dest="format", default=None,
+            help="csv or jsonl.  Defaults to the extension of the file, or "
+                "csv."),
+        make_option("--batch-size", action="store", dest="batch_size",
+            type="int", default=1000, help="The number of rows imported per "
+                "transaction.  Defaults to 1000."),
+        make_option("--tags", action="store", dest="tags", default=None,
+            help="The name of the TaggableManager to add tags to, for "
+                "models with more than one."),
+    )
+
+    def handle(self, filename=None, **options):
+        if filename is None or filename == "-":
+            f = sys.stdin
+        else:
+            f = open(filename, "rb")
+        format = get_format(options, filename)
+        batch_size = options.get("batch_size") or 1000
+        verbosity = int(options.get("verbosity", 1))
+
+        self.models = {}
+        self.throughs = {}
+        self.tags = options.get("tags")
+        self.rows = self.added = self.skipped = 0
+        started = time.time()
+        try:
+            for batch in batches(read_rows(f, format), batch_size):
+                transaction.commit_on_success(self.import_batch)(batch)
+                if verbosity >= 2:
+                    sys.stderr.write(self.report(started) + "\n")
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        if verbosity >= 1:
+            return self.report(started)
+
+    def report(self, started):
+        elapsed = time.time() - started
+        return ("Read %d rows and added %d links, skipped %d rows, in %.1f "
+            "seconds (%.0f rows per second)." % (self.rows, self.added,
+            self.skipped, elapsed, self.rows / max(elapsed, 0.001)))
+
+    def get_model(self, label):
+        if label not in self.models:
+            try:
+                app_label, model_name = label.split(".")
+            except ValueError:
+                raise CommandError("Bad content type %r; content types are "
+                    "given as app_label.model." % label)
+            model = models.get_model(app_label, model_name)
+            self.models[label] = model
+            if model is not None:
+                try:
+                    self.throughs[model] = get_through(model, self.tags)
+                except ValueError, e:
+                    raise CommandError(str(e))
+        return self.models[label]
+
+    def import_batch(self, batch):
+        self.rows += len(batch)
+        by_model = {}
+        names = set()
+        for label, object_id, name in batch:
+            model = self.get_model(label)
+            if model is None or not name:
+                self.skipped += 1
+                continue
+            object_id = pk_to_python(model, object_id)
+            by_model.setdefault(model, {}).setdefault(object_id, set()).add(name)
+            names.add(name)
+
+        tag_ids = {}
+        names = sorted(names)
+        for i in xrange(0, len(names), BATCH_SIZE):
+            for name, tag in Tag.objects.get_or_create_by_name(
+                names[i:i + BATCH_SIZE]).iteritems():
+                tag_ids[name] = tag.pk
+
+        for model, tagged in by_model.iteritems():
+            object_ids = tagged.keys()
+            existing = set()
+            for i in xrange(0, len(object_ids), BATCH_SIZE):
+                existing.update(model._default_manager.filter(
+                    pk__in=object_ids[i:i + BATCH_SIZE]
+                ).values_list("pk", flat=True))
+            pairs = []
+            for object_id, tag_names in tagged.iteritems():
+                if object_id not in existing:
+                    self.skipped += len(tag_names)
+                    continue
+                pairs.append((model(pk=object_id),
+                    [tag_ids[name] for name in tag_names]))
+            self.added += add_links(self.throughs[model], pairs)
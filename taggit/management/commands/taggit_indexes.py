@@ -0,0 +1,160 @@
+from optparse import make_option
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.backends.util import truncate_name
+
+from taggit.models import Tag
+from taggit.utils import get_connection, get_through_models
+
+
+class Index(object):
+    def __init__(self, model, fields, unique=False, suffix=None):
+        self.model = model
+        self.table = model._meta.db_table
+        self.columns = tuple([model._meta.get_field(f).column for f in fields])
+        self.unique = unique
+        self.suffix = suffix or "_".join(fields)
+
+    def name(self, connection):
+        return truncate_name("%s_%s" % (self.table, self.suffix),
+            connection.ops.max_name_length())
+
+    def describe(self):
+        return "%s%s (%s)" % (self.unique and "unique " or "", self.table,
+            ", ".join(self.columns))
+
+    def is_covered_by(self, existing, connection):
+        for name, columns, unique, expression in existing:
+            if expression or tuple(columns[:len(self.columns)]) != self.columns:
+                continue
+            if not self.unique or (unique and len(columns) == len(self.columns)):
+                return True
+        return False
+
+    def create_sql(self, connection):
+        qn = connection.ops.quote_name
+        return "CREATE %sINDEX %s ON %s (%s)" % (self.unique and "UNIQUE " or "",
+            qn(self.name(connection)), qn(self.table),
+            ", ".join([qn(c) for c in self.columns]))
+
+    def count_duplicates(self, cursor, connection):
+        qn = connection.ops.quote_name
+        cols = ", ".join([qn(c) for c in self.columns])
+        cursor.execute("SELECT COUNT(*) FROM (SELECT %s FROM %s GROUP BY %s "
+            "HAVING COUNT(*) > 1) dups" % (cols, qn(self.table), cols))
+        return cursor.fetchone()[0]
+
+
+def get_vendor(connection):
+    engine = getattr(connection, "settings_dict", {}).get("ENGINE")
+    engine = (engine or settings.DATABASE_ENGINE).split(".")[-1]
+    for vendor in ("postgres", "postgis", "sqlite", "mysql"):
+        if engine.startswith(vendor):
+            return vendor.replace("postgis", "postgres")
+    raise CommandError("Index introspection isn't supported for the %s "
+        "database backend." % engine)
+
+
+def expected_indexes():
+    indexes = [Index(Tag, ["name"])]
+    for through in get_through_models():
+        if through.object_id_attname() == "object_id":
+            fields = ["content_type", "object_id", "tag"]
+        else:
+            fields = ["content_object", "tag"]
+        indexes.append(Index(through, fields, unique=True,
+            suffix="object_tag_uniq"))
+    return indexes
+
+
+def get_existing_indexes(vendor, cursor, connection, table):
+    """
+    Returns a list of ``(name, columns, unique, is_expression)`` tuples.
+    """
+    qn = connection.ops.quote_name
+    indexes = []
+    if vendor == "sqlite":
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = %s", [table])
+        sql = dict(cursor.fetchall())
+        cursor.execute("PRAGMA index_list(%s)" % qn(table))
+        for row in cursor.fetchall():
+            name, unique = row[1], bool(row[2])
+            cursor.execute("PRAGMA index_info(%s)" % qn(name))
+            columns = [r[2] for r in sorted(cursor.fetchall())]
+            expression = "COLLATE" in (sql.get(name) or "").upper()
+            indexes.append((name, columns, unique, expression))
+    elif vendor == "postgres":
+        cursor.execute("SELECT a.attnum, a.attname FROM pg_catalog.pg_attribute a, "
+            "pg_catalog.pg_class c WHERE c.relname = %s AND a.attrelid = c.oid "
+            "AND a.attnum > 0", [table])
+        attnames = dict(cursor.fetchall())
+        cursor.execute("SELECT c2.relname, idx.indisunique, idx.indkey, "
+            "idx.indexprs IS NOT NULL FROM pg_catalog.pg_class c, "
+            "pg_catalog.pg_class c2, pg_catalog.pg_index idx "
+            "WHERE c.relname = %s AND c.oid = idx.indrelid "
+            "AND idx.indexrelid = c2.oid", [table])
+        for name, unique, indkey, expression in cursor.fetchall():
+            columns = [attnames.get(int(n)) for n in str(indkey).split()]
+            indexes.append((name, columns, unique, expression))
+    elif vendor == "mysql":
+        cursor.execute("SHOW INDEX FROM %s" % qn(table))
+        by_name = {}
+        for row in cursor.fetchall():
+            index = by_name.setdefault(row[2], (row[2], [], not row[1], False))
+            index[1].append((row[3], row[4]))
+        for name, columns, unique, expression in by_name.values():
+            columns.sort()
+            indexes.append((name, [c for _, c in columns], unique, expression))
+    return indexes
+
+
+class Command(BaseCommand):
+    help = ("Reports indexes that taggit's tables are missing, as happens "
+        "with tables created by older versions of taggit.  With --create the "
+        "missing indexes are created.")
+    option_list = BaseCommand.option_list + (
+        make_option("--create", action="store_true", dest="create",
+            default=False, help="Create the missing indexes."),
+        make_option("--database", action="store", dest="database",
+            default=None, help="Nominates a database to check.  Defaults to "
+                "the \"default\" database."),
+    )
+
+    def handle(self, *args, **options):
+        connection = get_connection(options.get("database"))
+        if django.VERSION >= (1, 2):
+            trans_kwargs = {"using": connection.alias}
+        else:
+            trans_kwargs = {}
+        vendor = get_vendor(connection)
+        cursor = connection.cursor()
+        create = options.get("create")
+
+        output = []
+        existing = {}
+        for index in expected_indexes():
+            if index.table not in existing:
+                existing[index.table] = get_existing_indexes(vendor, cursor,
+                    connection, index.table)
+            if index.is_covered_by(existing[index.table], connection):
+                continue
+            if not create:
+                output.append("Missing index on %s" % index.describe())
+                continue
+            if index.unique:
+                duplicates = index.count_duplicates(cursor, connection)
+                if duplicates:
+                    output.append("Can't create index on %s: %d duplicated "
+                        "rows" % (index.describe(), duplicates))
+                    continue
+            cursor.execute(index.create_sql(connection))
+            output.append("Created index %s on %s" % (
+                index.name(connection), index.describe()))
+        transaction.commit_unless_managed(**trans_kwargs)
+        if not output:
+            output.append("All indexes are present.")
+        return "\n".join(output)
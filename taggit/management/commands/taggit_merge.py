@@ -0,0 +1,41 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.encoding import force_unicode
+
+from taggit.bulk import BATCH_SIZE
+from taggit.models import Tag
+from taggit.ops import merge_tags
+
+
+class Command(BaseCommand):
+    args = "<source> [<source> ...] <target>"
+    help = ("Merges the tags named by the sources into the tag named by the "
+        "last argument, which is created if it doesn't exist: their links "
+        "are moved to it and they're deleted.")
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", action="store", dest="batch_size",
+            type="int", default=BATCH_SIZE, help="The number of links moved "
+                "per transaction.  Defaults to %d." % BATCH_SIZE),
+    )
+
+    def handle(self, *names, **options):
+        if len(names) < 2:
+            raise CommandError("Give the tags to merge and the tag to merge "
+                "them into.")
+        names = [force_unicode(name) for name in names]
+        sources, target = names[:-1], names[-1]
+        found = set(Tag.objects.filter(name__in=sources).values_list("name",
+            flat=True))
+        missing = [name for name in sources if name not in found]
+        if missing:
+            raise CommandError(("No tags named %s." % ", ".join(missing)
+                ).encode("utf-8"))
+        started = time.time()
+        moved, dropped = merge_tags(sources, target,
+            options.get("batch_size") or BATCH_SIZE)
+        if int(options.get("verbosity", 1)) >= 1:
+            return ("Merged %d tags into %s, moving %d links and dropping %d "
+                "duplicates, in %.1f seconds." % (len(sources), target, moved,
+                dropped, time.time() - started)).encode("utf-8")
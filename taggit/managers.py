@@ -2,15 +2,20 @@ from collections import defaultdict
 import django
 from django.contrib.contenttypes.generic import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, IntegrityError, transaction
 from django.db.models.fields.related import ManyToManyRel
-from django.db.models.related import RelatedObject
+from django.db.models.query import QuerySet
 from django.db.models.query_utils import QueryWrapper
 from django.utils.translation import ugettext_lazy as _
 
+from taggit.cache import TagsCache, cache_tags, invalidate_tags
 from taggit.forms import TagField
+from taggit.instrumentation import (finish, instrumented, note_rows,
+    recording, start)
 from taggit.models import Tag, TaggedItem
-from taggit.utils import require_instance_manager
+from taggit.utils import (require_instance_manager, bulk_insert,
+    get_connection, get_subclass_content_types, tag_counts_installed,
+    update_tag_counts)
 
 try:
     all
@@ -26,6 +31,30 @@ except NameError:
                     return False
             return True
 
+# Intersecting the objects of each tag in Python is quicker than grouping
+# the links in the database when one of the tags has at most this many.
+INTERSECTION_LIMIT = 500
+
+
+def _manager_model(args, kwargs):
+    return args[0].model
+
+def _tag_args(args, kwargs, result):
+    return len(args) - 1
+
+def _tags_arg(args, kwargs, result):
+    if len(args) > 1:
+        return len(args[1])
+    return len(kwargs["tags"])
+
+def _result_len(args, kwargs, result):
+    if result is None:
+        return None
+    return len(result)
+
+def _instrumented(operation, tags=None, rows=None):
+    return instrumented(operation, model=_manager_model, tags=tags, rows=rows)
+
 
 class TaggableRel(ManyToManyRel):
     def __init__(self, to):
@@ -38,9 +67,10 @@ class TaggableRel(ManyToManyRel):
 
 
 class TaggableManager(object):
-    def __init__(self, verbose_name=_("Tags"), through=None):
+    def __init__(self, verbose_name=_("Tags"), through=None, cache=False):
         self.use_gfk = through is None
         self.through = through or TaggedItem
+        self.cache = cache
         self.rel = TaggableRel(to=self.through)
         self.verbose_name = verbose_name
         self.editable = True
@@ -56,7 +86,8 @@ class TaggableManager(object):
         models.Field.creation_counter += 1
 
     def __get__(self, instance, model):
-        manager = _TaggableManager(through=self.through)
+        manager = _TaggableManager(through=self.through,
+            cache_name=self.get_cache_name(), shared_cache=self.cache)
         manager.model = model
         if instance is not None and instance.pk is None:
             raise ValueError("%s objects need to have a primary key value "
@@ -70,6 +101,11 @@ class TaggableManager(object):
         cls._meta.add_field(self)
         setattr(cls, name, self)
         setattr(cls,self.attname,self.name)
+        if self.cache:
+            cache_tags(self.through)
+
+    def get_cache_name(self):
+        return "_%s_cache" % self.name
 
     def save_form_data(self, instance, value):
         getattr(instance, self.name).set(*value)
@@ -121,7 +157,13 @@ class TaggableManager(object):
 
     def value_from_object(self, instance):
         if instance.pk:
-            return self.through.objects.filter(**self.through.lookup_kwargs(instance))
+            lookup_kwargs = self.through.lookup_kwargs(instance)
+            qs = self.through.objects.filter(**lookup_kwargs).select_related("tag")
+            cached = getattr(instance, self.get_cache_name(), None)
+            if cached is not None:
+                qs._result_cache = [self.through(tag=tag, **lookup_kwargs)
+                    for tag in cached]
+            return qs
         return self.through.objects.none()
 
     def related_query_name(self):
@@ -147,72 +189,251 @@ class TaggableManager(object):
         if negate or not self.use_gfk:
             return []
         prefix = "__".join(pieces[:pos+1])
-        cts = map(ContentType.objects.get_for_model, _get_subclasses(self.model))
+        cts = get_subclass_content_types(self.model)
         if len(cts) == 1:
             return [("%s__content_type" % prefix, cts[0])]
         return [("%s__content_type__in" % prefix, cts)]
 
 
 class _TaggableManager(models.Manager):
-    def __init__(self, through):
+    def __init__(self, through, cache_name, shared_cache=False):
         self.through = through
+        self.cache_name = cache_name
+        self.shared_cache = shared_cache
         
     def get_query_set(self):
-        return self.through.tags_for(self.model, self.instance)
+        if self.instance is None:
+            if tag_counts_installed():
+                from taggit.contrib.counts.utils import tags_for
+                return tags_for(self.through, self.model)
+            return self.through.tags_for(self.model)
+        qs = self.through.tags_for(self.model, self.instance)
+        cached = self._get_cache()
+        tags_cache = None
+        if cached is None and self.shared_cache:
+            tags_cache = TagsCache.for_instance(self.through, self.instance)
+            cached = tags_cache.get()
+            if cached is not None:
+                self._set_cache(cached)
+        if cached is not None:
+            qs._result_cache = list(cached)
+            return qs
+        qs = qs._clone(klass=_TagCachingQuerySet)
+        qs.cache_instance = self.instance
+        qs.cache_name = self.cache_name
+        qs.tags_cache = tags_cache
+        return qs
+
+    def _get_cache(self):
+        return self.instance.__dict__.get(self.cache_name)
+
+    def _set_cache(self, tags):
+        self.instance.__dict__[self.cache_name] = list(tags)
+
+    @require_instance_manager
+    def refresh_tags(self):
+        """
+        Throws away the tags cached on the instance, so they're read from the
+        database again the next time they're needed.
+        """
+        self.instance.__dict__.pop(self.cache_name, None)
+
+    def _tags_changed(self):
+        invalidate_tags(self.through, [self.instance])
+
+    @_instrumented("names", tags=_result_len, rows=_result_len)
+    @require_instance_manager
+    def names(self):
+        """
+        Returns the names of the object's tags.
+        """
+        return [tag.name for tag in self.get_query_set()]
 
     def _lookup_kwargs(self):
         return self.through.lookup_kwargs(self.instance)
     
+    def _to_tag_model_instances(self, tags):
+        """
+        Takes an iterable of ``Tag`` objects and tag names and returns the
+        matching ``Tag`` objects, creating any that don't exist yet.
+        """
+        tag_objs = set([t for t in tags if isinstance(t, Tag)])
+        str_tags = set([t for t in tags if not isinstance(t, Tag)])
+        tag_objs.update(Tag.objects.get_or_create_many(str_tags))
+        return tag_objs
+
+    @_instrumented("add", tags=_tag_args)
     @require_instance_manager
     def add(self, *tags):
-        for tag in tags:
-            if not isinstance(tag, Tag):
-                tag, _ = Tag.objects.get_or_create(name=tag)
-            self.through.objects.get_or_create(tag=tag, **self._lookup_kwargs())
+        tag_objs = self._to_tag_model_instances(tags)
+        if not tag_objs:
+            return
+        existing = set(self.through.objects.filter(tag__in=tag_objs,
+            **self._lookup_kwargs()).values_list("tag", flat=True))
+        self._add_links(tag_objs, existing)
+        self._tags_changed()
+        cached = self._get_cache()
+        if cached is not None:
+            cached_pks = set([t.pk for t in cached])
+            self._set_cache(cached + [t for t in tag_objs if t.pk not in cached_pks])
+
+    def _add_links(self, tag_objs, existing):
+        lookup_kwargs = self._lookup_kwargs()
+        new = [tag for tag in tag_objs if tag.pk not in existing]
+        if not new:
+            return
+        added = [tag.pk for tag in new]
+        if django.VERSION >= (1, 2):
+            from django.db import router
+            using = router.db_for_write(self.through, instance=self.instance)
+            trans_kwargs = {"using": using}
+        else:
+            using = None
+            trans_kwargs = {}
+        sid = transaction.savepoint(**trans_kwargs)
+        try:
+            bulk_insert(self.through, [self.through(tag=tag, **lookup_kwargs)
+                for tag in new], using=using)
+        except IntegrityError:
+            # Some of the links were added concurrently.
+            transaction.savepoint_rollback(sid, **trans_kwargs)
+            added = []
+            for tag in new:
+                _, created = self.through.objects.get_or_create(tag=tag,
+                    **lookup_kwargs)
+                if created:
+                    added.append(tag.pk)
+        else:
+            transaction.savepoint_commit(sid, **trans_kwargs)
+        update_tag_counts(self.through, self.instance, added, 1)
+        note_rows(len(added))
 
+    def _delete_links(self, qs):
+        # The deleted links are only looked up when they have to be counted,
+        # as that costs a query; the ORM's delete doesn't say how many it
+        # deleted.
+        if not (tag_counts_installed() or recording()):
+            qs.delete()
+            return
+        rows = list(qs.values_list("pk", "tag"))
+        if not rows:
+            return
+        # Deleting just the links looked up keeps the counts exact.
+        self.through.objects.filter(pk__in=[pk for pk, tag_id in rows]).delete()
+        update_tag_counts(self.through, self.instance,
+            [tag_id for pk, tag_id in rows], -1)
+        note_rows(len(rows))
+
+    @_instrumented("set", tags=_tag_args)
     @require_instance_manager
     def set(self, *tags):
-        self.clear()
-        self.add(*tags)
+        """
+        Makes ``tags`` the object's tags, only adding and removing the links
+        that actually change.
+        """
+        # Read from the database rather than the cache; a stale cache mustn't
+        # decide what gets written.
+        current = list(self.through.tags_for(self.model, self.instance))
+        current_pks = set([t.pk for t in current])
+        current_names = dict([(t.name, t.pk) for t in current])
+        keep = set()
+        new = []
+        for tag in tags:
+            if isinstance(tag, Tag):
+                if tag.pk in current_pks:
+                    keep.add(tag.pk)
+                    continue
+            elif tag in current_names:
+                keep.add(current_names[tag])
+                continue
+            new.append(tag)
 
+        removed = current_pks - keep
+        if removed:
+            self._delete_links(self.through.objects.filter(tag__in=removed,
+                **self._lookup_kwargs()))
+        tag_objs = [t for t in current if t.pk in keep]
+        if new:
+            new = self._to_tag_model_instances(new)
+            self._add_links(new, current_pks)
+            tag_objs.extend([t for t in new if t.pk not in current_pks])
+        if removed or new:
+            self._tags_changed()
+        self._set_cache(tag_objs)
+
+    @_instrumented("remove", tags=_tag_args)
     @require_instance_manager
     def remove(self, *tags):
-        self.through.objects.filter(**self._lookup_kwargs()).filter(
-            tag__name__in=tags).delete()
+        self._delete_links(self.through.objects.filter(
+            **self._lookup_kwargs()).filter(tag__name__in=tags))
+        self._tags_changed()
+        cached = self._get_cache()
+        if cached is not None:
+            self._set_cache([t for t in cached if t.name not in tags])
 
+    @_instrumented("clear")
     @require_instance_manager
     def clear(self):
-        self.through.objects.filter(**self._lookup_kwargs()).delete()
+        self._delete_links(self.through.objects.filter(**self._lookup_kwargs()))
+        self._tags_changed()
+        self._set_cache([])
 
+    @_instrumented("most_common")
     def most_common(self):
+        if self.instance is None and tag_counts_installed():
+            from taggit.contrib.counts.utils import most_common
+            return most_common(self.through, self.model)
         return self.get_query_set().annotate(
             num_times=models.Count(self.through.tag_relname())
         ).order_by('-num_times')
 
+    @_instrumented("similar_objects", rows=_result_len)
     @require_instance_manager
-    def similar_objects(self):
+    def similar_objects(self, limit=None, min_overlap=1, score="count"):
+        """
+        Returns a list of the objects sharing the most tags with this one.
+
+        Each object gets a ``similar_tags`` attribute, the number of shared
+        tags, and a ``similarity`` attribute, the score the list is ordered
+        by: the number of shared tags for ``score="count"``, or the Jaccard
+        index of the two tag sets for ``score="jaccard"``.  Objects sharing
+        fewer than ``min_overlap`` tags are left out.  Only the first
+        ``limit`` objects are loaded.
+        """
+        if score not in ("count", "jaccard"):
+            raise ValueError("Unknown similarity score %r, use 'count' or "
+                "'jaccard'." % score)
         lookup_kwargs = self._lookup_kwargs()
         lookup_keys = sorted(lookup_kwargs)
-        qs = self.through.objects.values(*lookup_kwargs.keys())
-        qs = qs.annotate(n=models.Count('pk'))
-        qs = qs.exclude(**lookup_kwargs)
-        qs = qs.filter(tag__in=self.all())
-        qs = qs.order_by('-n')
-        
-        # TODO: This all feels like a bit of a hack.
+
+        if score == "count":
+            qs = self.through.objects.values(*lookup_kwargs.keys())
+            qs = qs.annotate(n=models.Count('pk'))
+            qs = qs.exclude(**lookup_kwargs)
+            qs = qs.filter(tag__in=self.all())
+            if min_overlap > 1:
+                qs = qs.filter(n__gte=min_overlap)
+            qs = qs.order_by('-n')
+            if limit is not None:
+                qs = qs[:limit]
+            rows = list(qs)
+            for row in rows:
+                row["similarity"] = row["n"]
+        else:
+            rows = self._jaccard_rows(lookup_kwargs, lookup_keys, limit,
+                min_overlap)
+
         items = {}
         if len(lookup_keys) == 1:
-            # Can we do this without a second query by using a select_related()
-            # somehow?
             f = self.through._meta.get_field_by_name(lookup_keys[0])[0]
             objs = f.rel.to._default_manager.filter(**{
-                "%s__in" % f.rel.field_name: [r["content_object"] for r in qs]
+                "%s__in" % f.rel.field_name: [r["content_object"] for r in rows]
             })
             for obj in objs:
                 items[(getattr(obj, f.rel.field_name),)] = obj
         else:
             preload = {}
-            for result in qs:
+            for result in rows:
                 preload.setdefault(result['content_type'], set())
                 preload[result["content_type"]].add(result["object_id"])
 
@@ -222,20 +443,235 @@ class _TaggableManager(models.Manager):
                     items[(ct.pk, obj.pk)] = obj
 
         results = []
-        for result in qs:
-            obj = items[
-                tuple(result[k] for k in lookup_keys)
-            ]
+        for result in rows:
+            obj = items.get(tuple([result[k] for k in lookup_keys]))
+            if obj is None:
+                # Left behind by a deleted object.
+                continue
             obj.similar_tags = result["n"]
+            obj.similarity = result["similarity"]
             results.append(obj)
         return results
 
+    def _jaccard_rows(self, lookup_kwargs, lookup_keys, limit, min_overlap):
+        """
+        Returns the keys of the objects sharing tags with this one, with the
+        number shared as ``n`` and their Jaccard index as ``similarity``,
+        best first.  The union of two tag sets depends on how many tags each
+        object has, so the candidates are counted, scored and ranked in the
+        database, and only the first ``limit`` are loaded.
+        """
+        if django.VERSION >= (1, 2):
+            from django.db import router
+            using = router.db_for_read(self.through, instance=self.instance)
+        else:
+            using = None
+        connection = get_connection(using)
+        qn = connection.ops.quote_name
+        opts = self.through._meta
+        columns = [qn(opts.get_field(k).column) for k in lookup_keys]
+        own = [getattr(lookup_kwargs[k], "pk", lookup_kwargs[k])
+            for k in lookup_keys]
+        params = {
+            "table": qn(opts.db_table),
+            "tag": qn(opts.get_field("tag").column),
+            "keys": ", ".join(columns),
+            "same": " AND ".join(["t.%s = c.%s" % (c, c) for c in columns]),
+            "own": " AND ".join(["o.%s = %%s" % c for c in columns]),
+            "not_own": " OR ".join(["%s <> %%s" % c for c in columns]),
+        }
+        sql = ("SELECT %(keys)s, n, total, own FROM (SELECT c.*, "
+            "(SELECT COUNT(*) FROM %(table)s t WHERE %(same)s) AS total, "
+            "(SELECT COUNT(*) FROM %(table)s o WHERE %(own)s) AS own "
+            "FROM (SELECT %(keys)s, COUNT(*) AS n FROM %(table)s WHERE %(tag)s "
+            "IN (SELECT o.%(tag)s FROM %(table)s o WHERE %(own)s) AND "
+            "(%(not_own)s) GROUP BY %(keys)s HAVING COUNT(*) >= %%s) c) s "
+            "ORDER BY 1.0 * n / (own + total - n) DESC, n DESC" % params)
+        args = own + own + own + [min_overlap]
+        if limit is not None:
+            sql += " LIMIT %s"
+            args.append(limit)
+        cursor = connection.cursor()
+        cursor.execute(sql, args)
+        rows = []
+        for row in cursor.fetchall():
+            n, total, own_total = row[-3:]
+            row = dict(zip(lookup_keys, row))
+            row["n"] = n
+            row["similarity"] = float(n) / (own_total + total - n)
+            rows.append(row)
+        return rows
+
+    @_instrumented("tagged_with_all", tags=_tags_arg)
+    def tagged_with_all(self, tags, queryset=None):
+        """
+        Returns the objects tagged with every one of ``tags``, Tag objects or
+        names, out of ``queryset`` or all of the model's objects.
+        """
+        queryset = self._object_queryset(queryset)
+        tag_ids, complete = self._tag_ids(tags)
+        if not complete:
+            return queryset.none()
+        if len(tag_ids) <= 1:
+            return self._filter_tagged(queryset, tag_ids)
+        field = self._object_field()
+        uses = self._tag_uses(tag_ids)
+        if uses is not None and min(uses.values()) <= INTERSECTION_LIMIT:
+            # One tag is rare: narrow its few objects down tag by tag.
+            object_ids = None
+            for tag_id in sorted(tag_ids, key=uses.get):
+                qs = self._links([tag_id])
+                if object_ids is not None:
+                    qs = qs.filter(**{"%s__in" % field: object_ids})
+                object_ids = list(qs.values_list(field, flat=True))
+                if not object_ids:
+                    break
+            return queryset.filter(pk__in=object_ids)
+        return queryset.filter(pk__in=self._links(tag_ids).values(field).annotate(
+            n=models.Count("tag", distinct=True)
+        ).filter(n=len(tag_ids)).values_list(field, flat=True))
+
+    @_instrumented("tagged_with_any", tags=_tags_arg)
+    def tagged_with_any(self, tags, queryset=None):
+        """
+        Returns the objects tagged with at least one of ``tags`` out of
+        ``queryset`` or all of the model's objects.
+        """
+        queryset = self._object_queryset(queryset)
+        tag_ids, complete = self._tag_ids(tags)
+        if not tag_ids:
+            return queryset.none()
+        return self._filter_tagged(queryset, tag_ids)
+
+    @_instrumented("tagged_without", tags=_tags_arg)
+    def tagged_without(self, tags, queryset=None):
+        """
+        Returns the objects tagged with none of ``tags`` out of ``queryset``
+        or all of the model's objects.
+        """
+        queryset = self._object_queryset(queryset)
+        tag_ids, complete = self._tag_ids(tags)
+        if not tag_ids:
+            return queryset
+        return queryset.exclude(pk__in=self._links(tag_ids).values_list(
+            self._object_field(), flat=True))
+
+    def _object_queryset(self, queryset):
+        if queryset is None:
+            return self.model._default_manager.all()
+        return queryset
+
+    def _object_field(self):
+        if issubclass(self.through, TaggedItem):
+            return "object_id"
+        return "content_object"
+
+    def _links(self, tag_ids):
+        qs = self.through.objects.filter(tag__in=tag_ids)
+        if issubclass(self.through, TaggedItem):
+            qs = qs.filter(content_type__in=get_subclass_content_types(self.model))
+        return qs
+
+    def _filter_tagged(self, queryset, tag_ids):
+        if not tag_ids:
+            return queryset
+        return queryset.filter(pk__in=self._links(tag_ids).values_list(
+            self._object_field(), flat=True))
+
+    def _tag_ids(self, tags):
+        """
+        Returns the ids of ``tags`` and whether all of them exist.
+        """
+        tag_ids = set()
+        names = set()
+        for tag in tags:
+            if isinstance(tag, Tag):
+                tag_ids.add(tag.pk)
+            else:
+                names.add(tag)
+        if not names:
+            return tag_ids, True
+        found = set()
+        for pk, name in Tag.objects.filter(name__in=names).values_list("pk", "name"):
+            tag_ids.add(pk)
+            found.add(name)
+        return tag_ids, len(found) == len(names)
+
+    def _tag_uses(self, tag_ids):
+        """
+        Returns how many of the model's objects use each of ``tag_ids``, if
+        the counts are kept, otherwise ``None``.
+        """
+        if not tag_counts_installed():
+            return None
+        from taggit.contrib.counts.utils import tag_uses
+        return tag_uses(self.through, self.model, tag_ids)
+
+
+class _TagCachingQuerySet(QuerySet):
+    """
+    The tags of a single object.  The first time the queryset is evaluated
+    the tags are stored on the object, so later ``obj.tags.all()`` calls
+    don't hit the database, and also in Django's cache when the
+    ``TaggableManager`` has ``cache=True``.  Querysets derived from it aren't
+    cached.
+    """
+    cache_instance = None
+    cache_name = None
+    tags_cache = None
+
+    def iterator(self):
+        if self.cache_instance is None:
+            return super(_TagCachingQuerySet, self).iterator()
+        record = start("all", self.cache_instance.__class__)
+        tags = []
+        try:
+            tags = list(super(_TagCachingQuerySet, self).iterator())
+            self.cache_instance.__dict__[self.cache_name] = list(tags)
+            if self.tags_cache is not None:
+                self.tags_cache.set(tags)
+        finally:
+            finish(record, tags=len(tags), rows=len(tags))
+        return iter(tags)
+
+
+class TaggedQuerySet(QuerySet):
+    """
+    A queryset with the tag filters of the model's ``TaggableManager``.
+    """
+    def _tags_manager(self):
+        for field in self.model._meta.many_to_many:
+            if isinstance(field, TaggableManager):
+                return getattr(self.model, field.name)
+        raise TypeError("%s has no TaggableManager." %
+            self.model._meta.object_name)
+
+    def tagged_with_all(self, tags):
+        return self._tags_manager().tagged_with_all(tags, self)
+
+    def tagged_with_any(self, tags):
+        return self._tags_manager().tagged_with_any(tags, self)
+
+    def tagged_without(self, tags):
+        return self._tags_manager().tagged_without(tags, self)
+
+
+class TaggedManager(models.Manager):
+    """
+    A manager for tagged models, whose querysets have the
+    ``tagged_with_all``, ``tagged_with_any`` and ``tagged_without`` filters.
+    """
+    def get_query_set(self):
+        if django.VERSION >= (1, 2):
+            return TaggedQuerySet(self.model, using=self._db)
+        return TaggedQuerySet(self.model)
+
+    def tagged_with_all(self, tags):
+        return self.get_query_set().tagged_with_all(tags)
+
+    def tagged_with_any(self, tags):
+        return self.get_query_set().tagged_with_any(tags)
+
+    def tagged_without(self, tags):
+        return self.get_query_set().tagged_without(tags)
 
-def _get_subclasses(model):
-    subclasses = [model]
-    for f in model._meta.get_all_field_names():
-        field = model._meta.get_field_by_name(f)[0]
-        if (isinstance(field, RelatedObject) and
-            getattr(field.field.rel, "parent_link", None)):
-            subclasses.extend(_get_subclasses(field.model))
-    return subclasses
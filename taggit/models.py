@@ -1,14 +1,132 @@
+import copy
+
 import django
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericForeignKey
 from django.db import models, IntegrityError, transaction
+from django.db.models.signals import (post_init, pre_save, post_save,
+    post_delete)
 from django.template.defaultfilters import slugify
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
 from django.utils.translation import ugettext_lazy as _, ugettext
 
+from taggit.cache import CachedValue
+from taggit.utils import bulk_insert, get_content_type
+
+
+def _slug_cache(slug):
+    # Cache keys can't hold every character a slug in a URL might.
+    return CachedValue("taggit.tag:%s" % md5_constructor(smart_str(slug)).hexdigest(),
+        lambda: Tag.objects.get(slug=slug))
+
+
+class TagManager(models.Manager):
+    def get_or_create_many(self, names):
+        """
+        Returns a list of ``Tag`` objects named ``names``, creating the ones
+        that don't exist yet.  The number of queries doesn't depend on how
+        many names are given.  Tags are created in bulk, without sending the
+        ``pre_save`` and ``post_save`` signals, except those whose slug is
+        taken, which are saved one by one.
+        """
+        names = set(names)
+        if not names:
+            return []
+        tags, missing = self._existing(names)
+        if missing:
+            tags.extend(self._create_many(missing))
+        return tags
+
+    def get_or_create_by_name(self, names):
+        """
+        Like ``get_or_create_many()``, but returns a dict of the tag of each
+        of ``names``.  Under a collation that ignores case or accents a name
+        may get a tag written differently.
+        """
+        names = set(names)
+        tags = self.get_or_create_many(names)
+        by_name = dict([(tag.name, tag) for tag in tags])
+        result = {}
+        for name in names:
+            if name in by_name:
+                result[name] = by_name[name]
+            else:
+                # Rare, so the database is asked which tag it matched.
+                result[name] = self.get(name=name)
+        return result
+
+    def _existing(self, names):
+        """
+        Returns the tags named ``names`` and the names with no tag, matched
+        the way the database compares them.
+        """
+        tags = list(self.filter(name__in=names))
+        missing = names - set([t.name for t in tags])
+        # Some collations, like MySQL's default one, ignore case, so a tag
+        # may have been found for a name written differently.  Only the
+        # database can tell, so it's asked about those names on their own.
+        found = set([t.name.lower() for t in tags])
+        alike = [name for name in missing if name.lower() in found]
+        if alike:
+            matched = set([name.lower() for name in self.filter(
+                name__in=alike).values_list("name", flat=True)])
+            missing.difference_update([name for name in alike
+                if name.lower() in matched])
+        return tags, missing
+
+    def get_by_slug(self, slug):
+        """
+        Returns the tag with ``slug``, from a cache kept up to date as tags
+        are saved and deleted.  Raises ``Tag.DoesNotExist`` if there's no
+        such tag.  The tag is a copy, so changing it leaves the cache alone.
+        """
+        tag = copy.copy(_slug_cache(slug).get())
+        if hasattr(tag, "_state"):
+            tag._state = copy.copy(tag._state)
+        return tag
+
+    def _create_many(self, names):
+        if django.VERSION >= (1, 2):
+            using = self.db
+            trans_kwargs = {"using": using}
+        else:
+            using = None
+            trans_kwargs = {}
+        slugs = {}
+        for name in sorted(names):
+            slugs.setdefault(slugify(name), name)
+        taken = set(self.filter(slug__in=slugs.keys()).values_list("slug", flat=True))
+        bulk = dict((name, slug) for slug, name in slugs.iteritems()
+            if slug and slug not in taken)
+        # Names whose slug is already used, or shared with another new name,
+        # go through Tag.save(), which knows how to pick a free slug.
+        slow = names.difference(bulk)
+
+        tags = []
+        if bulk:
+            sid = transaction.savepoint(**trans_kwargs)
+            try:
+                bulk_insert(self.model, [self.model(name=name, slug=slug)
+                    for name, slug in bulk.iteritems()], using=using)
+            except IntegrityError:
+                # Somebody else created some of these in the meantime.
+                transaction.savepoint_rollback(sid, **trans_kwargs)
+                tags, missing = self._existing(set(bulk))
+                slow.update(missing)
+            else:
+                transaction.savepoint_commit(sid, **trans_kwargs)
+                tags = list(self.filter(slug__in=bulk.values()))
+        for name in sorted(slow):
+            tags.append(self.create(name=name))
+        return tags
+
 
 class Tag(models.Model):
-    name = models.CharField(verbose_name=_('Name'), max_length=100)
+    name = models.CharField(verbose_name=_('Name'), max_length=100, db_index=True)
     slug = models.SlugField(verbose_name=_('Slug'), unique=True, max_length=100)
+
+    objects = TagManager()
     
     def __unicode__(self):
         return self.name
@@ -45,6 +163,62 @@ class Tag(models.Model):
         else:
             return super(Tag, self).save(*args, **kwargs)
 
+    def iter_tagged_objects(self, model=None, chunk_size=1000):
+        """
+        Yields the objects tagged with this tag, or only those of ``model``.
+        The links are read ``chunk_size`` at a time in order of their primary
+        key, and each chunk's objects are loaded with one query per model,
+        so memory use doesn't grow with the number of objects.  Links to
+        objects that no longer exist are skipped.
+        """
+        from taggit.bulk import get_through, in_bulk
+        from taggit.utils import get_subclass_content_types, get_through_models
+        if model is not None:
+            throughs = [get_through(model)]
+        else:
+            throughs = get_through_models()
+        for through in throughs:
+            qs = through.objects.filter(tag=self).order_by("pk")
+            if issubclass(through, TaggedItem):
+                if model is not None:
+                    qs = qs.filter(
+                        content_type__in=get_subclass_content_types(model))
+                fields = ("pk", "content_type", "object_id")
+            else:
+                fields = ("pk", "content_object")
+                target = model or through._meta.get_field_by_name(
+                    "content_object")[0].rel.to
+            last = None
+            while True:
+                chunk_qs = qs
+                if last is not None:
+                    chunk_qs = qs.filter(pk__gt=last)
+                rows = list(chunk_qs.values_list(*fields)[:chunk_size])
+                if not rows:
+                    break
+                last = rows[-1][0]
+                if len(fields) == 2:
+                    objects = in_bulk(target, [row[1] for row in rows])
+                    keys = [row[1] for row in rows]
+                else:
+                    by_type = {}
+                    for pk, ct_id, object_id in rows:
+                        by_type.setdefault(ct_id, []).append(object_id)
+                    objects = {}
+                    for ct_id, object_ids in by_type.iteritems():
+                        model_class = ContentType.objects.get_for_id(
+                            ct_id).model_class()
+                        if model_class is None:
+                            continue
+                        for pk, obj in in_bulk(model_class,
+                            object_ids).iteritems():
+                            objects[(ct_id, pk)] = obj
+                    keys = [(row[1], row[2]) for row in rows]
+                for key in keys:
+                    if key in objects:
+                        yield objects[key]
+
+
 class TaggedItemBase(models.Model):
     if django.VERSION < (1, 2):
         tag = models.ForeignKey(Tag, related_name="%(class)s_items")
@@ -59,6 +233,10 @@ class TaggedItemBase(models.Model):
     
     class Meta:
         abstract = True
+        # Subclasses which define their own Meta should inherit from this
+        # one to keep the constraint, which also indexes the lookup of an
+        # object's tags.
+        unique_together = (('content_object', 'tag'),)
 
     @classmethod
     def tag_relname(cls):
@@ -70,6 +248,16 @@ class TaggedItemBase(models.Model):
             'content_object': instance
         }
 
+    @classmethod
+    def bulk_lookup_kwargs(cls, instances):
+        return {
+            'content_object__in': instances
+        }
+
+    @classmethod
+    def object_id_attname(cls):
+        return cls._meta.get_field_by_name('content_object')[0].attname
+
     @classmethod
     def tags_for(cls, model, instance=None):
         if instance is not None:
@@ -82,7 +270,7 @@ class TaggedItemBase(models.Model):
 
 
 class TaggedItem(TaggedItemBase):
-    object_id = models.IntegerField(verbose_name=_('Object id'))
+    object_id = models.IntegerField(verbose_name=_('Object id'), db_index=True)
     content_type = models.ForeignKey(ContentType, verbose_name=_('Content type'),
         related_name="tagged_items")
     content_object = GenericForeignKey()
@@ -90,17 +278,32 @@ class TaggedItem(TaggedItemBase):
     class Meta:
         verbose_name = _("Tagged Item")
         verbose_name_plural = _("Tagged Items")
+        # Column order matters: the index behind the constraint also serves
+        # looking up the tags of an object.
+        unique_together = (('content_type', 'object_id', 'tag'),)
         
     @classmethod
     def lookup_kwargs(cls, instance):
         return {
             'object_id': instance.pk,
-            'content_type': ContentType.objects.get_for_model(instance)
+            'content_type': get_content_type(instance)
+        }
+
+    @classmethod
+    def bulk_lookup_kwargs(cls, instances):
+        # All instances must be of the same model.
+        return {
+            'object_id__in': [instance.pk for instance in instances],
+            'content_type': get_content_type(instances[0])
         }
 
+    @classmethod
+    def object_id_attname(cls):
+        return 'object_id'
+
     @classmethod
     def tags_for(cls, model, instance=None):
-        ct = ContentType.objects.get_for_model(model)
+        ct = get_content_type(model)
         if instance is not None:
             return Tag.objects.filter(**{
                 '%s__object_id' % cls.tag_relname(): instance.pk,
@@ -110,3 +313,27 @@ class TaggedItem(TaggedItemBase):
             '%s__content_type' % cls.tag_relname(): ct
         }).distinct()
 
+
+def _tag_loaded(sender, instance, **kwargs):
+    # Remembered so that a changed slug is noticed without a query.
+    if instance.pk:
+        instance._loaded_slug = instance.slug
+
+def _tag_changing(sender, instance, raw=False, **kwargs):
+    # A changed slug leaves the tag cached under its old one.
+    slug = instance.__dict__.get("_loaded_slug")
+    if instance.pk and not raw and slug is not None and slug != instance.slug:
+        _slug_cache(slug).invalidate()
+
+def _tag_changed(sender, instance, **kwargs):
+    _slug_cache(instance.slug).invalidate()
+    instance._loaded_slug = instance.slug
+
+post_init.connect(_tag_loaded, sender=Tag,
+    dispatch_uid="taggit.Tag.post_init")
+pre_save.connect(_tag_changing, sender=Tag,
+    dispatch_uid="taggit.Tag.pre_save")
+post_save.connect(_tag_changed, sender=Tag,
+    dispatch_uid="taggit.Tag.post_save")
+post_delete.connect(_tag_changed, sender=Tag,
+    dispatch_uid="taggit.Tag.post_delete")
@@ -0,0 +1,158 @@
+"""
+Operations on whole tags, which rewrite their links with a few statements
+per batch of links rather than object by object.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from taggit.bulk import BATCH_SIZE, _in_transaction, _trans_kwargs
+from taggit.cache import invalidate_links
+from taggit.models import Tag, TaggedItem, TaggedItemBase
+from taggit.utils import (get_connection, get_content_type,
+    get_tag_relations, get_through_models, tag_counts_installed,
+    update_tag_counts)
+
+
+def _is_mysql(connection):
+    engine = getattr(connection, "settings_dict", {}).get("ENGINE")
+    return "mysql" in (engine or settings.DATABASE_ENGINE)
+
+def _object_columns(through):
+    if issubclass(through, TaggedItem):
+        names = ("content_type", "object_id")
+    else:
+        names = ("content_object",)
+    return [through._meta.get_field(name).column for name in names]
+
+def _repoint_links(through, connection, ids, source_id, target_id):
+    """
+    Moves the links ``ids`` of the tag ``source_id`` to ``target_id``, unless
+    their object already has ``target_id``.
+    """
+    qn = connection.ops.quote_name
+    opts = through._meta
+    params = {
+        "table": qn(opts.db_table),
+        "pk": qn(opts.pk.column),
+        "tag": qn(opts.get_field("tag").column),
+        "ids": ", ".join(["%s"] * len(ids)),
+    }
+    params["same"] = " AND ".join(["dup.%s = %s.%s" % (qn(column),
+        params["table"], qn(column)) for column in _object_columns(through)])
+    cursor = connection.cursor()
+    if _is_mysql(connection):
+        # MySQL can't select from the table an UPDATE changes in a subquery,
+        # but it can join it.
+        cursor.execute("UPDATE %(table)s LEFT JOIN %(table)s dup ON "
+            "(dup.%(tag)s = %%s AND %(same)s) SET %(table)s.%(tag)s = %%s "
+            "WHERE %(table)s.%(pk)s IN (%(ids)s) AND dup.%(pk)s IS NULL"
+            % params, [target_id, target_id] + ids)
+    else:
+        cursor.execute("UPDATE %(table)s SET %(tag)s = %%s WHERE %(pk)s IN "
+            "(%(ids)s) AND NOT EXISTS (SELECT 1 FROM %(table)s dup WHERE "
+            "dup.%(tag)s = %%s AND %(same)s)" % params,
+            [target_id] + ids + [target_id])
+    # What's left of the source's links duplicate links to the target.
+    cursor.execute("DELETE FROM %(table)s WHERE %(pk)s IN (%(ids)s) AND "
+        "%(tag)s = %%s" % params, ids + [source_id])
+
+def _merge_batch(through, source_id, target_id, batch_size):
+    """
+    Moves at most ``batch_size`` links of the tag ``source_id`` to
+    ``target_id``.  Returns the number of links moved and dropped, or
+    ``None`` once the source has no links left.
+    """
+    is_gfk = issubclass(through, TaggedItem)
+    fields = ["pk", through.object_id_attname()]
+    if is_gfk:
+        fields.append("content_type")
+    rows = list(through.objects.filter(tag=source_id).order_by("pk")
+        .values_list(*fields)[:batch_size])
+    if not rows:
+        return None
+    using, trans_kwargs = _trans_kwargs(through)
+    ids = [row[0] for row in rows]
+    _repoint_links(through, get_connection(using), ids, source_id, target_id)
+    transaction.commit_unless_managed(**trans_kwargs)
+    moved = set(through.objects.filter(pk__in=ids).values_list("pk",
+        flat=True))
+
+    if not is_gfk:
+        ct_id = get_content_type(
+            through._meta.get_field("content_object").rel.to).pk
+    links = []
+    by_ct = {}
+    for row in rows:
+        if is_gfk:
+            ct_id = row[2]
+        links.append((ct_id, row[1]))
+        counts = by_ct.setdefault(ct_id, [0, 0])
+        counts[0] += 1
+        if row[0] in moved:
+            counts[1] += 1
+    if tag_counts_installed():
+        for ct_id, (total, n) in by_ct.iteritems():
+            # Not get_for_id(), which can't cache a content type without a
+            # model.  The links of a model that's gone are left to the gc,
+            # and its counts to rebuild_tag_counts.
+            model = ContentType.objects.get(pk=ct_id).model_class()
+            if model is None:
+                continue
+            update_tag_counts(through, model, [source_id], -total)
+            update_tag_counts(through, model, [target_id], n)
+    invalidate_links(through, links)
+    return len(moved), len(rows) - len(moved)
+
+def _replace_tag(source, target):
+    """
+    Points the objects related to ``source``, such as its synonyms, at
+    ``target``, and deletes ``source``.
+    """
+    for related in get_tag_relations():
+        model = related.model
+        if issubclass(model, TaggedItemBase):
+            continue
+        # Saved one by one, so the caches built from them are invalidated.
+        for obj in model._default_manager.filter(**{related.field.name: source}):
+            setattr(obj, related.field.name, target)
+            obj.save()
+    if "taggit.contrib.synonyms" in settings.INSTALLED_APPS:
+        from taggit.contrib.synonyms.models import TagSynonym
+        TagSynonym.objects.get_or_create(name=source.name,
+            defaults={"tag": target})
+    source.delete()
+
+def merge_tags(sources, target, batch_size=BATCH_SIZE):
+    """
+    Merges the tags ``sources`` into ``target``, ``Tag`` objects or names.
+    The links of the sources, through every through model, are moved to
+    ``target``, except those of objects already tagged with ``target``,
+    which are dropped.  The objects related to the sources, such as their
+    synonyms, are pointed at ``target``, and the sources are deleted.  With
+    ``taggit.contrib.synonyms`` installed their names become synonyms of
+    ``target``.  ``target`` is created if it doesn't exist.
+
+    The links are moved ``batch_size`` at a time, each batch with one UPDATE
+    and one DELETE in its own transaction, so the through tables are never
+    locked for long.  Returns the number of links moved and dropped.
+    """
+    if not isinstance(target, Tag):
+        target = Tag.objects.get_or_create_many([target])[0]
+    names = [tag for tag in sources if not isinstance(tag, Tag)]
+    sources = [tag for tag in sources if isinstance(tag, Tag)]
+    sources.extend(Tag.objects.filter(name__in=names))
+    moved = dropped = 0
+    for source in dict([(tag.pk, tag) for tag in sources]).itervalues():
+        if source.pk == target.pk:
+            continue
+        for through in get_through_models():
+            while True:
+                result = _in_transaction(through, _merge_batch, through,
+                    source.pk, target.pk, batch_size)
+                if result is None:
+                    break
+                moved += result[0]
+                dropped += result[1]
+        _in_transaction(Tag, _replace_tag, source, target)
+    return moved, dropped
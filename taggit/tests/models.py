@@ -71,3 +71,24 @@ class CustomPKPet(models.Model):
 
 class CustomPKHousePet(CustomPKPet):
     trained = models.BooleanField()
+
+# test tags kept in Django's cache
+
+class CachedFood(models.Model):
+    name = models.CharField(max_length=50)
+
+    tags = TaggableManager(cache=True)
+
+    def __unicode__(self):
+        return self.name
+
+class TaggedCachedFood(TaggedItemBase):
+    content_object = models.ForeignKey('DirectCachedFood')
+
+class DirectCachedFood(models.Model):
+    name = models.CharField(max_length=50)
+
+    tags = TaggableManager(through=TaggedCachedFood, cache=True)
+
+    def __unicode__(self):
+        return self.name
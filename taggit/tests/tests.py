@@ -1,15 +1,40 @@
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from StringIO import StringIO
 from unittest import TestCase as UnitTestCase
 
 from django.test import TestCase, TransactionTestCase
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete, pre_save
+from django.http import Http404, HttpRequest, QueryDict
 
+from taggit.managers import TaggedQuerySet
+from taggit.bulk import add_links, get_through, tag_objects, untag_objects
+from taggit.cache import LocalBackend, _default_backend
+from taggit.gc import delete_links_on_delete
+from taggit.instrumentation import (get_sinks, logger, operation_finished,
+    percentile, recording, reset_sinks)
+from taggit.management.commands.taggit_indexes import get_existing_indexes
 from taggit.models import Tag, TaggedItem
+from taggit.ops import merge_tags
 from taggit.tests.forms import FoodForm, DirectFoodForm, CustomPKFoodForm
 from taggit.tests.models import (Food, Pet, HousePet, DirectFood, DirectPet,
     DirectHousePet, TaggedPet, CustomPKFood, CustomPKPet, CustomPKHousePet,
-    TaggedCustomPKPet)
-from taggit.utils import parse_tags, edit_string_for_tags, post_process_tags, replace_synonyms_with_tags
-from taggit.contrib.synonyms.models import TagSynonym
+    TaggedCustomPKPet, CachedFood, DirectCachedFood)
+from taggit.views import tagged_object_list, tagged_objects
+from taggit.utils import (parse_tags, parse_tags_many, split_strip,
+    edit_string_for_tags, post_process_tags, filter_tags,
+    replace_synonyms_with_tags, prefetch_tags, get_content_type,
+    get_subclass_content_types, clear_content_type_cache)
+from taggit.contrib.synonyms.models import TagSynonym, synonym_map
 
 
 class BaseTaggingTest(object):
@@ -20,6 +45,28 @@ class BaseTaggingTest(object):
             tags.sort()
         self.assertEqual(got, tags)
 
+    def count_queries(self, func, *args, **kwargs):
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        start = len(connection.queries)
+        try:
+            func(*args, **kwargs)
+            return len(connection.queries) - start
+        finally:
+            settings.DEBUG = old_debug
+
+    def assert_num_queries(self, num, func, *args, **kwargs):
+        self.assertEqual(self.count_queries(func, *args, **kwargs), num)
+
+    def call_command(self, *args, **kwargs):
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            call_command(*args, **kwargs)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+
 class BaseTaggingTestCase(TestCase, BaseTaggingTest):
     pass
 
@@ -81,6 +128,96 @@ class TaggableManagerTestCase(BaseTaggingTestCase):
         apple.delete()
         self.assert_tags_equal(self.food_model.tags.all(), ["green"])
 
+    def test_add_queries_independent_of_tag_count(self):
+        apple = self.food_model.objects.create(name="apple")
+        pear = self.food_model.objects.create(name="pear")
+        apple.tags.add("green")
+        few = self.count_queries(apple.tags.add, "red", "sour")
+        many = self.count_queries(pear.tags.add, *["tag%d" % i for i in range(20)])
+        self.assertEqual(few, many)
+        self.assert_tags_equal(pear.tags.all(), ["tag%d" % i for i in range(20)])
+
+        # Tags and links that already exist cost one lookup each.
+        self.assert_num_queries(2, pear.tags.add, "tag1", "tag2", "tag3")
+        self.assert_tags_equal(pear.tags.all(), ["tag%d" % i for i in range(20)])
+
+    def test_set(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.set("red", "green", "sweet")
+        self.assert_tags_equal(apple.tags.all(), ["green", "red", "sweet"])
+        through = apple.tags.through
+        green = through.objects.get(tag__name="green")
+
+        self.assert_num_queries(1, apple.tags.set, "sweet", "red", "green")
+        self.assert_tags_equal(apple.tags.all(), ["green", "red", "sweet"])
+
+        apple.tags.set("green", Tag.objects.get(name="red"), "sour")
+        self.assert_tags_equal(apple.tags.all(), ["green", "red", "sour"])
+        # Unchanged links are left alone.
+        self.assertEqual(
+            through.objects.get(tag__name="green").pk, green.pk)
+
+        apple.tags.set()
+        self.assert_tags_equal(apple.tags.all(), [])
+        self.assert_tags_equal(self.food_model.tags.all(), [])
+
+    def test_prefetch_tags(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green", "red")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("green")
+        self.food_model.objects.create(name="guava")
+
+        foods = list(self.food_model.objects.all())
+        self.assert_num_queries(1, prefetch_tags, foods)
+        self.assert_num_queries(0, lambda: [list(f.tags.all()) for f in foods])
+        apple, pear, guava = foods
+        self.assert_tags_equal(apple.tags.all(), ["green", "red"])
+        self.assert_tags_equal(pear.tags.all(), ["green"])
+        self.assert_tags_equal(guava.tags.all(), [])
+
+        pear.tags.add("juicy")
+        self.assert_tags_equal(pear.tags.all(), ["green", "juicy"])
+        apple.tags.remove("red")
+        self.assert_tags_equal(apple.tags.all(), ["green"])
+
+    def test_instance_tag_cache(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green", "red")
+        self.assert_num_queries(1, lambda: list(apple.tags.all()))
+        self.assert_num_queries(0, lambda: list(apple.tags.all()))
+        # Derived querysets still go to the database.
+        self.assert_tags_equal(apple.tags.all().filter(name="red"), ["red"])
+
+        self.assert_num_queries(0, lambda: list(apple.tags.all()))
+        apple.tags.add("juicy")
+        self.assert_num_queries(0, lambda: list(apple.tags.all()))
+        self.assert_tags_equal(apple.tags.all(), ["green", "juicy", "red"])
+        apple.tags.remove("green")
+        self.assert_tags_equal(apple.tags.all(), ["juicy", "red"])
+        apple.tags.set("red", "sour")
+        self.assert_num_queries(0, lambda: list(apple.tags.all()))
+        self.assert_tags_equal(apple.tags.all(), ["red", "sour"])
+        apple.tags.clear()
+        self.assert_num_queries(0, lambda: list(apple.tags.all()))
+        self.assert_tags_equal(apple.tags.all(), [])
+
+        # Changes made behind the manager's back need refresh_tags().
+        self.food_model.objects.get(pk=apple.pk).tags.add("ripe")
+        self.assert_tags_equal(apple.tags.all(), [])
+        apple.tags.refresh_tags()
+        self.assert_tags_equal(apple.tags.all(), ["ripe"])
+
+    def test_add_existing_slug(self):
+        apple = self.food_model.objects.create(name="apple")
+        Tag.objects.create(name="Red")
+        apple.tags.add("red", "RED", "green")
+        self.assert_tags_equal(apple.tags.all(), ["RED", "green", "red"])
+        self.assertEqual(
+            sorted(Tag.objects.values_list("slug", flat=True)),
+            ["green", "red", "red_1", "red_2"]
+        )
+
     def test_require_pk(self):
         food_instance = self.food_model()
         self.assertRaises(ValueError, lambda: food_instance.tags.all())
@@ -94,6 +231,22 @@ class TaggableManagerTestCase(BaseTaggingTestCase):
         apple.delete()
         self.assert_tags_equal(strawberry.tags.all(), ["red"])
     
+    def test_delete_signals(self):
+        deleted = []
+        def link_deleted(sender, instance, **kwargs):
+            deleted.append(instance.tag.name)
+        through = get_through(self.food_model)
+        post_delete.connect(link_deleted, sender=through)
+        try:
+            apple = self.food_model.objects.create(name="apple")
+            apple.tags.add("red", "green", "juicy")
+            apple.tags.remove("red")
+            apple.tags.set("green")
+            apple.tags.clear()
+        finally:
+            post_delete.disconnect(link_deleted, sender=through)
+        self.assertEqual(deleted, ["red", "juicy", "green"])
+
     def test_delete_bulk(self):
         apple = self.food_model.objects.create(name="apple")
         kitty = self.pet_model.objects.create(pk=apple.pk,  name="kitty")
@@ -169,6 +322,123 @@ class TaggableManagerTestCase(BaseTaggingTestCase):
         self.assertEqual(similar_objs, [pear, watermelon])
         self.assertEqual(map(lambda x: x.similar_tags, similar_objs), [3, 2])
 
+    def test_similar_objects_options(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green", "juicy", "small", "sour")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("green", "juicy", "small", "sweet")
+        watermelon = self.food_model.objects.create(name="watermelon")
+        watermelon.tags.add("green", "juicy", "large", "sweet")
+        kiwi = self.food_model.objects.create(name="kiwi")
+        kiwi.tags.add("green", "juicy", "small", "sour", "fuzzy", "brown", "hairy")
+
+        self.assertEqual(apple.tags.similar_objects(), [kiwi, pear, watermelon])
+        self.assertEqual(apple.tags.similar_objects(limit=2), [kiwi, pear])
+        self.assertEqual(apple.tags.similar_objects(min_overlap=3), [kiwi, pear])
+
+        similar = apple.tags.similar_objects(score="jaccard")
+        self.assertEqual(similar, [pear, kiwi, watermelon])
+        self.assertEqual([o.similar_tags for o in similar], [3, 4, 2])
+        self.assertEqual([round(o.similarity, 3) for o in similar],
+            [0.6, 0.571, 0.333])
+        self.assertEqual(
+            apple.tags.similar_objects(score="jaccard", limit=1, min_overlap=3),
+            [pear])
+        self.assertRaises(ValueError, apple.tags.similar_objects, score="cosine")
+
+    def test_jaccard_counts_each_object(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green", "juicy")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("green", "sweet", "small", "ripe")
+        # Shares its primary key with the pear: their tags mustn't be mixed.
+        kitty = self.pet_model.objects.create(pk=pear.pk, name="kitty")
+        kitty.tags.add("green", "juicy", "furry")
+        similar = dict([(o.__class__, o.similarity) for o in
+            apple.tags.similar_objects(score="jaccard")])
+        self.assertEqual(round(similar[self.food_model], 3), 0.2)
+        # Only TaggedItem links both models.
+        if get_through(self.food_model) is TaggedItem:
+            self.assertEqual(round(similar[self.pet_model], 3), 0.667)
+        else:
+            self.assertFalse(self.pet_model in similar)
+
+    def test_tagged_with(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green", "red", "sweet")
+        pear = self.food_model.objects.create(name="pear")
+        pear.tags.add("green", "sweet")
+        lemon = self.food_model.objects.create(name="lemon")
+        lemon.tags.add("yellow", "sour")
+        bread = self.food_model.objects.create(name="bread")
+        sweet = Tag.objects.get(name="sweet")
+
+        def names(qs):
+            return sorted([o.name for o in qs])
+
+        tags = self.food_model.tags
+        self.assertEqual(names(tags.tagged_with_all(["green", "sweet"])),
+            ["apple", "pear"])
+        self.assertEqual(names(tags.tagged_with_all(["green", "red", sweet])),
+            ["apple"])
+        self.assertEqual(names(tags.tagged_with_all(["green", "sour"])), [])
+        self.assertEqual(names(tags.tagged_with_all(["green", "purple"])), [])
+        self.assertEqual(names(tags.tagged_with_all(["sour"])), ["lemon"])
+        self.assertEqual(names(tags.tagged_with_all([])),
+            ["apple", "bread", "lemon", "pear"])
+
+        self.assertEqual(names(tags.tagged_with_any(["red", "sour", "purple"])),
+            ["apple", "lemon"])
+        self.assertEqual(names(tags.tagged_with_any([])), [])
+
+        self.assertEqual(names(tags.tagged_without(["green", "purple"])),
+            ["bread", "lemon"])
+        self.assertEqual(names(tags.tagged_without([])),
+            ["apple", "bread", "lemon", "pear"])
+
+        qs = TaggedQuerySet(self.food_model).exclude(name="pear")
+        self.assertEqual(names(qs.tagged_with_all(["green", "sweet"])), ["apple"])
+        self.assertEqual(names(qs.tagged_with_any(["sweet", "sour"])),
+            ["apple", "lemon"])
+        self.assertEqual(names(qs.tagged_without(["sweet"]).filter(
+            name__startswith="b")), ["bread"])
+
+        # Objects of subclasses are found too.
+        cat = self.housepet_model.objects.create(name="cat", trained=True)
+        cat.tags.add("fuzzy", "lazy")
+        dog = self.pet_model.objects.create(name="dog")
+        dog.tags.add("fuzzy")
+        self.assertEqual(names(self.pet_model.tags.tagged_with_all(
+            ["fuzzy", "lazy"])), ["cat"])
+
+    def test_iter_tagged_objects(self):
+        foods = []
+        for name in ["apple", "pear", "plum", "kiwi", "lemon"]:
+            food = self.food_model.objects.create(name=name)
+            food.tags.add("fresh")
+            foods.append(food)
+        dog = self.pet_model.objects.create(name="dog")
+        dog.tags.add("fresh")
+        cat = self.housepet_model.objects.create(name="cat", trained=True)
+        cat.tags.add("fresh")
+        # Not an object id the pets share, which Django 1.1 would delete their
+        # links for too (see docs/issues.txt).
+        foods[-1].delete()
+        fresh = Tag.objects.get(name="fresh")
+
+        def names(objects):
+            return sorted([o.name for o in objects])
+
+        self.assertEqual(names(fresh.iter_tagged_objects(self.food_model,
+            chunk_size=2)), ["apple", "kiwi", "pear", "plum"])
+        self.assertEqual(names(fresh.iter_tagged_objects(self.pet_model)),
+            ["cat", "dog"])
+        self.assertEqual(names(fresh.iter_tagged_objects(self.housepet_model)),
+            ["cat"])
+        self.assertEqual(names(fresh.iter_tagged_objects(chunk_size=3)),
+            ["apple", "cat", "dog", "kiwi", "pear", "plum"])
+        self.assertEqual(list(Tag.objects.create(name="stale").iter_tagged_objects()), [])
+
     def test_tag_reuse(self):
         apple = self.food_model.objects.create(name="apple")
         apple.tags.add("juicy", "juicy")
@@ -196,6 +466,543 @@ class TaggableManagerTestCase(BaseTaggingTestCase):
         )
 
 
+class ContentTypeCacheTestCase(BaseTaggingTestCase):
+    def tearDown(self):
+        clear_content_type_cache()
+
+    def test_content_type_cache(self):
+        ct = ContentType.objects.get_for_model(Pet)
+        self.assertEqual(get_content_type(Pet), ct)
+        self.assertEqual(get_content_type(Pet(name="kitty")), ct)
+        self.assertEqual(get_subclass_content_types(Pet),
+            [ct, ContentType.objects.get_for_model(HousePet)])
+        self.assertEqual(get_subclass_content_types(HousePet),
+            [ContentType.objects.get_for_model(HousePet)])
+
+        cts = get_subclass_content_types(Pet)
+        self.assert_num_queries(0, get_content_type, Pet)
+        self.assertTrue(get_subclass_content_types(Pet) is cts)
+        clear_content_type_cache()
+        self.assertFalse(get_subclass_content_types(Pet) is cts)
+        self.assertEqual(get_subclass_content_types(Pet), cts)
+
+
+class IndexCommandTestCase(BaseTaggingTestCase):
+    def test_taggit_indexes(self):
+        engine = (getattr(connection, "settings_dict", {}).get("ENGINE") or
+            settings.DATABASE_ENGINE)
+        if not engine.endswith("sqlite3"):
+            return
+        self.assertEqual(self.call_command("taggit_indexes"),
+            'All indexes are present.\n')
+        cursor = connection.cursor()
+        for name, columns, unique, expression in get_existing_indexes(
+            "sqlite", cursor, connection, "taggit_tag"):
+            if columns == ["name"]:
+                cursor.execute('DROP INDEX "%s"' % name)
+        self.assertEqual(self.call_command("taggit_indexes"),
+            'Missing index on taggit_tag (name)\n')
+        self.assertEqual(self.call_command("taggit_indexes", create=True),
+            'Created index taggit_tag_name on taggit_tag (name)\n')
+        self.assertEqual(self.call_command("taggit_indexes"),
+            'All indexes are present.\n')
+
+
+class ImportExportTestCase(BaseTaggingTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def round_trip(self, format):
+        path = os.path.join(self.dir, "tags.%s" % format)
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("green", "red")
+        cat = HousePet.objects.create(name="cat")
+        cat.tags.add("fuzzy")
+        pear = DirectFood.objects.create(name="pear")
+        pear.tags.add("green", u"caf\xe9")
+        dog = CustomPKPet.objects.create(name="dog")
+        dog.tags.add("loud")
+
+        self.call_command("taggit_export", output=path, verbosity=0)
+        for obj in (apple, cat, pear, dog):
+            obj.tags.clear()
+        Tag.objects.filter(name=u"caf\xe9").delete()
+
+        output = self.call_command("taggit_import", path, batch_size=2)
+        self.assertTrue(output.startswith("Read 6 rows and added 6 links, "
+            "skipped 0 rows"), output)
+        for obj in (apple, cat, pear, dog):
+            obj.tags.refresh_tags()
+        self.assert_tags_equal(apple.tags.all(), ["green", "red"])
+        self.assert_tags_equal(cat.tags.all(), ["fuzzy"])
+        self.assert_tags_equal(pear.tags.all(), ["green", u"caf\xe9"])
+        self.assert_tags_equal(dog.tags.all(), ["loud"])
+
+        output = self.call_command("taggit_import", path)
+        self.assertTrue(output.startswith("Read 6 rows and added 0 links"))
+
+    def test_csv(self):
+        self.round_trip("csv")
+
+    def test_jsonl(self):
+        self.round_trip("jsonl")
+
+    def test_export_through(self):
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("red")
+        pear = DirectFood.objects.create(name="pear")
+        pear.tags.add("green")
+        output = self.call_command("taggit_export", "tests.TaggedFood",
+            verbosity=0)
+        self.assertEqual(output, "content_type,object_id,tag_name\r\n"
+            "tests.directfood,%s,green\r\n" % pear.pk)
+
+    def test_import_skips(self):
+        path = os.path.join(self.dir, "tags.jsonl")
+        apple = Food.objects.create(name="apple")
+        f = open(path, "w")
+        f.write('{"content_type": "tests.food", "object_id": %d, '
+            '"tag_name": "red"}\n' % apple.pk)
+        f.write('{"content_type": "tests.food", "object_id": %d, '
+            '"tag_name": "red"}\n' % (apple.pk + 1))
+        f.write('{"content_type": "nope.nope", "object_id": 1, '
+            '"tag_name": "red"}\n')
+        f.write('{"content_type": "tests.food", "object_id": %d, '
+            '"tag_name": ""}\n' % apple.pk)
+        f.close()
+        output = self.call_command("taggit_import", path)
+        self.assertTrue(output.startswith("Read 4 rows and added 1 links, "
+            "skipped 3 rows"), output)
+        self.assert_tags_equal(apple.tags.all(), ["red"])
+
+    def test_import_collation(self):
+        path = os.path.join(self.dir, "tags.jsonl")
+        apple = Food.objects.create(name="apple")
+        red = Tag.objects.create(name="red")
+        f = open(path, "w")
+        f.write('{"content_type": "tests.food", "object_id": %d, '
+            '"tag_name": "Red"}\n' % apple.pk)
+        f.close()
+        # As under a case insensitive collation, like MySQL's default one.
+        Tag.objects.get_or_create_many = lambda names: [red]
+        Tag.objects.get = lambda name: red
+        try:
+            self.call_command("taggit_import", path)
+        finally:
+            del Tag.objects.get_or_create_many
+            del Tag.objects.get
+        self.assert_tags_equal(apple.tags.all(), ["red"])
+
+
+class TaggedObjectListTestCase(BaseTaggingTestCase):
+    food_model = Food
+
+    def get(self, slug, query="", **kwargs):
+        request = HttpRequest()
+        request.method = "GET"
+        request.GET = QueryDict(query)
+        return tagged_object_list(request, slug, self.food_model.objects.all(),
+            **kwargs).content.strip()
+
+    def test_tagged_object_list(self):
+        foods = []
+        for name in ["apple", "pear", "plum", "kiwi", "lemon"]:
+            food = self.food_model.objects.create(name=name)
+            food.tags.add("fruit")
+            foods.append(food)
+        foods[0].tags.add("red")
+        pks = [food.pk for food in foods]
+
+        self.assertEqual(self.get("red"), "red: apple")
+        self.assertRaises(Http404, self.get, "purple")
+
+        self.assertEqual(self.get("fruit", cursor_paginate_by=2),
+            "fruit: apple pear next=%s" % pks[1])
+        self.assertEqual(self.get("fruit", "after=%s" % pks[1],
+            cursor_paginate_by=2), "fruit: plum kiwi next=%s" % pks[3])
+        self.assertEqual(self.get("fruit", "after=%s" % pks[3],
+            cursor_paginate_by=2), "fruit: lemon")
+
+    def test_tag_cache(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("red")
+        tag = Tag.objects.get_by_slug("red")
+        self.assertEqual(tag.name, "red")
+        self.assert_num_queries(0, Tag.objects.get_by_slug, "red")
+
+        tag.name = tag.slug = "crimson"
+        # The cached tag isn't changed along with the one returned.
+        self.assertEqual(Tag.objects.get_by_slug("red").name, "red")
+        # Saving knows the old slug without looking it up.
+        self.assert_num_queries(0, pre_save.send, sender=Tag, instance=tag)
+        tag.save()
+        self.assertEqual(self.get("crimson"), "crimson: apple")
+        self.assertRaises(Tag.DoesNotExist, Tag.objects.get_by_slug, "red")
+        tag.delete()
+        self.assertRaises(Tag.DoesNotExist, Tag.objects.get_by_slug, "crimson")
+
+    def test_generic_objects(self):
+        # Objects of models without a TaggableManager can be tagged too.
+        red = Tag.objects.create(name="red")
+        ct = ContentType.objects.get_for_model(Food)
+        TaggedItem.objects.create(content_object=ct, tag=red)
+        other = ContentType.objects.get_for_model(Tag)
+        pear = Food.objects.create(pk=other.pk, name="pear")
+        pear.tags.add("red")
+        self.assertEqual(list(tagged_objects(ContentType.objects.all(), red)),
+            [ct])
+
+
+class TaggedObjectListDirectTestCase(TaggedObjectListTestCase):
+    food_model = DirectFood
+
+
+class BulkTaggingTestCase(BaseTaggingTestCase):
+    food_model = Food
+    pet_model = Pet
+    housepet_model = HousePet
+
+    def test_tag_objects(self):
+        foods = [self.food_model.objects.create(name=name)
+            for name in ["apple", "pear", "plum", "kiwi", "lemon"]]
+        foods[0].tags.add("red")
+        green = Tag.objects.create(name="green")
+        self.assertEqual(tag_objects(self.food_model.objects.all(),
+            ["red", green], chunk_size=2), 9)
+        for food in foods:
+            food.tags.refresh_tags()
+            self.assert_tags_equal(food.tags.all(), ["green", "red"])
+        self.assertEqual(tag_objects(self.food_model.objects.all(), ["red"]), 0)
+
+        self.assertEqual(untag_objects(foods[:2], ["red", "purple"]), 2)
+        self.assertEqual(untag_objects(self.food_model.objects.filter(
+            name="plum"), [green]), 1)
+        tags = {}
+        for food in self.food_model.objects.all():
+            tags[food.name] = sorted(food.tags.names())
+        self.assertEqual(tags, {"apple": ["green"], "pear": ["green"],
+            "plum": ["red"], "kiwi": ["green", "red"],
+            "lemon": ["green", "red"]})
+
+    def test_queries(self):
+        Tag.objects.create(name="red")
+        Tag.objects.create(name="green")
+        for i in xrange(9):
+            self.food_model.objects.create(name="food %d" % i)
+        # Fills the content type cache.
+        tag_objects(self.food_model.objects.all()[:1], ["blue"])
+        few = self.count_queries(tag_objects,
+            self.food_model.objects.all()[:3], ["red"])
+        many = self.count_queries(tag_objects,
+            self.food_model.objects.all(), ["green"])
+        self.assertEqual(few, many)
+
+    def test_subclasses(self):
+        cat = self.pet_model.objects.create(name="cat")
+        dog = self.housepet_model.objects.create(name="dog")
+        self.assertEqual(tag_objects([cat, dog], ["fuzzy"]), 2)
+        self.assert_tags_equal(self.pet_model.objects.get(pk=cat.pk).tags.all(),
+            ["fuzzy"])
+        self.assert_tags_equal(
+            self.housepet_model.objects.get(pk=dog.pk).tags.all(), ["fuzzy"])
+        self.assertEqual(untag_objects([dog], ["fuzzy"]), 1)
+        self.assert_tags_equal(
+            self.housepet_model.objects.get(pk=dog.pk).tags.all(), [])
+
+
+class BulkTaggingDirectTestCase(BulkTaggingTestCase):
+    food_model = DirectFood
+    pet_model = DirectPet
+    housepet_model = DirectHousePet
+
+
+class MergeTagsTestCase(BaseTaggingTestCase):
+    def tags(self, obj):
+        return sorted(obj.__class__.objects.get(pk=obj.pk).tags.names())
+
+    def test_merge_tags(self):
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("py", "python")
+        pear = Food.objects.create(name="pear")
+        pear.tags.add("py", "Py", "green")
+        cat = HousePet.objects.create(name="cat")
+        cat.tags.add("py")
+        dog = DirectPet.objects.create(name="dog")
+        dog.tags.add("py", "python")
+        rex = CachedFood.objects.create(name="rex")
+        rex.tags.add("Py")
+        list(rex.tags.all())
+        TagSynonym.objects.create(name="pyth", tag=Tag.objects.get(name="Py"))
+
+        self.assertEqual(merge_tags(["py", Tag.objects.get(name="Py"),
+            "python"], "python", batch_size=1), (3, 3))
+        self.assertEqual(self.tags(apple), ["python"])
+        self.assertEqual(self.tags(pear), ["green", "python"])
+        self.assertEqual(self.tags(cat), ["python"])
+        self.assertEqual(self.tags(dog), ["python"])
+        self.assertEqual(self.tags(rex), ["python"])
+        self.assertEqual(sorted(Tag.objects.values_list("name", flat=True)),
+            ["green", "python"])
+        self.assertEqual(sorted(TagSynonym.objects.filter(
+            tag__name="python").values_list("name", flat=True)),
+            ["Py", "py", "pyth"])
+        self.assertEqual(parse_tags("py, pyth"), ["python"])
+
+    def test_command(self):
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("py")
+        output = self.call_command("taggit_merge", "py", "python")
+        self.assertTrue(output.startswith("Merged 1 tags into python, moving "
+            "1 links and dropping 0 duplicates"), output)
+        self.assertEqual(self.tags(apple), ["python"])
+
+
+class GcTestCase(BaseTaggingTestCase):
+    def test_dangling_links(self):
+        red = Tag.objects.create(name="red")
+        apple = Food.objects.create(name="apple")
+        apple.tags.add(red)
+        food = ContentType.objects.get_for_model(Food)
+        TaggedItem.objects.create(content_type=food, object_id=apple.pk + 1,
+            tag=red)
+        gone = ContentType.objects.create(app_label="gone", model="gone")
+        TaggedItem.objects.create(content_type=gone, object_id=1, tag=red)
+        # Objects with a primary key that isn't a number are looked up.
+        custom = ContentType.objects.get_for_model(CustomPKFood)
+        CustomPKFood.objects.create(name="5")
+        TaggedItem.objects.create(content_type=custom, object_id=5, tag=red)
+        TaggedItem.objects.create(content_type=custom, object_id=6, tag=red)
+        Tag.objects.create(name="lonely")
+        synonym = Tag.objects.create(name="synonym")
+        TagSynonym.objects.create(name="alias", tag=synonym)
+
+        self.assertEqual(self.call_command("taggit_gc", tags=True,
+            dry_run=True), "Would delete 3 dangling links and 1 unused "
+            "tags.\n")
+        self.assertEqual(TaggedItem.objects.count(), 5)
+        self.assertEqual(self.call_command("taggit_gc", tags=True,
+            batch_size=1, verbosity=2), "Deleted 1 dangling links of "
+            "tests.food.\nDeleted 1 dangling links of tests.custompkfood.\n"
+            "Deleted 1 dangling links of gone.gone.\nDeleted 3 dangling "
+            "links and 1 unused tags.\n")
+        self.assertEqual(sorted(TaggedItem.objects.values_list(
+            "content_type", "object_id")), sorted([(food.pk, apple.pk),
+            (custom.pk, 5)]))
+        self.assertEqual(sorted(Tag.objects.values_list("name", flat=True)),
+            ["red", "synonym"])
+
+    def test_delete_links_on_delete(self):
+        ct = ContentType.objects.create(app_label="gone", model="gone")
+        TaggedItem.objects.create(content_object=ct,
+            tag=Tag.objects.create(name="red"))
+        delete_links_on_delete(ContentType)
+        try:
+            ct.delete()
+        finally:
+            post_delete.disconnect(sender=ContentType,
+                dispatch_uid="taggit.gc.delete_links_on_delete")
+        self.assertEqual(TaggedItem.objects.count(), 0)
+
+
+class BenchmarkTestCase(BaseTaggingTestCase):
+    def test_benchmarks(self):
+        # The benchmarks import this module's models, so they're imported
+        # here for taggit_benchmark to import them first.
+        from taggit.benchmarks import check_budgets, run as run_benchmarks
+        from taggit.benchmarks.dataset import Scale
+        results = run_benchmarks(Scale(objects=20, tags=10, tags_per_object=3,
+            content_types=4), repeat=2)
+        names = ["add", "most_common", "parse_tags", "remove", "set",
+            "similar_objects", "tagged_object_list", "tags__in"]
+        # suggest_tags is only run with its app installed.
+        if "taggit.contrib.suggest" in settings.INSTALLED_APPS:
+            names.append("suggest_tags")
+        self.assertEqual(sorted(results), sorted(names))
+        self.assertEqual(results["parse_tags"]["queries"], 0)
+        self.assertEqual(check_budgets(results, {"parse_tags": {"queries": 0,
+            "seconds": 60}, "tags__in": {"queries": 0}}),
+            ["tags__in took 1 queries, over its budget of 0."])
+
+
+class InstrumentationTestCase(BaseTaggingTestCase):
+    def setUp(self):
+        self.records = []
+        self.old_debug = settings.DEBUG
+
+    def tearDown(self):
+        operation_finished.disconnect(self.record)
+        settings.DEBUG = self.old_debug
+        if hasattr(settings, "TAGGIT_INSTRUMENTATION_SINKS"):
+            del settings.TAGGIT_INSTRUMENTATION_SINKS
+        reset_sinks()
+
+    def record(self, sender, record, **kwargs):
+        self.records.append(record)
+
+    def find(self, operation):
+        return [r for r in self.records if r.operation == operation]
+
+    def test_disabled(self):
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("green")
+        parse_tags("red, yellow")
+        self.assertEqual(self.records, [])
+        self.assertFalse(recording())
+
+    def test_records(self):
+        operation_finished.connect(self.record)
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("green", "red")
+        apple.tags.remove("green", "yellow")
+        self.assertEqual(sorted(apple.tags.names()), ["red"])
+        parse_tags("a, b, c")
+
+        add, = self.find("add")
+        self.assertEqual((add.model, add.tags, add.rows, add.queries),
+            ("tests.Food", 2, 2, None))
+        self.assertTrue(add.seconds >= 0)
+        remove, = self.find("remove")
+        self.assertEqual((remove.tags, remove.rows), (2, 1))
+        names, = self.find("names")
+        self.assertEqual((names.tags, names.rows), (1, 1))
+        self.assertEqual(len(self.find("all")), 1)
+        parse, = self.find("parse_tags")
+        self.assertEqual((parse.model, parse.tags), (None, 3))
+        self.assertEqual(len(self.find("synonyms")), 1)
+        self.assertFalse(recording())
+
+    def test_tagged_with_all(self):
+        operation_finished.connect(self.record)
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("green", "red")
+        pear = Food.objects.create(name="pear")
+        pear.tags.add("green")
+        list(Food.tags.tagged_with_all(["green", "red"]))
+        tagged, = self.find("tagged_with_all")
+        self.assertEqual(tagged.tags, 2)
+        apple.tags.similar_objects(score="jaccard")
+        self.assertEqual(len(self.find("tagged_with_all")), 1)
+        self.assertEqual(len(self.find("similar_objects")), 1)
+
+    def test_queries(self):
+        operation_finished.connect(self.record)
+        settings.DEBUG = True
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("green")
+        apple.tags.clear()
+        clear, = self.find("clear")
+        self.assertEqual(clear.rows, 1)
+        self.assertTrue(clear.queries >= 2)
+        self.assertEqual(self.find("parse_tags"), [])
+
+    def test_failing_receiver(self):
+        def fail(sender, record, **kwargs):
+            raise ValueError("broken receiver")
+        operation_finished.connect(fail)
+        operation_finished.connect(self.record)
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger.addHandler(handler)
+        try:
+            apple = Food.objects.create(name="apple")
+            apple.tags.add("green")
+        finally:
+            logger.removeHandler(handler)
+            operation_finished.disconnect(fail)
+        self.assert_tags_equal(apple.tags.all(), ["green"])
+        self.assertEqual(len(self.find("add")), 1)
+        self.assertTrue(records)
+
+    def test_sinks(self):
+        settings.TAGGIT_INSTRUMENTATION_SINKS = [
+            "taggit.instrumentation.AggregatingSink",
+            "taggit.instrumentation.LoggingSink",
+        ]
+        reset_sinks()
+        apple = Food.objects.create(name="apple")
+        apple.tags.add("green")
+        apple.tags.add("red", "yellow")
+        summary = get_sinks()[0].summary()
+        add = summary[("add", "tests.Food")]
+        self.assertEqual((add["count"], add["rows"]), (2, 3))
+        self.assertTrue(add["p50"] <= add["p90"] <= add["p99"] <= add["max"])
+        get_sinks()[0].reset()
+        self.assertEqual(get_sinks()[0].summary(), {})
+
+    def test_percentile(self):
+        samples = range(1, 11)
+        self.assertEqual(percentile(samples, 50), 5)
+        self.assertEqual(percentile(samples, 90), 9)
+        self.assertEqual(percentile(samples, 99), 10)
+        self.assertEqual(percentile(samples, 0), 1)
+        self.assertEqual(percentile([], 50), None)
+
+
+class CachedTagsTestCase(BaseTaggingTestCase):
+    food_model = CachedFood
+
+    def setUp(self):
+        # The cache outlives the rolled back objects of earlier tests, so
+        # each test keeps its tags under keys of its own.
+        settings.TAGGIT_TAGS_CACHE_PREFIX = "taggit.tests:%s:%s" % (self.id(),
+            time.time())
+
+    def tearDown(self):
+        del settings.TAGGIT_TAGS_CACHE_PREFIX
+
+    def fresh(self, obj):
+        return self.food_model.objects.get(pk=obj.pk)
+
+    def test_cached_tags(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green", "red")
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["green", "red"])
+        apple = self.fresh(apple)
+        self.assert_num_queries(0, lambda: list(apple.tags.all()))
+        self.assertEqual(sorted(apple.tags.names()), ["green", "red"])
+        self.assertEqual([t.pk for t in apple.tags.all()],
+            [t.pk for t in self.fresh(apple).tags.all()])
+
+    def test_mutations(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green")
+        list(self.fresh(apple).tags.all())
+        self.fresh(apple).tags.add("red")
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["green", "red"])
+        self.fresh(apple).tags.remove("green")
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["red"])
+        self.fresh(apple).tags.set("yellow")
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["yellow"])
+        self.fresh(apple).tags.clear()
+        self.assert_tags_equal(self.fresh(apple).tags.all(), [])
+
+    def test_links_and_tags(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green")
+        list(self.fresh(apple).tags.all())
+        through = get_through(self.food_model)
+        red = Tag.objects.create(name="red")
+        through.objects.create(tag=red, **through.lookup_kwargs(apple))
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["green", "red"])
+        through.objects.filter(tag=red).delete()
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["green"])
+
+        add_links(through, [(self.food_model(pk=apple.pk), [red.pk])])
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["green", "red"])
+
+        red.name = "crimson"
+        red.save()
+        self.assert_tags_equal(self.fresh(apple).tags.all(), ["crimson", "green"])
+
+
+class CachedTagsDirectTestCase(CachedTagsTestCase):
+    food_model = DirectCachedFood
+
+
 class TaggableManagerDirectTestCase(TaggableManagerTestCase):
     food_model = DirectFood
     pet_model = DirectPet
@@ -243,6 +1050,13 @@ class TaggableFormTestCase(BaseTaggingTestCase):
         f = self.form_class(instance=apple)
         self.assertEqual(str(f), """<tr><th><label for="id_name">Name:</label></th><td><input id="id_name" type="text" name="name" value="apple" maxlength="50" /></td></tr>\n<tr><th><label for="id_tags">Tags:</label></th><td><input type="text" name="tags" value="&quot;has,comma&quot; delicious green red yummy" id="id_tags" /><br />A comma-separated list of tags.</td></tr>""")
 
+    def test_form_prefetched_tags(self):
+        apple = self.food_model.objects.create(name="apple")
+        apple.tags.add("green", "red")
+        apple = prefetch_tags([self.food_model.objects.get(name="apple")])[0]
+        self.assert_num_queries(0, lambda: str(self.form_class(instance=apple)))
+        self.assertTrue('value="green red"' in str(self.form_class(instance=apple)))
+
         
 class TaggableFormDirectTestCase(TaggableFormTestCase):
     form_class = DirectFoodForm
@@ -327,6 +1141,35 @@ class TagStringParseTestCase(UnitTestCase):
         self.assertEqual(parse_tags('a-one "a-two" "a-three'),
             [u'a-one', u'a-three', u'a-two'])
 
+    def test_legacy_parser(self):
+        """
+        The parser gives the same results as the character by character one it
+        replaced.
+        """
+        inputs = [
+            'one', 'one two', ' one  two ', 'one\ttwo', ',one two', 'a, b c',
+            '"one', '"one two"', 'a "b c" d', 'a "b, c" d', 'a, "b" c',
+            '"a" "b" c,', 'a"b"c', '"a""b"', '"', '""', '" , "', 'a "b, c',
+            'a "b c', 'a "', ',,', '" a "', 'a\n"b\nc"', u'caf\xe9, "na\xefve"',
+            'one, one, "one"', '"two", one, one, two, "one"',
+        ]
+        rng = random.Random(42)
+        for i in range(500):
+            inputs.append(''.join([rng.choice('ab ,"\t') for j in
+                range(rng.randint(1, 12))]))
+        for tagstring in inputs:
+            self.assertEqual(parse_tags(tagstring), legacy_parse_tags(tagstring),
+                tagstring)
+        self.assertEqual(parse_tags_many(inputs),
+            [legacy_parse_tags(tagstring) for tagstring in inputs])
+
+    def test_parse_tags_many(self):
+        self.assertEqual(parse_tags_many([]), [])
+        self.assertEqual(parse_tags_many(['one two', None, '', 'two, three']),
+            [[u'one', u'two'], [], [], [u'three', u'two']])
+        self.assertEqual(parse_tags_many(iter(['b a', '"c d"'])),
+            [[u'a', u'b'], [u'c d']])
+
     def test_recreation_of_tag_list_string_representations(self):
         plain = Tag.objects.create(name='plain')
         spaces = Tag.objects.create(name='spa ces')
@@ -337,6 +1180,57 @@ class TagStringParseTestCase(UnitTestCase):
         self.assertEqual(edit_string_for_tags([plain, comma]), u'"com,ma" plain')
         self.assertEqual(edit_string_for_tags([comma, spaces]), u'"com,ma", spa ces')
 
+def legacy_parse_tags(tagstring):
+    """
+    The character by character parser ``parse_tags`` used to be.
+    """
+    if not tagstring:
+        return []
+    tagstring = unicode(tagstring)
+    if u',' not in tagstring and u'"' not in tagstring:
+        return post_process_tags(split_strip(tagstring, u' '))
+    words = []
+    buffer = []
+    to_be_split = []
+    saw_loose_comma = False
+    open_quote = False
+    i = iter(tagstring)
+    try:
+        while True:
+            c = i.next()
+            if c == u'"':
+                if buffer:
+                    to_be_split.append(u''.join(buffer))
+                    buffer = []
+                open_quote = True
+                c = i.next()
+                while c != u'"':
+                    buffer.append(c)
+                    c = i.next()
+                if buffer:
+                    word = u''.join(buffer).strip()
+                    if word:
+                        words.append(word)
+                    buffer = []
+                open_quote = False
+            else:
+                if not saw_loose_comma and c == u',':
+                    saw_loose_comma = True
+                buffer.append(c)
+    except StopIteration:
+        if buffer:
+            if open_quote and u',' in buffer:
+                saw_loose_comma = True
+            to_be_split.append(u''.join(buffer))
+    if to_be_split:
+        if saw_loose_comma:
+            delimiter = u','
+        else:
+            delimiter = u' '
+        for chunk in to_be_split:
+            words.extend(split_strip(chunk, delimiter))
+    return post_process_tags(words)
+
 class TestTagPostProcessing(TestCase):
     def test_post_processing(self):
         ''' Test tag post-processing
@@ -366,22 +1260,103 @@ class TestFilterTags(TestCase):
             tags.sort()
             self.assertEquals(tags, [u'be', u'filtered', u'nothing', u'should', ])
 
-class TestTagSynonyms(TestCase):
+class TestTagSynonyms(BaseTaggingTestCase):
     def setUp(self):
         self.prestxt = u'president barack obama'
         self.prestag = Tag.objects.create(name = self.prestxt )
         TagSynonym.objects.create(tag = self.prestag, name = 'president')
         TagSynonym.objects.create(tag = self.prestag, name = 'barack')
         TagSynonym.objects.create(tag = self.prestag, name = 'obama')
+    def tearDown(self):
+        # the rollback at the end of the test doesn't send signals
+        synonym_map.invalidate()
     def test_tag_replaces_synonym(self):
         " tag replaces a synonym "
         self.assertEquals(replace_synonyms_with_tags(['president']),
             [self.prestxt])
         self.assertEquals(replace_synonyms_with_tags(['president','obama']),
             [self.prestxt,self.prestxt])
+    def test_synonym_map_is_cached(self):
+        " synonyms are looked up once, and reloaded when they change "
+        replace_synonyms_with_tags(['president'])
+        self.assert_num_queries(0, replace_synonyms_with_tags,
+            ['president', 'notsynonym', 'barack'])
+        TagSynonym.objects.create(tag = self.prestag, name = 'potus')
+        self.assertEquals(replace_synonyms_with_tags(['potus']),
+            [self.prestxt])
+        self.prestag.name = 'barack obama'
+        self.prestag.save()
+        self.assertEquals(replace_synonyms_with_tags(['potus', 'obama']),
+            [u'barack obama', u'barack obama'])
+        TagSynonym.objects.filter(name = 'potus').delete()
+        self.assertEquals(replace_synonyms_with_tags(['potus']), ['potus'])
+    def test_shared_cache_backend(self):
+        " the map can be kept in django's cache framework "
+        old_backend = getattr(settings, 'TAGGIT_CACHE_BACKEND', None)
+        settings.TAGGIT_CACHE_BACKEND = 'taggit.cache.DjangoCacheBackend'
+        try:
+            self.assertEquals(replace_synonyms_with_tags(['barack']),
+                [self.prestxt])
+            self.assert_num_queries(0, replace_synonyms_with_tags,
+                ['obama'])
+            TagSynonym.objects.create(tag = self.prestag, name = 'potus')
+            self.assertEquals(replace_synonyms_with_tags(['potus']),
+                [self.prestxt])
+            synonym_map.invalidate()
+        finally:
+            if old_backend is None:
+                del settings.TAGGIT_CACHE_BACKEND
+            else:
+                settings.TAGGIT_CACHE_BACKEND = old_backend
     def test_tag_does_not_replace_non_synonym(self):
         " tag does not replaces a synonym "
         self.assertEquals(replace_synonyms_with_tags(['notsynonym']),
             [u'notsynonym'])
         self.assertEquals(replace_synonyms_with_tags(
             ['notsynonym',self.prestxt]),[u'notsynonym',self.prestxt])
+
+class CacheBackendTestCase(UnitTestCase):
+    names = ("CACHES", "CACHE_BACKEND", "TAGGIT_LOCAL_CACHE_TIMEOUT",
+        "TAGGIT_LOCAL_CACHE_MAX_ENTRIES")
+
+    def setUp(self):
+        self.old_settings = dict([(name, getattr(settings, name))
+            for name in self.names if hasattr(settings, name)])
+        # Django's own settings have defaults, which can't be deleted.
+        settings.CACHES = None
+        settings.CACHE_BACKEND = ""
+        for name in self.names[2:]:
+            if hasattr(settings, name):
+                delattr(settings, name)
+
+    def tearDown(self):
+        for name in self.names[2:]:
+            if hasattr(settings, name):
+                delattr(settings, name)
+        for name, value in self.old_settings.iteritems():
+            setattr(settings, name, value)
+
+    def test_default_backend(self):
+        settings.CACHE_BACKEND = "locmem://"
+        self.assertEqual(_default_backend(), "taggit.cache.LocalBackend")
+        settings.CACHE_BACKEND = "memcached://127.0.0.1:11211/"
+        self.assertEqual(_default_backend(), "taggit.cache.DjangoCacheBackend")
+        settings.CACHES = {"default": {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+        self.assertEqual(_default_backend(), "taggit.cache.LocalBackend")
+
+    def test_local_backend_expires(self):
+        settings.TAGGIT_LOCAL_CACHE_TIMEOUT = -1
+        backend = LocalBackend()
+        loads = []
+        backend.get("key", lambda: loads.append(1))
+        backend.get("key", lambda: loads.append(1))
+        self.assertEqual(len(loads), 2)
+
+    def test_local_backend_size(self):
+        settings.TAGGIT_LOCAL_CACHE_MAX_ENTRIES = 6
+        backend = LocalBackend()
+        for i in range(20):
+            self.assertEqual(backend.get(i, lambda: i * 2), i * 2)
+        self.assertTrue(len(backend._values) <= 6)
+        self.assertTrue(19 in backend._values)
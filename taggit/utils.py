@@ -1,9 +1,28 @@
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+from django.db.models.related import RelatedObject
+from django.db.models.signals import class_prepared, post_syncdb
 from django.utils.encoding import force_unicode
 from django.utils.functional import wraps
 from django.conf import settings
 from django.core.urlresolvers import get_callable
 
+from taggit.instrumentation import instrumented
 
+
+def _result_len(args, kwargs, result):
+    if result is None:
+        return None
+    return len(result)
+
+def _results_len(args, kwargs, result):
+    if result is None:
+        return None
+    return sum([len(tags) for tags in result])
+
+
+@instrumented("parse_tags", tags=_result_len)
 def parse_tags(tagstring):
     """
     Parses tag input, with multiple word input being activated and
@@ -17,62 +36,72 @@ def parse_tags(tagstring):
     """
     if not tagstring:
         return []
+    return post_process_tags(split_tags(tagstring))
+
 
+@instrumented("parse_tags_many", tags=_results_len)
+def parse_tags_many(tagstrings):
+    """
+    Parses each of ``tagstrings`` like ``parse_tags``, returning a list of
+    the results.  The tag filter and synonym replacement run once for the
+    distinct names of all the strings, so the filter function must judge
+    each tag on its own.
+    """
+    split = []
+    names = set()
+    for tagstring in tagstrings:
+        if tagstring:
+            words = split_tags(tagstring)
+        else:
+            words = []
+        split.append(words)
+        names.update(words)
+    names = list(names)
+    replaced = {}
+    if names:
+        kept = filter_tags(names)
+        replaced = dict(zip(kept, replace_synonyms_with_tags(kept)))
+    results = []
+    for words in split:
+        tags = list(set([replaced[w] for w in words if w in replaced]))
+        tags.sort()
+        results.append(tags)
+    return results
+
+
+def split_tags(tagstring):
+    """
+    Splits tag input into tag names, without any post-processing.  See
+    ``parse_tags``.
+    """
     tagstring = force_unicode(tagstring)
 
     # Special case - if there are no commas or double quotes in the
     # input, we don't *do* a recall... I mean, we know we only need to
     # split on spaces.
     if u',' not in tagstring and u'"' not in tagstring:
-        words = split_strip(tagstring, u' ')
-        return post_process_tags(words)
-
-    words = []
-    buffer = []
-    # Defer splitting of non-quoted sections until we know if there are
-    # any unquoted commas.
-    to_be_split = []
-    saw_loose_comma = False
-    open_quote = False
-    i = iter(tagstring)
-    try:
-        while True:
-            c = i.next()
-            if c == u'"':
-                if buffer:
-                    to_be_split.append(u''.join(buffer))
-                    buffer = []
-                # Find the matching quote
-                open_quote = True
-                c = i.next()
-                while c != u'"':
-                    buffer.append(c)
-                    c = i.next()
-                if buffer:
-                    word = u''.join(buffer).strip()
-                    if word:
-                        words.append(word)
-                    buffer = []
-                open_quote = False
-            else:
-                if not saw_loose_comma and c == u',':
-                    saw_loose_comma = True
-                buffer.append(c)
-    except StopIteration:
-        # If we were parsing an open quote which was never closed treat
-        # the buffer as unquoted.
-        if buffer:
-            if open_quote and u',' in buffer:
-                saw_loose_comma = True
-            to_be_split.append(u''.join(buffer))
-    if to_be_split:
-        if saw_loose_comma:
+        return split_strip(tagstring, u' ')
+
+    # Splitting on quotes alternates unquoted and quoted sections.  If the
+    # last quote was never closed, the section after it is treated as
+    # unquoted.
+    sections = tagstring.split(u'"')
+    unquoted = sections[0::2]
+    quoted = sections[1::2]
+    if len(sections) % 2 == 0:
+        unquoted.append(quoted.pop())
+
+    words = [w.strip() for w in quoted]
+    words = [w for w in words if w]
+    # Unquoted sections are split on commas if any of them has one.
+    delimiter = u' '
+    for chunk in unquoted:
+        if u',' in chunk:
             delimiter = u','
-        else:
-            delimiter = u' '
-        for chunk in to_be_split:
-            words.extend(split_strip(chunk, delimiter))
-    return post_process_tags(words)
+            break
+    for chunk in unquoted:
+        words.extend(split_strip(chunk, delimiter))
+    return words
     
 
 def split_strip(string, delimiter=u','):
@@ -131,6 +160,159 @@ def require_instance_manager(func):
         return func(self, *args, **kwargs)
     return inner
 
+_content_types = {}
+_subclass_content_types = {}
+
+def get_content_type(model):
+    '''``ContentType.objects.get_for_model()``, memoized per model class.
+
+    Also accepts model instances.
+    '''
+    if isinstance(model, models.Model):
+        model = model.__class__
+    try:
+        return _content_types[model]
+    except KeyError:
+        ct = _content_types[model] = ContentType.objects.get_for_model(model)
+        return ct
+
+def get_subclass_content_types(model):
+    '''the content types of ``model`` and its multi-table subclasses'''
+    try:
+        return _subclass_content_types[model]
+    except KeyError:
+        cts = [get_content_type(m) for m in get_subclasses(model)]
+        _subclass_content_types[model] = cts
+        return cts
+
+def get_subclasses(model):
+    subclasses = [model]
+    for f in model._meta.get_all_field_names():
+        field = model._meta.get_field_by_name(f)[0]
+        if (isinstance(field, RelatedObject) and
+            getattr(field.field.rel, "parent_link", None)):
+            subclasses.extend(get_subclasses(field.model))
+    return subclasses
+
+def clear_content_type_cache(**kwargs):
+    '''empty the caches behind ``get_content_type()`` and
+    ``get_subclass_content_types()``.
+
+    Called whenever the database is (re)created, and handy in tests.
+    '''
+    _content_types.clear()
+    _subclass_content_types.clear()
+
+def _clear_subclass_cache(**kwargs):
+    # A new model may be a subclass of one we've already looked at.
+    _subclass_content_types.clear()
+
+class_prepared.connect(_clear_subclass_cache,
+    dispatch_uid="taggit.utils._clear_subclass_cache")
+post_syncdb.connect(clear_content_type_cache,
+    dispatch_uid="taggit.utils.clear_content_type_cache")
+
+def get_through_models():
+    '''all installed tagging through models: ``TaggedItem`` and every
+    concrete subclass of ``TaggedItemBase``'''
+    from taggit.models import TaggedItemBase
+    return [m for m in models.get_models() if issubclass(m, TaggedItemBase)]
+
+def get_tag_relations():
+    '''the relations of other models to ``Tag``, through models included,
+    except the counts of ``taggit.contrib.counts``, which just follow their
+    tags'''
+    from taggit.models import Tag
+    return [related for related in Tag._meta.get_all_related_objects()
+        if (related.model._meta.app_label, related.model._meta.object_name)
+        != ("counts", "TagCount")]
+
+def get_connection(using=None):
+    '''the connection for the database alias ``using`` (default database if
+    ``None``); on Django 1.1 there is only one'''
+    if django.VERSION >= (1, 2):
+        from django.db import connections, DEFAULT_DB_ALIAS
+        return connections[using or DEFAULT_DB_ALIAS]
+    from django.db import connection
+    return connection
+
+def bulk_insert(model, objs, using=None):
+    '''insert ``objs``, unsaved instances of ``model``, in one statement.
+
+    Uses ``QuerySet.bulk_create`` where Django provides it, otherwise a
+    single ``executemany`` on the raw cursor.  Like ``bulk_create`` no
+    signals are sent and primary keys are not set on ``objs``.
+    '''
+    if not objs:
+        return
+    manager = model._default_manager
+    if using is not None:
+        manager = manager.db_manager(using)
+    if hasattr(manager, "bulk_create"):
+        manager.bulk_create(objs)
+        return
+
+    if django.VERSION >= (1, 2):
+        from django.db import connections, router
+        using = using or router.db_for_write(model)
+        connection = connections[using]
+        trans_kwargs = {"using": using}
+        prep_kwargs = {"connection": connection}
+    else:
+        from django.db import connection
+        trans_kwargs = {}
+        prep_kwargs = {}
+
+    opts = model._meta
+    qn = connection.ops.quote_name
+    fields = [f for f in opts.local_fields
+        if not isinstance(f, models.AutoField)]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(opts.db_table),
+        ", ".join([qn(f.column) for f in fields]),
+        ", ".join(["%s"] * len(fields)),
+    )
+    params = []
+    for obj in objs:
+        params.append([f.get_db_prep_save(f.pre_save(obj, True), **prep_kwargs)
+            for f in fields])
+    connection.cursor().executemany(sql, params)
+    transaction.commit_unless_managed(**trans_kwargs)
+
+def prefetch_tags(objects, name="tags"):
+    '''load the tags of all ``objects`` with one query per model.
+
+    ``name`` is the name of the ``TaggableManager`` on the objects' model.
+    The tags are cached on each object, so ``obj.tags.all()`` doesn't hit
+    the database until the tags are changed.  Returns ``objects`` as a list.
+    '''
+    objects = list(objects)
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(obj.__class__, []).append(obj)
+    for model, instances in by_model.iteritems():
+        field = model._meta.get_field(name)
+        through = field.through
+        attname = through.object_id_attname()
+        cache = dict([(obj.pk, []) for obj in instances])
+        items = through.objects.filter(
+            **through.bulk_lookup_kwargs(instances)).select_related("tag")
+        for item in items:
+            cache[getattr(item, attname)].append(item.tag)
+        cache_name = field.get_cache_name()
+        for obj in instances:
+            setattr(obj, cache_name, cache[obj.pk])
+    return objects
+
+def tag_counts_installed():
+    return 'taggit.contrib.counts' in settings.INSTALLED_APPS
+
+def update_tag_counts(through, model, tag_ids, delta):
+    '''keep the counts of ``taggit.contrib.counts`` up to date, if installed'''
+    if tag_counts_installed():
+        from taggit.contrib.counts.utils import update_counts
+        update_counts(through, model, tag_ids, delta)
+
 def post_process_tags(tags):
     tags = filter_tags(tags)
     tags = replace_synonyms_with_tags(tags)
@@ -138,6 +320,7 @@ def post_process_tags(tags):
     tags.sort()
     return tags
 
+@instrumented("filter_tags", tags=_result_len)
 def filter_tags(tags):
     '''filter tags by a function supplied in settings.py
        ex. TAGGIT_FILTER_FXN = some.function
@@ -150,18 +333,12 @@ def filter_tags(tags):
     except AttributeError:
         return tags
 
+@instrumented("synonyms", tags=_result_len)
 def replace_synonyms_with_tags(tags):
     '''replace any synonyms with their parent tags
     '''
     if 'taggit.contrib.synonyms' in settings.INSTALLED_APPS:
-        from taggit.contrib.synonyms.models import TagSynonym
-        clean_tags = []
-        for tag in tags:
-            try:
-                # subsitute the parent name
-                synonym = TagSynonym.objects.get(name=tag)
-                clean_tags.append(synonym.tag.name)
-            except TagSynonym.DoesNotExist:
-                clean_tags.append(tag)
-        return clean_tags
+        from taggit.contrib.synonyms.models import synonym_map
+        synonyms = synonym_map.get()
+        return [synonyms.get(tag, tag) for tag in tags]
     return tags
@@ -1,18 +1,94 @@
-from django.contrib.contenttypes.models import ContentType
-from django.shortcuts import get_object_or_404
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.shortcuts import render_to_response
+from django.template import RequestContext
 from django.views.generic.list_detail import object_list
 
+from taggit.managers import TaggableManager
 from taggit.models import TaggedItem, Tag
+from taggit.utils import get_connection, get_content_type
 
 
+def tagged_objects(queryset, tag):
+    """
+    Filters ``queryset`` down to the objects tagged with ``tag``.
+    """
+    model = queryset.model
+    for field in model._meta.many_to_many:
+        if isinstance(field, TaggableManager):
+            # A join through the model's own through table.
+            return queryset.filter(**{"%s__tag" % field.name: tag})
+    # Models without a TaggableManager can still be tagged generically, but
+    # there is no relation to join along.  Querysets only know their database
+    # from Django 1.2 on.
+    qn = get_connection(getattr(queryset, "db", None)).ops.quote_name
+    opts = TaggedItem._meta
+    table = qn(opts.db_table)
+    return queryset.extra(where=["EXISTS (SELECT 1 FROM %s WHERE %s.%s = %s.%s "
+        "AND %s.%s = %%s AND %s.%s = %%s)" % (table,
+        table, qn(opts.get_field("object_id").column),
+        qn(model._meta.db_table), qn(model._meta.pk.column),
+        table, qn(opts.get_field("content_type").column),
+        table, qn(opts.get_field("tag").column))],
+        params=[get_content_type(model).pk, tag.pk])
+
 def tagged_object_list(request, slug, queryset, **kwargs):
+    """
+    Lists the objects of ``queryset`` tagged with the tag ``slug``, with the
+    ``object_list`` generic view, which takes the other arguments.  The tag
+    is in the context as ``tag``.
+
+    With ``cursor_paginate_by`` the objects are paginated in order of their
+    primary key, and a page starts after the object whose key is given in
+    the ``after`` parameter of the query string, so deep pages cost the same
+    as the first.  The page's template gets ``object_list``, ``has_next``
+    and ``next_cursor``, the value of ``after`` for the next page.
+    """
     if callable(queryset):
         queryset = queryset()
-    tag = get_object_or_404(Tag, slug=slug)
-    qs = queryset.filter(pk__in=TaggedItem.objects.filter(
-        tag=tag, content_type=ContentType.objects.get_for_model(queryset.model)
-    ).values_list("object_id", flat=True))
+    try:
+        tag = Tag.objects.get_by_slug(slug)
+    except Tag.DoesNotExist:
+        raise Http404("No tag with the slug %r." % slug)
+    qs = tagged_objects(queryset, tag)
     if "extra_context" not in kwargs:
         kwargs["extra_context"] = {}
     kwargs["extra_context"]["tag"] = tag
+    paginate_by = kwargs.pop("cursor_paginate_by", None)
+    if paginate_by:
+        return cursor_object_list(request, qs, paginate_by, **kwargs)
     return object_list(request, qs, **kwargs)
+
+def cursor_object_list(request, queryset, paginate_by, template_name=None,
+    template_object_name="object", extra_context=None,
+    context_processors=None, mimetype=None, **kwargs):
+    model = queryset.model
+    qs = queryset.order_by("pk")
+    after = request.GET.get("after")
+    if after:
+        try:
+            qs = qs.filter(pk__gt=model._meta.pk.to_python(after))
+        except (ValueError, ValidationError):
+            raise Http404("Invalid cursor %r." % after)
+    objects = list(qs[:paginate_by + 1])
+    has_next = len(objects) > paginate_by
+    objects = objects[:paginate_by]
+    next_cursor = None
+    if has_next:
+        next_cursor = objects[-1].pk
+    context = {
+        "%s_list" % template_object_name: objects,
+        "object_list": objects,
+        "has_next": has_next,
+        "next_cursor": next_cursor,
+    }
+    for key, value in (extra_context or {}).items():
+        if callable(value):
+            value = value()
+        context[key] = value
+    if not template_name:
+        template_name = "%s/%s_list.html" % (model._meta.app_label,
+            model._meta.object_name.lower())
+    return render_to_response(template_name, context,
+        context_instance=RequestContext(request, processors=context_processors),
+        mimetype=mimetype)